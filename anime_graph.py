@@ -9,13 +9,45 @@ and its related function implementations.
 """
 from __future__ import annotations
 
-from typing import Union, Optional, Any, Callable
+import sys
+from typing import Union, Optional, Any, Callable, Iterable
 from datetime import datetime
 import networkx as nx
+import numpy as np
+
+import instrumentation
+from anime_metadata import AnimeMetadataStore
+from genre_affinity import GenreAffinity
+from id_interning import IdMap, save_id_maps, load_id_maps
+from sparse_graph import SparseAnimeGraph, csr_from_rows
+from graph_sampling import sample_subgraph
+from minhash_lsh import MinHashLSH
+from top_k import top_k, top_k_indices, top_k_keys
 
 
 class Vertex:
-    """Abstract class for a vertex in the graph"""
+    """Abstract class for a vertex in the graph.
+
+    Vertices declare __slots__ instead of having a per-instance __dict__, since the graph
+    holds tens of thousands of them.
+
+    Vertices are hashed on every dictionary lookup of the similarity loops, so the hash value
+    of the key of a vertex is computed once, when the vertex is created.
+
+    Class Attributes:
+        - kind: The kind of the vertex: 'user', 'anime' or 'genre'.
+
+    Instance Attributes:
+        - vid: The dense integer id of the vertex among the vertices of its kind in the graph,
+        as assigned by the id maps of the graph, or -1 if the vertex has not been added to a
+        graph.
+    """
+    __slots__ = ('vid', '_hash')
+
+    kind: str = ''
+    vid: int
+    _hash: int
+
     def adjacent(self, v: Vertex) -> bool:
         """Returns whether v is adjacent to self"""
         raise NotImplementedError
@@ -34,11 +66,17 @@ class User(Vertex):
         - birth_year: An int or None. The birth year of the user. We only takes the
         birth year into account right now for simplicity, since the birth year matter the most
         in determining age-related similarities between user.
+        - version: The number of times the reviews of this user changed. Results computed
+        from the state of this user are only valid for the same version.
     """
+    __slots__ = ('username', 'gender', 'birth_year', 'version', 'neighbor_anime',
+                 'neighbor_genres')
+    kind = 'user'
 
     username: str
     gender: Optional[str]
     birth_year: Optional[int]
+    version: int
 
     neighbor_anime: dict[Anime, Union[int, float]]
     neighbor_genres: dict[Genre, Union[int, float]]
@@ -46,10 +84,13 @@ class User(Vertex):
     def __init__(self, username: str, gender: Optional[str],
                  birth_year: Optional[int]) -> None:
         """Initialize an user vertex"""
+        self.vid = -1
         self.username = username
-        self.gender = gender
+        self._hash = hash(username)
+        # There are only a few distinct genders, so all users share the same string objects.
+        self.gender = sys.intern(gender) if gender is not None else None
         self.birth_year = birth_year
-        # self.favorites_anime = favorites_anime if favorites_anime is not None else set()
+        self.version = 0
 
         self.neighbor_anime = {}
         self.neighbor_genres = {}
@@ -60,11 +101,15 @@ class User(Vertex):
 
     def __hash__(self) -> int:
         """Returns the hash value of this user."""
-        return hash(self.username)
+        return self._hash
 
     def __eq__(self, other: Vertex) -> bool:
         """Returns whether this vertex is equal to another vertex."""
-        if not isinstance(other, Vertex):
+        if self is other:
+            return True
+        elif type(other) is User:
+            return self.username == other.username
+        elif not isinstance(other, Vertex):
             raise TypeError(f'Equality is undefined between instances '
                             f'of {type(self)} and {type(other)}')
         elif isinstance(other, User):
@@ -85,64 +130,68 @@ class User(Vertex):
         else:
             return 0
 
-    def most_similar_users(self, limit: int = 50) -> list[User]:
+    def most_similar_users(self, limit: int = 50,
+                           stop: Optional[Callable[[], bool]] = None) -> list[User]:
         """Returns a list tuples of most similar users, up to a limit, based on user reviews.
         Each tuple takes the form (a, b), where a is the User object, and b is the similarity
         score.
+        stop is checked before each reviewed anime: once it returns True, the search is
+        abandoned and the returned list is incomplete.
         """
         # Accumulator:
         similarity_map = {}
-        for anime in self.neighbor_anime:
-            for other in anime.neighbor_users:
+        for anime, own_score in self.neighbor_anime.items():
+            if stop is not None and stop():
+                break
+            # anime.neighbor_users[other] is other's score, so no lookup in other is needed.
+            for other, other_score in anime.neighbor_users.items():
                 if other is not self:
-                    difference = abs(self.neighbor_anime[anime] - other.neighbor_anime[anime])
-                    value_to_add = 5.5 - difference  # Negative when difference > 5.5
-                    if other in similarity_map:
-                        similarity_map[other] += value_to_add
-                    else:
-                        similarity_map[other] = value_to_add
-        resulting_list = [(user, similarity_map[user]) for user in similarity_map if
-                          similarity_map[user] > 0]
-        resulting_list.sort(key=lambda x: x[1], reverse=True)
-
-        return [tup[0] for tup in resulting_list[:limit]]
-
-    def closest_jaccard_distance_users(self, limit: int = 50) -> list[User]:
+                    value_to_add = 5.5 - abs(own_score - other_score)  # Negative when > 5.5
+                    similarity_map[other] = similarity_map.get(other, 0) + value_to_add
+        instrumentation.count('users_compared', len(similarity_map))
+        with instrumentation.span('user.sort_similar_users'):
+            # The positive similarities come first, so filtering the top users is enough.
+            return [user for user in top_k_keys(similarity_map, limit)
+                    if similarity_map[user] > 0]
+
+    def closest_jaccard_distance_users(self, limit: int = 50,
+                                       stop: Optional[Callable[[], bool]] = None) \
+            -> list[User]:
         """Returns a list tuples of most similar users, measured by the jaccard distance,
         up to a limit, based on user reviews.
         Each tuple takes the form (a, b), where a is the User object, and b is the similarity
         score.
+        stop is checked before each reviewed anime, as in most_similar_users.
         """
         # Accumulator:
         similarity_map = {}
-        for anime in self.neighbor_anime:
-            for other in anime.neighbor_users:
+        for anime, own_score in self.neighbor_anime.items():
+            if stop is not None and stop():
+                break
+            for other, other_score in anime.neighbor_users.items():
                 if other is not self and other in similarity_map:
                     # [0] is strictly equal weight common anime count
                     # [1] is common anime count
-                    similarity_map[other][0] += \
-                        int(self.neighbor_anime[anime] == other.neighbor_anime[anime])
-                    similarity_map[other][1] += 1
+                    counts = similarity_map[other]
+                    counts[0] += int(own_score == other_score)
+                    counts[1] += 1
                 elif other is not self:
-                    similarity_map[other] = \
-                        [int(self.neighbor_anime[anime] == other.neighbor_anime[anime]), 1]
-        return self._generate_jaccard_sorted_list(similarity_map, limit)
+                    similarity_map[other] = [int(own_score == other_score), 1]
+        instrumentation.count('users_compared', len(similarity_map))
+        with instrumentation.span('user.sort_similar_users'):
+            return self._generate_jaccard_sorted_list(similarity_map, limit)
 
     def _generate_jaccard_sorted_list(self, similarity_map: dict, limit: int) -> list[User]:
         """Returns a sorted list of users sorted by jaccard similarities, given the mapping of
         users to their corresponding cardinalities of the intersection and the union of the sets
         of neighbor animes.
         """
-        resulting_list = []
-        for user in similarity_map:
-            total_neighbors = len(self.neighbor_anime) + len(user.neighbor_anime)
-            similarity = _jaccard_similarity(total_neighbors,
-                                             similarity_map[user][1],
-                                             similarity_map[user][0])
-            resulting_list.append((user, similarity))
-        resulting_list.sort(key=lambda x: x[1], reverse=True)
-
-        return [tup[0] for tup in resulting_list[:limit]]
+        users = list(similarity_map)
+        similarities = np.fromiter(
+            (_jaccard_similarity(len(self.neighbor_anime) + len(user.neighbor_anime),
+                                 similarity_map[user][1], similarity_map[user][0])
+             for user in users), np.float64, len(users))
+        return [users[i] for i in top_k_indices(similarities, limit).tolist()]
 
     def best_liked_genres(self, limit: int = 5) -> list[tuple[Genre, float]]:
         """Returns a list tuples (a, b), where a is the genre the user like and b is the
@@ -154,8 +203,7 @@ class User(Vertex):
         if len(liked_list) <= limit:
             return liked_list
         else:
-            liked_list.sort(key=lambda x: x[1], reverse=True)
-            return liked_list[:limit]
+            return top_k(liked_list, limit, key=lambda x: x[1])
 
 
 class Anime(Vertex):
@@ -165,52 +213,88 @@ class Anime(Vertex):
         - uid: The unique numeric id of the anime.
         - title: The title of the anime.
         - synopsis: A paragraph description of the anime.
+        - aired_date: The date the anime was first aired. Stored as an ordinal (aired_ordinal).
         - total_episodes: The number of episodes of the anime.
         - popularity: The ranking in popularity. The lower the number, the higher the rank.
         - rank: MyAnimeList ranking
         - score: MyAnimeList score
+        - image_url: The url of the cover image of the anime.
+
+    Only the attributes used by the recommenders are kept in the vertex. The synopsis,
+    total_episodes, rank and image_url are fetched from the anime metadata store on demand.
     """
 
+    __slots__ = ('uid', 'title', 'aired_ordinal', 'popularity', 'score',
+                 'neighbor_genres', 'neighbor_users', '_metadata')
+    kind = 'anime'
+
     uid: int
     title: str
-    synopsis: str
-    aired_date: datetime
-    total_episodes: int
+    aired_ordinal: int
     popularity: Optional[int]
-    rank: Optional[int]
     score: Optional[float]
-    image_url: str
 
     neighbor_genres: set  # The set of Genres
     neighbor_users: dict[User, Union[float, int]]
 
-    def __init__(self, uid: int, title: str, synopsis: str, aired_date: datetime,
-                 total_episodes: int, popularity: Optional[int],
-                 rank: Optional[int], score: Optional[int], image_url: str) -> None:
-        """Initializer"""
+    _metadata: AnimeMetadataStore
+
+    def __init__(self, uid: int, title: str, aired_date: datetime, popularity: Optional[int],
+                 score: Optional[int], metadata: AnimeMetadataStore) -> None:
+        """Initializer.
+        The remaining fields of the anime are looked up in metadata when needed.
+        """
+        self.vid = -1
         self.uid = uid
+        self._hash = hash(uid)
         self.title = title
-        self.total_episodes = total_episodes
         self.popularity = popularity
-        self.rank = rank
         self.score = score
-        self.synopsis = synopsis
-        self.aired_date = aired_date
-        self.image_url = image_url
+        self._metadata = metadata
+        self.aired_ordinal = aired_date.toordinal()
         self.neighbor_genres = set()
         self.neighbor_users = {}
 
+    @property
+    def aired_date(self) -> datetime:
+        """Returns the date the anime was first aired."""
+        return datetime.fromordinal(self.aired_ordinal)
+
+    @property
+    def synopsis(self) -> str:
+        """Returns the synopsis of the anime."""
+        return self._metadata.get(self.uid)[0]
+
+    @property
+    def total_episodes(self) -> int:
+        """Returns the number of episodes of the anime."""
+        return self._metadata.get(self.uid)[1]
+
+    @property
+    def rank(self) -> Optional[int]:
+        """Returns the MyAnimeList ranking of the anime."""
+        return self._metadata.get(self.uid)[2]
+
+    @property
+    def image_url(self) -> str:
+        """Returns the url of the cover image of the anime."""
+        return self._metadata.get(self.uid)[3]
+
     def __str__(self) -> str:
         """Returns the title of the anime."""
         return self.title
 
     def __hash__(self) -> int:
-        """Returns the hash value of this user."""
-        return hash(self.uid)
+        """Returns the hash value of this anime."""
+        return self._hash
 
     def __eq__(self, other: Vertex) -> bool:
         """Returns whether this vertex is equal to another vertex."""
-        if not isinstance(other, Vertex):
+        if self is other:
+            return True
+        elif type(other) is Anime:
+            return self.uid == other.uid
+        elif not isinstance(other, Vertex):
             raise TypeError(f'Equality is undefined between instances '
                             f'of {type(self)} and {type(other)}')
         elif isinstance(other, Anime):
@@ -235,13 +319,17 @@ class Anime(Vertex):
 
 class Genre(Vertex):
     """A genre in the anime categorization system"""
+    __slots__ = ('genre_name', 'neighbor_anime', 'neighbor_users')
+    kind = 'genre'
 
     genre_name: str
     neighbor_anime: set[Anime]  # The set of anime IDs in this genre
     neighbor_users: dict[User, Union[float, int]]
 
     def __init__(self, name: str) -> None:
-        self.genre_name = name
+        self.vid = -1
+        self.genre_name = sys.intern(name)
+        self._hash = hash(self.genre_name)
         self.neighbor_anime = set()
         self.neighbor_users = {}
 
@@ -250,12 +338,16 @@ class Genre(Vertex):
         return self.genre_name
 
     def __hash__(self) -> int:
-        """Returns the hash value of this user."""
-        return hash(self.genre_name)
+        """Returns the hash value of this genre."""
+        return self._hash
 
     def __eq__(self, other: Vertex) -> bool:
         """Returns whether this vertex is equal to another vertex."""
-        if not isinstance(other, Vertex):
+        if self is other:
+            return True
+        elif type(other) is Genre:
+            return self.genre_name == other.genre_name
+        elif not isinstance(other, Vertex):
             raise TypeError(f'Equality is undefined between instances '
                             f'of {type(self)} and {type(other)}')
         elif isinstance(other, Genre):
@@ -281,34 +373,63 @@ class AnimeGraph:
     """A weighted graph, consisting of Anime, Users and Genres.
 
     Instance Attributes:
-        -
+        - users: A mapping of usernames to the users in the graph.
+        - genres: A mapping of genre names to the genres in the graph.
+        - anime: A mapping of anime uids to the anime in the graph.
+        - metadata: The store of the heavy fields of the anime.
+        - user_ids: The id map of usernames to the dense integer ids of the users.
+        - anime_ids: The id map of anime uids to the dense integer ids of the anime.
+        - genre_ids: The id map of genre names to the dense integer ids of the genres.
+        - lsh_index: The MinHash LSH index of the users, used by the 'approximate jaccard
+        distance' measure, or None if it has not been built yet.
+        - affinity: The maintenance of the weights of the user-genre edges. Set its half_life
+        to make older reviews count less.
     """
 
     users: dict[str, User]
     genres: dict[str, Genre]
     anime: dict[int, Anime]
+    metadata: AnimeMetadataStore
+    user_ids: IdMap
+    anime_ids: IdMap
+    genre_ids: IdMap
+    lsh_index: Optional[MinHashLSH]
+    affinity: GenreAffinity
     _anime_name_map: dict[str, Anime]
 
-    def __init__(self) -> None:
-        """Initialize an instance of the AnimeGraph class"""
+    def __init__(self, metadata: Optional[AnimeMetadataStore] = None) -> None:
+        """Initialize an instance of the AnimeGraph class.
+        metadata is the store of the heavy fields of the anime. If it is not given, an
+        in-memory store is used.
+        """
         self.users = {}
         self.anime = {}
         self.genres = {}
+        self.metadata = metadata if metadata is not None else AnimeMetadataStore()
+        self.user_ids = IdMap()
+        self.anime_ids = IdMap()
+        self.genre_ids = IdMap()
+        self.lsh_index = None
+        self.affinity = GenreAffinity()
         self._anime_name_map = {}
 
     def __contains__(self, item: Any) -> bool:
         """Return whether a vertex is in the graph."""
         return item in self.anime or item in self.users or item in self.genres
 
-    def add_anime(self, uid: int, title: str, synopsis: str, aired_date: datetime,
-                  total_episodes: int, popularity: Optional[int],
-                  rank: Optional[int], score: Optional[int], image_url: str) -> None:
+    def add_anime(self, uid: int, title: str, synopsis: Optional[str], aired_date: datetime,
+                  total_episodes: Optional[int], popularity: Optional[int],
+                  rank: Optional[int], score: Optional[int], image_url: Optional[str]) -> None:
         """Add a new Anime to the graph.
-        If the Anime is already in the graph, does nothing."""
+        If the Anime is already in the graph, does nothing.
+        If synopsis is None, the heavy fields of the anime (synopsis, total_episodes, rank and
+        image_url) must already be in self.metadata. Otherwise, they are kept in memory."""
 
         if uid not in self.anime:
-            new_anime = Anime(uid, title, synopsis, aired_date, total_episodes,
-                              popularity, rank, score, image_url)
+            if synopsis is not None:
+                self.metadata.put(uid, synopsis, total_episodes, rank, image_url)
+            new_anime = Anime(uid, title, aired_date, popularity, score, self.metadata)
+            new_anime.vid = self.anime_ids.intern(uid)
             self.anime[uid] = new_anime
             self._anime_name_map[title] = new_anime
 
@@ -320,6 +441,7 @@ class AnimeGraph:
             - genre_name not in self._genres
         """
         new_genre = Genre(genre_name)
+        new_genre.vid = self.genre_ids.intern(genre_name)
         self.genres[genre_name] = new_genre
 
     def add_user(self, username: str, gender: Optional[str],
@@ -329,31 +451,59 @@ class AnimeGraph:
 
         if username not in self.users:
             new_user = User(username, gender, birth_year)
+            new_user.vid = self.user_ids.intern(username)
             self.users[username] = new_user
 
-    def add_review(self, username: str, anime_uid: int, score: Union[int, float]) -> None:
+    def add_review(self, username: str, anime_uid: int, score: Union[int, float],
+                   timestamp: Optional[float] = None) -> None:
         """Add a review to the graph by establishing a weighted edge between
         an anime and a user.
         This function also establish weighted edges between the user and the related genres.
         If there is already an edge between the user and the given genre, the weight will change
-        based on the score."""
+        based on the score. If the user already reviewed the anime, the new review replaces
+        the old one, in the genre weights too.
+        timestamp is the time of the review, in seconds since the epoch, which is only used if
+        reviews decay. It defaults to now.
+        The version of the user is bumped."""
 
         if username in self.users and anime_uid in self.anime:
             user = self.users[username]
             anime = self.anime[anime_uid]
 
+            user.version += 1
+            old_score = user.neighbor_anime.get(anime)
             user.neighbor_anime[anime] = score
             anime.neighbor_users[user] = score
-
-            for genre in anime.neighbor_genres:
-
-                deviation = score - 5.5
-                if genre in user.neighbor_genres:
-                    user.neighbor_genres[genre] += deviation
-                    genre.neighbor_users[user] += deviation
-                else:
-                    user.neighbor_genres[genre] = deviation
-                    genre.neighbor_users[user] = deviation
+            self.affinity.apply_review(user, anime, old_score, score, timestamp)
+
+            if self.lsh_index is not None:
+                self.lsh_index.update(user)
+
+    def add_reviews(self, reviews: Iterable[tuple[str, int, Union[int, float],
+                                                  Optional[float]]]) -> list[User]:
+        """Add the given reviews, as tuples (username, anime_uid, score, timestamp), in order,
+        as in add_review. Returns the list of the users whose reviews changed, without
+        duplicates. Reviews of users or anime that are not in the graph are skipped.
+        The LSH index is updated once per user at the end, rather than once per review."""
+        changed = {}
+        lsh_index, self.lsh_index = self.lsh_index, None
+        try:
+            for username, anime_uid, score, timestamp in reviews:
+                if username in self.users and anime_uid in self.anime:
+                    self.add_review(username, anime_uid, score, timestamp)
+                    changed[self.users[username]] = None
+        finally:
+            self.lsh_index = lsh_index
+        if lsh_index is not None:
+            for user in changed:
+                lsh_index.update(user)
+        return list(changed)
+
+    def recompute_genre_affinities(self, now: Optional[float] = None) -> int:
+        """Recompute the weights of the user-genre edges from the reviews, as of now if the
+        reviews decay, and returns the number of users whose weights changed.
+        See GenreAffinity.recompute."""
+        return self.affinity.recompute(self, now)
 
     def add_anime_genre_edge(self, anime_uid: int, genre_name: str) -> None:
         """Add an anime-genre edge to the graph."""
@@ -368,25 +518,79 @@ class AnimeGraph:
 
     def most_similar_users(self, user: User,
                            distant_measure: Union[Callable[[User, User], float], str] = 'custom',
-                           limit: int = 50) -> list[User]:
+                           limit: int = 50,
+                           stop: Optional[Callable[[], bool]] = None) -> list[User]:
         """Return a list of users most similar to the given user.
+        stop is checked as the search goes: once it returns True, the search is abandoned and
+        the returned list is incomplete.
         Preconditions:
             - user.username in self.users
         """
         compared_so_far = []
         if distant_measure == 'custom':
             # Using my self-invented measure of similarity
-            return user.most_similar_users(limit)
+            return user.most_similar_users(limit, stop)
         elif distant_measure == 'graph-based jaccard distance':
-            return user.closest_jaccard_distance_users(limit)
+            return user.closest_jaccard_distance_users(limit, stop)
+        elif distant_measure == 'approximate jaccard distance':
+            # Candidates come from the MinHash LSH index, and only they are compared exactly.
+            self.build_lsh_index()
+            return self.lsh_index.most_similar_users(user, limit, stop)
+
+        with instrumentation.span('graph.distance_measure'):
+            for other in self.users.values():
+                if stop is not None and stop():
+                    break
+                if other is not user:
+                    compared_so_far.append((other, distant_measure(user, other)))
+        instrumentation.count('pairwise_comparisons', len(compared_so_far))
+        instrumentation.count('users_compared', len(compared_so_far))
+        with instrumentation.span('graph.sort_similar_users'):
+            # The distant_measure is the opposite of similarity, so the smallest come first.
+            distances = np.fromiter((tup[1] for tup in compared_so_far), np.float64,
+                                    len(compared_so_far))
+            return [compared_so_far[i][0]
+                    for i in top_k_indices(distances, limit, largest=False).tolist()]
+
+    def build_lsh_index(self) -> MinHashLSH:
+        """Build the MinHash LSH index of the users if it has not been built yet, and return
+        it. Once built, it is kept up to date by add_review."""
+        if self.lsh_index is None:
+            self.lsh_index = MinHashLSH()
+            self.lsh_index.index_graph(self)
+        return self.lsh_index
+
+    def user_by_id(self, vid: int) -> Optional[User]:
+        """Returns the user with the given dense id, or None if it is not in the graph."""
+        return self.users.get(self.user_ids.key_of(vid)) if 0 <= vid < len(self.user_ids) \
+            else None
+
+    def anime_by_id(self, vid: int) -> Optional[Anime]:
+        """Returns the anime with the given dense id, or None if it is not in the graph."""
+        return self.anime.get(self.anime_ids.key_of(vid)) if 0 <= vid < len(self.anime_ids) \
+            else None
+
+    def genre_by_id(self, vid: int) -> Optional[Genre]:
+        """Returns the genre with the given dense id, or None if it is not in the graph."""
+        return self.genres.get(self.genre_ids.key_of(vid)) if 0 <= vid < len(self.genre_ids) \
+            else None
+
+    def save_id_maps(self, filepath: str) -> None:
+        """Save the id maps of the users, anime and genres of this graph to a file."""
+        save_id_maps({'users': self.user_ids, 'anime': self.anime_ids,
+                      'genres': self.genre_ids}, filepath)
+
+    def load_id_maps(self, filepath: str) -> None:
+        """Load the id maps saved in the given file, so that the vertices added from now on get
+        the same ids as in the graph the file was saved from.
 
-        for other in self.users.values():
-            if other is not user:
-                compared_so_far.append((other, distant_measure(user, other)))
-        # The distant_measure is the opposite of similarity, so we don't have to reverse the
-        # sorting order.
-        compared_so_far.sort(key=lambda x: x[1])
-        return [tup[0] for tup in compared_so_far[:limit]]
+        Preconditions:
+            - self.users == {} and self.anime == {} and self.genres == {}
+        """
+        id_maps = load_id_maps(filepath)
+        self.user_ids = id_maps['users']
+        self.anime_ids = id_maps['anime']
+        self.genre_ids = id_maps['genres']
 
     def fetch_anime_by_name(self, name: str) -> Optional[Anime]:
         """Returns an anime in the system.
@@ -399,20 +603,16 @@ class AnimeGraph:
     def fetch_new_anime(self, limit: int = 10) -> list[Anime]:
         """Returns a list of newly released anime, up to a limit."""
         res = list(self.anime.values())
-        res.sort(key=lambda anime: anime.aired_date, reverse=True)
-        return res[:limit]
+        aired = np.fromiter((anime.aired_ordinal for anime in res), np.int64, len(res))
+        return [res[i] for i in top_k_indices(aired, limit).tolist()]
 
     def fetch_popular_anime(self, limit: int = 10) -> list[Anime]:
         """Returns a list of most popular anime."""
-        res = list(self.anime.values())
-        res.sort(key=lambda anime: anime.popularity)
-        return res[:limit]
+        return _most_popular(list(self.anime.values()), limit)
 
     def fetch_popular_by_genre(self, genre: str, limit: int = 10) -> list[Anime]:
         """Returns a list of most popular anime of a given genre, up to a limit."""
-        res = list(self.genres[genre].neighbor_anime)
-        res.sort(key=lambda anime: anime.popularity)
-        return res[:limit]
+        return _most_popular(list(self.genres[genre].neighbor_anime), limit)
 
     def fetch_all_genres(self) -> list[str]:
         """Return the list of all anime genres."""
@@ -422,14 +622,200 @@ class AnimeGraph:
         """Return a list of all anime names."""
         return list(self._anime_name_map.keys())
 
-    def to_networkx(self, max_vertices: int = 10000) -> nx.Graph:
+    def to_sparse(self) -> SparseAnimeGraph:
+        """Convert this graph into sparse matrices indexed by the dense ids of the vertices:
+        the users × anime review scores, the same scores by anime, the anime × genres
+        membership and the users × genres liking scores. The rows keep the order of the
+        neighbors, so from_sparse gives back the same graph.
+        """
+        users = list(self.users.values())
+        anime = list(self.anime.values())
+        user_vids = np.fromiter((user.vid for user in users), np.int64, len(users))
+        anime_vids = np.fromiter((ani.vid for ani in anime), np.int64, len(anime))
+
+        # Each matrix is built from the neighbor dictionaries in a single pass over them.
+        lengths = np.fromiter((len(user.neighbor_anime) for user in users), np.int64, len(users))
+        total = int(lengths.sum())
+        ratings = csr_from_rows(
+            user_vids, lengths,
+            np.fromiter((ani.vid for user in users for ani in user.neighbor_anime),
+                        np.int64, total),
+            np.fromiter((score for user in users for score in user.neighbor_anime.values()),
+                        np.float32, total),
+            (len(self.user_ids), len(self.anime_ids)))
+        lengths = np.fromiter((len(ani.neighbor_users) for ani in anime), np.int64, len(anime))
+        ratings_by_anime = csr_from_rows(
+            anime_vids, lengths,
+            np.fromiter((user.vid for ani in anime for user in ani.neighbor_users),
+                        np.int64, total),
+            np.fromiter((score for ani in anime for score in ani.neighbor_users.values()),
+                        np.float32, total),
+            (len(self.anime_ids), len(self.user_ids)))
+
+        lengths = np.fromiter((len(ani.neighbor_genres) for ani in anime), np.int64, len(anime))
+        total = int(lengths.sum())
+        membership = csr_from_rows(
+            anime_vids, lengths,
+            np.fromiter((genre.vid for ani in anime for genre in ani.neighbor_genres),
+                        np.int64, total),
+            np.ones(total, np.float32),
+            (len(self.anime_ids), len(self.genre_ids)))
+
+        lengths = np.fromiter((len(user.neighbor_genres) for user in users), np.int64,
+                              len(users))
+        total = int(lengths.sum())
+        affinity = csr_from_rows(
+            user_vids, lengths,
+            np.fromiter((genre.vid for user in users for genre in user.neighbor_genres),
+                        np.int64, total),
+            np.fromiter((value for user in users for value in user.neighbor_genres.values()),
+                        np.float64, total),
+            (len(self.user_ids), len(self.genre_ids)))
+
+        user_attributes = [None] * len(self.user_ids)
+        for user in users:
+            user_attributes[user.vid] = (user.gender, user.birth_year)
+        anime_attributes = [None] * len(self.anime_ids)
+        for ani in anime:
+            anime_attributes[ani.vid] = (ani.title, ani.aired_ordinal, ani.popularity, ani.score)
+        genre_present = np.zeros(len(self.genre_ids), bool)
+        genre_present[[genre.vid for genre in self.genres.values()]] = True
+
+        return SparseAnimeGraph((ratings, ratings_by_anime), membership, affinity,
+                                (self.user_ids, self.anime_ids, self.genre_ids),
+                                user_attributes, anime_attributes, genre_present)
+
+    @staticmethod
+    def from_sparse(sparse_graph: SparseAnimeGraph,
+                    metadata: Optional[AnimeMetadataStore] = None) -> AnimeGraph:
+        """Returns the AnimeGraph represented by the given sparse graph. The vertices keep their
+        dense ids, and the neighbors of each vertex keep the order of its row, which is their
+        order in the graph it was converted from, so the recommendations are the same.
+        metadata is the store of the heavy fields of the anime. The sparse graph does not hold
+        them, so without it, the heavy fields (synopsis, total_episodes, rank and
+        image_url) of the anime are dropped.
+        """
+        graph = AnimeGraph(metadata)
+        graph.user_ids = IdMap(sparse_graph.user_ids.keys())
+        graph.anime_ids = IdMap(sparse_graph.anime_ids.keys())
+        graph.genre_ids = IdMap(sparse_graph.genre_ids.keys())
+
+        anime_by_vid = [None] * len(graph.anime_ids)
+        for vid, attributes in enumerate(sparse_graph.anime_attributes):
+            if attributes is not None:
+                uid = graph.anime_ids.key_of(vid)
+                title, aired_ordinal, popularity, score = attributes
+                graph.add_anime(uid, title, None, datetime.fromordinal(aired_ordinal), None,
+                                popularity, None, score, None)
+                anime_by_vid[vid] = graph.anime[uid]
+        genre_by_vid = [None] * len(graph.genre_ids)
+        for vid in np.flatnonzero(sparse_graph.genre_present).tolist():
+            graph._add_genre(graph.genre_ids.key_of(vid))
+            genre_by_vid[vid] = graph.genres[graph.genre_ids.key_of(vid)]
+        user_by_vid = [None] * len(graph.user_ids)
+        for vid, attributes in enumerate(sparse_graph.user_attributes):
+            if attributes is not None:
+                username = graph.user_ids.key_of(vid)
+                graph.add_user(username, *attributes)
+                user_by_vid[vid] = graph.users[username]
+
+        membership = sparse_graph.membership
+        for vid, anime in enumerate(anime_by_vid):
+            if anime is not None:
+                for genre_vid in membership.indices[membership.indptr[vid]:
+                                                    membership.indptr[vid + 1]].tolist():
+                    anime.neighbor_genres.add(genre_by_vid[genre_vid])
+                    genre_by_vid[genre_vid].neighbor_anime.add(anime)
+
+        # Each side of the review edges is filled from its own matrix, in its own order.
+        ratings = sparse_graph.ratings
+        affinity = sparse_graph.affinity
+        for vid, user in enumerate(user_by_vid):
+            if user is not None:
+                start, end = ratings.indptr[vid], ratings.indptr[vid + 1]
+                for anime_vid, score in zip(ratings.indices[start:end].tolist(),
+                                            ratings.data[start:end].tolist()):
+                    user.neighbor_anime[anime_by_vid[anime_vid]] = score
+                start, end = affinity.indptr[vid], affinity.indptr[vid + 1]
+                for genre_vid, value in zip(affinity.indices[start:end].tolist(),
+                                            affinity.data[start:end].tolist()):
+                    user.neighbor_genres[genre_by_vid[genre_vid]] = value
+                    genre_by_vid[genre_vid].neighbor_users[user] = value
+        ratings = sparse_graph.ratings_by_anime
+        for vid, anime in enumerate(anime_by_vid):
+            if anime is not None:
+                start, end = ratings.indptr[vid], ratings.indptr[vid + 1]
+                for user_vid, score in zip(ratings.indices[start:end].tolist(),
+                                           ratings.data[start:end].tolist()):
+                    anime.neighbor_users[user_by_vid[user_vid]] = score
+        return graph
+
+    def copy(self) -> AnimeGraph:
+        """Returns a copy of this graph that can be mutated without changing this graph.
+        The vertices keep their dense ids and versions. The metadata store is shared, since
+        the heavy fields of an anime never change. The LSH index, if it was built, is copied
+        to refer to the vertices of the copy.
+        """
+        graph = AnimeGraph(self.metadata)
+        graph.user_ids = self.user_ids.copy()
+        graph.anime_ids = self.anime_ids.copy()
+        graph.genre_ids = self.genre_ids.copy()
+        graph.affinity = self.affinity.copy()
+
+        for uid, anime in self.anime.items():
+            new_anime = Anime(uid, anime.title, anime.aired_date, anime.popularity, anime.score,
+                              self.metadata)
+            new_anime.vid = anime.vid
+            graph.anime[uid] = new_anime
+        graph._anime_name_map = {title: graph.anime[anime.uid]
+                                 for title, anime in self._anime_name_map.items()}
+        for name, genre in self.genres.items():
+            graph.genres[name] = Genre(name)
+            graph.genres[name].vid = genre.vid
+        for username, user in self.users.items():
+            new_user = User(username, user.gender, user.birth_year)
+            new_user.vid = user.vid
+            new_user.version = user.version
+            graph.users[username] = new_user
+
+        # Each adjacency is copied from its own dictionary or set, so that the copy iterates
+        # the neighbors in the same order and breaks ties the same way.
+        users, anime_by_uid, genres = graph.users, graph.anime, graph.genres
+        for uid, anime in self.anime.items():
+            new_anime = anime_by_uid[uid]
+            new_anime.neighbor_genres = {genres[g.genre_name] for g in anime.neighbor_genres}
+            new_anime.neighbor_users = {users[u.username]: score
+                                        for u, score in anime.neighbor_users.items()}
+        for name, genre in self.genres.items():
+            new_genre = genres[name]
+            new_genre.neighbor_anime = {anime_by_uid[a.uid] for a in genre.neighbor_anime}
+            new_genre.neighbor_users = {users[u.username]: value
+                                        for u, value in genre.neighbor_users.items()}
+        for username, user in self.users.items():
+            new_user = users[username]
+            new_user.neighbor_anime = {anime_by_uid[a.uid]: score
+                                       for a, score in user.neighbor_anime.items()}
+            new_user.neighbor_genres = {genres[g.genre_name]: value
+                                        for g, value in user.neighbor_genres.items()}
+        if self.lsh_index is not None:
+            graph.lsh_index = self.lsh_index.copy(users)
+        return graph
+
+    def to_networkx(self, max_vertices: int = 10000, sampling: str = 'greedy',
+                    seed: Optional[int] = None) -> nx.Graph:
         """Convert this graph into a networkx Graph.
 
         max_vertices specifies the maximum number of vertices that can appear in the graph.
         (This is necessary to limit the visualization output for large graphs.)
 
-        Note that this method is provided for you, and you shouldn't change it.
+        sampling specifies how the vertices are chosen:
+            - 'greedy': anime in insertion order, each with its genres and at most 100 users.
+            - 'random_walk', 'forest_fire' or 'stratified': a representative sample of the
+            graph, as described in the graph_sampling module. seed makes it reproducible.
         """
+        if sampling != 'greedy':
+            return sample_subgraph(self, max_vertices, sampling, seed)
+
         # An anime may has a very large number of linked users.
         max_neighbor_users = 100
         graph_nx = nx.Graph()
@@ -456,6 +842,13 @@ class AnimeGraph:
 
 
 # HELPER FUNCTION
+def _most_popular(anime: list[Anime], limit: int) -> list[Anime]:
+    """Returns the given anime with the best popularity ranks, up to a limit, ties in the
+    given order."""
+    popularity = np.fromiter((a.popularity for a in anime), np.int64, len(anime))
+    return [anime[i] for i in top_k_indices(popularity, limit, largest=False).tolist()]
+
+
 def _jaccard_similarity(total: int, common_count: int, strict_common_count: int) -> float:
     """Returns the jaccard similarity between two sets of vertices, given the common neighbor
     count and the strictly equal edge weight common neighbor count.
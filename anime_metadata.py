@@ -0,0 +1,185 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The anime_metadata module.
+
+This module contains the store for the heavy fields of an anime
+(synopsis, image url, number of episodes and ranking), which are only
+needed when an anime is displayed, so they are not kept in memory
+with the graph.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import csv
+import mmap
+import sys
+import threading
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+# The number of anime whose metadata is kept in memory after being read.
+DEFAULT_CACHE_SIZE = 128
+
+# A tuple of (synopsis, total_episodes, rank, image_url).
+Metadata = tuple[str, int, Optional[int], str]
+
+
+class AnimeMetadataStore:
+    """A store of the heavy fields of anime, keyed by anime uid.
+
+    The fields of anime loaded from the anime data file stay in that file. The file is
+    memory-mapped when a field is first requested, and each anime uid is mapped to the byte
+    offset and length of its row in the file. Rows that were read recently are kept in a
+    small LRU cache.
+    Anime that were not loaded from a file have their fields kept in memory.
+    The store can be shared between threads: the LRU cache and the file are guarded by a lock.
+
+    Instance Attributes:
+        - filepath: The path to the anime data file, or None.
+        - cache_size: The maximum number of anime kept in the LRU cache.
+    """
+    filepath: Optional[str]
+    cache_size: int
+
+    # Private Instance Attributes:
+    #     - _offsets: A mapping of anime uids to a tuple (offset, length) of their rows.
+    #     - _resident: A mapping of anime uids to the fields of anime not loaded from a file.
+    #     - _cache: The LRU cache of recently read fields.
+    #     - _file: The open anime data file, or None if it is not mapped yet.
+    #     - _map: The memory map of the anime data file, or None if it is not mapped yet.
+    #     - _lock: The lock guarding _cache, _file and _map.
+    _offsets: dict[int, tuple[int, int]]
+    _resident: dict[int, Metadata]
+    _cache: OrderedDict[int, Metadata]
+    _file: Optional[object]
+    _map: Optional[mmap.mmap]
+    _lock: threading.Lock
+
+    def __init__(self, filepath: Optional[str] = None,
+                 cache_size: int = DEFAULT_CACHE_SIZE) -> None:
+        """Initialize an empty store over the given anime data file."""
+        self.filepath = filepath
+        self.cache_size = cache_size
+        self._offsets = {}
+        self._resident = {}
+        self._cache = OrderedDict()
+        self._file = None
+        self._map = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, uid: int) -> bool:
+        """Return whether the store has the fields of the anime with the given uid."""
+        return uid in self._offsets or uid in self._resident
+
+    def add_offset(self, uid: int, offset: int, length: int) -> None:
+        """Record the byte offset and length of the row of the given anime in the data file.
+        If the anime is already in the store, does nothing.
+        """
+        if uid not in self:
+            self._offsets[uid] = (offset, length)
+
+    def put(self, uid: int, synopsis: str, total_episodes: int, rank: Optional[int],
+            image_url: str) -> None:
+        """Keep the given fields of an anime in memory.
+        If the anime is already in the store, does nothing.
+        """
+        if uid not in self:
+            self._resident[uid] = (synopsis, total_episodes, rank, image_url)
+
+    def get(self, uid: int) -> Metadata:
+        """Returns the fields (synopsis, total_episodes, rank, image_url) of the given anime.
+        If the anime is not in the store, returns default values.
+        """
+        if uid in self._resident:
+            return self._resident[uid]
+        elif uid not in self._offsets:
+            return ('', 0, None, '')
+
+        with self._lock:
+            if uid in self._cache:
+                self._cache.move_to_end(uid)
+                return self._cache[uid]
+            fields = self._read_row(*self._offsets[uid])
+            self._cache[uid] = fields
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return fields
+
+    def peek(self, uid: int) -> Metadata:
+        """Returns the fields of the given anime, as get does, without changing the LRU cache.
+        """
+        if uid in self._resident:
+            return self._resident[uid]
+        elif uid not in self._offsets:
+            return ('', 0, None, '')
+
+        with self._lock:
+            if uid in self._cache:
+                return self._cache[uid]
+            return self._read_row(*self._offsets[uid])
+
+    def resident_size(self) -> int:
+        """Returns the number of bytes of text fields that this store keeps in memory."""
+        fields = list(self._resident.values()) + list(self._cache.values())
+        return sum(len(synopsis) + len(image_url) for synopsis, _, _, image_url in fields)
+
+    def index_size(self) -> int:
+        """Returns the number of bytes of the index of the rows of the anime in the data file.
+        """
+        return sys.getsizeof(self._offsets) + \
+            sum(sys.getsizeof(position) for position in self._offsets.values())
+
+    def close(self) -> None:
+        """Unmap and close the anime data file. It is mapped again if a field is requested."""
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._file.close()
+                self._map = None
+                self._file = None
+
+    def _read_row(self, offset: int, length: int) -> Metadata:
+        """Returns the fields parsed from the row at the given position of the data file."""
+        if self._map is None:
+            self._file = open(self.filepath, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        row = next(csv.reader([self._map[offset:offset + length].decode('utf8')]))
+        return (row[2], _parse_episodes(row[5]), _parse_optional_int(row[8]), row[10])
+
+
+def _parse_episodes(value: str) -> int:
+    """Returns the number of episodes in the given field of the anime data file."""
+    return 0 if value == '' else int(float(value))
+
+
+def _parse_optional_int(value: str) -> Optional[int]:
+    """Returns the integer in the given field of the anime data file, or None if it is empty."""
+    return None if value == '' else int(float(value))
+
+
+def iter_rows_with_offsets(filepath: str) -> Iterator[tuple[int, int, list[str]]]:
+    """Yield a tuple (a, b, c) for each row in the given csv file, excluding the header,
+    where a is the byte offset of the row in the file, b is its length in bytes and c is the
+    row parsed by the csv module.
+
+    A quoted field may span several physical lines, so a row ends only at a line break
+    after an even number of quote characters.
+    """
+    with open(filepath, 'rb') as file:
+        # Skip the header
+        offset = len(file.readline())
+        row_start = offset
+        pending = []
+        quotes = 0
+        for line in file:
+            pending.append(line)
+            quotes += line.count(b'"')
+            offset += len(line)
+            if quotes % 2 == 0:
+                text = b''.join(pending).decode('utf8')
+                yield (row_start, offset - row_start, next(csv.reader([text])))
+                pending = []
+                quotes = 0
+                row_start = offset
+
@@ -16,8 +16,9 @@ import requests
 from PIL import Image, ImageTk, UnidentifiedImageError
 
 from recommendation_engine import RecommendationEngine
-from data_loader import create_anime_graph_from_data
+from data_loader import create_anime_graph_from_storage
 from anime_graph import Anime
+from storage import CsvStorage, Storage
 from trie_auto_complete import Trie
 
 ##########################################################################
@@ -87,8 +88,7 @@ class Application(tk.Tk):
         - current_user: The user currently logged in.
         - trie: The trie for autocompletion feature.
         - anime_file: path to the anime data file.
-        - profiles_file: path to the profiles file.
-        - reviews_file: path to the reviews file.
+        - storage: The storage of the user profiles and reviews.
     """
     # The GUI components necessary for input/output
     background_image: tk.PhotoImage
@@ -111,23 +111,24 @@ class Application(tk.Tk):
     trie: Trie
     recommender: RecommendationEngine
     anime_file: str
-    profiles_file: str
-    reviews_file: str
+    storage: Storage
 
-    def __init__(self, anime_filepath: str, profiles_filepath: str, reviews_filepath: str) -> None:
+    def __init__(self, anime_filepath: str, profiles_filepath: str = '',
+                 reviews_filepath: str = '', storage: Optional[Storage] = None) -> None:
         """Initialize the Application.
+        The users and reviews are kept in the given storage, such as a SqliteStorage, or in
+        the given profiles and reviews files if it is None.
         """
         super().__init__()
         # Initializing components for the recommendation system
         self.anime_file = anime_filepath
-        self.profiles_file = profiles_filepath
-        self.reviews_file = reviews_filepath
+        self.storage = storage if storage is not None \
+            else CsvStorage(profiles_filepath, reviews_filepath)
         self.perm_anime_covers = []
         self.temp_anime_covers = []
         self.current_user = None
         # Initializing the recommendation engine
-        graph = create_anime_graph_from_data(self.anime_file, self.profiles_file,
-                                             self.reviews_file)
+        graph = create_anime_graph_from_storage(self.anime_file, self.storage)
         self.trie = Trie(graph.fetch_all_anime_names())
         self.recommender = RecommendationEngine(graph)
 
@@ -593,7 +594,7 @@ class Application(tk.Tk):
                 birth_year_var.get()
             gender = gender_var.get()
             # When then registering is successful
-            if self.recommender.register(username, gender, birthday, self.profiles_file):
+            if self.recommender.register(username, gender, birthday, self.storage):
                 tk.messagebox.showinfo(title="Successful", message="Successfully registered. "
                                                                    "You can log in now.")
                 self._display_login_window()
@@ -610,7 +611,7 @@ class Application(tk.Tk):
         """
         self.recommender.add_review(self.current_user, anime_uid,
                                     review_score,
-                                    self.reviews_file)
+                                    self.storage)
         result = tk.messagebox.askyesno("Successful",
                                         "Successfully added a new review. "
                                         "Do you want the system to generate new recommendations?")
@@ -0,0 +1,313 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The array_graph module.
+
+This module contains the definition of the ArrayGraph class, a
+read-only AnimeGraph stored in flat NumPy arrays: CSR adjacency
+arrays indexed by the dense ids of the vertices, attribute arrays,
+and string tables for usernames, titles and genre names. Since it
+has no Python objects per vertex, its arrays can live in shared
+memory or in a memory-mapped file and be used without a copy.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import bisect
+from typing import TYPE_CHECKING, Callable, Optional
+
+import numpy as np
+
+from recommendation_scoring import NUM_SIMILAR_USERS, SCORE_FAVORITE
+from top_k import top_k_indices
+
+if TYPE_CHECKING:
+    from anime_graph import AnimeGraph, Vertex
+
+# The names of the arrays of an ArrayGraph, and their dtypes.
+ARRAY_DTYPES = {
+    # users × anime review scores, in CSR form, in the order of User.neighbor_anime.
+    'user_indptr': np.int64, 'user_anime': np.int32, 'user_scores': np.float32,
+    # anime × users review scores, in CSR form, in the order of Anime.neighbor_users.
+    'anime_indptr': np.int64, 'anime_users': np.int32, 'anime_scores': np.float32,
+    # users × genres liking scores, in CSR form, in the order of User.neighbor_genres.
+    'affinity_indptr': np.int64, 'affinity_genres': np.int32, 'affinity_values': np.float64,
+    # genres × anime membership, in CSR form, sorted by anime id.
+    'genre_indptr': np.int64, 'genre_anime': np.int32,
+    # Attributes of each id. Missing popularities are -1 and missing scores are NaN.
+    'user_present': np.bool_, 'anime_present': np.bool_, 'anime_uids': np.int64,
+    'anime_popularity': np.int64, 'anime_score': np.float32, 'anime_aired': np.int64,
+    # String tables: the UTF-8 bytes of all the strings and the start of each string.
+    'username_offsets': np.int64, 'username_bytes': np.uint8,
+    'title_offsets': np.int64, 'title_bytes': np.uint8,
+    'genre_offsets': np.int64, 'genre_bytes': np.uint8,
+    # The ids sorted by username and by anime uid, and the sorted anime uids, for lookups by
+    # binary search.
+    'username_order': np.int32, 'anime_uid_order': np.int32, 'anime_uids_sorted': np.int64,
+}
+
+
+class ArrayGraph:
+    """A read-only graph of anime, users and genres stored in flat arrays.
+
+    The recommendation methods take and return dense ids, and give the same results as the
+    corresponding methods of AnimeGraph and RecommendationEngine, except that ties are
+    broken by id where those iterate over sets.
+
+    Instance Attributes:
+        - arrays: The arrays of the graph, by name. See ARRAY_DTYPES.
+    """
+    arrays: dict[str, np.ndarray]
+
+    def __init__(self, arrays: dict[str, np.ndarray]) -> None:
+        """Initialize a graph over the given arrays, which are not copied."""
+        self.arrays = arrays
+
+    @staticmethod
+    def from_graph(graph: AnimeGraph) -> ArrayGraph:
+        """Returns the ArrayGraph of the given AnimeGraph."""
+        users = list(graph.users.values())
+        anime = list(graph.anime.values())
+        genres = list(graph.genres.values())
+        # The adjacency arrays keep the iteration order of the neighbor dictionaries, which
+        # breaks ties the same way as the methods of AnimeGraph.
+        user_indptr, user_anime, user_scores = _adjacency(
+            users, len(graph.user_ids), lambda user: user.neighbor_anime)
+        anime_indptr, anime_users, anime_scores = _adjacency(
+            anime, len(graph.anime_ids), lambda ani: ani.neighbor_users)
+        affinity_indptr, affinity_genres, affinity_values = _adjacency(
+            users, len(graph.user_ids), lambda user: user.neighbor_genres)
+        genre_indptr, genre_anime, _ = _adjacency(
+            genres, len(graph.genre_ids),
+            lambda genre: dict.fromkeys(sorted(genre.neighbor_anime, key=_by_vid), 1.0))
+
+        arrays = {
+            'user_indptr': user_indptr, 'user_anime': user_anime, 'user_scores': user_scores,
+            'anime_indptr': anime_indptr, 'anime_users': anime_users,
+            'anime_scores': anime_scores,
+            'affinity_indptr': affinity_indptr, 'affinity_genres': affinity_genres,
+            'affinity_values': affinity_values,
+            'genre_indptr': genre_indptr, 'genre_anime': genre_anime,
+            'user_present': np.zeros(len(graph.user_ids), np.bool_),
+            'anime_present': np.zeros(len(graph.anime_ids), np.bool_),
+            'anime_uids': np.array(graph.anime_ids.keys(), np.int64),
+            'anime_popularity': np.full(len(graph.anime_ids), -1, np.int64),
+            'anime_score': np.full(len(graph.anime_ids), np.nan, np.float32),
+            'anime_aired': np.zeros(len(graph.anime_ids), np.int64),
+        }
+        for user in users:
+            arrays['user_present'][user.vid] = True
+        for ani in anime:
+            arrays['anime_present'][ani.vid] = True
+            if ani.popularity is not None:
+                arrays['anime_popularity'][ani.vid] = ani.popularity
+            if ani.score is not None:
+                arrays['anime_score'][ani.vid] = ani.score
+            arrays['anime_aired'][ani.vid] = ani.aired_ordinal
+
+        usernames = graph.user_ids.keys()
+        titles = [''] * len(graph.anime_ids)
+        for ani in anime:
+            titles[ani.vid] = ani.title
+        for name, strings in [('username', usernames), ('title', titles),
+                              ('genre', graph.genre_ids.keys())]:
+            arrays[f'{name}_offsets'], arrays[f'{name}_bytes'] = _string_table(strings)
+        encoded = [name.encode('utf8') for name in usernames]
+        arrays['username_order'] = np.array(sorted(range(len(encoded)),
+                                                   key=encoded.__getitem__), np.int32)
+        arrays['anime_uid_order'] = np.argsort(arrays['anime_uids'], kind='stable')
+        arrays['anime_uids_sorted'] = arrays['anime_uids'][arrays['anime_uid_order']]
+        return ArrayGraph({name: np.ascontiguousarray(array, ARRAY_DTYPES[name])
+                           for name, array in arrays.items()})
+
+    def num_users(self) -> int:
+        """Returns the number of user ids."""
+        return len(self.arrays['user_present'])
+
+    def num_anime(self) -> int:
+        """Returns the number of anime ids."""
+        return len(self.arrays['anime_present'])
+
+    def username(self, user_vid: int) -> str:
+        """Returns the username of the user with the given id."""
+        return _string_at(self.arrays['username_offsets'], self.arrays['username_bytes'],
+                          user_vid)
+
+    def title(self, anime_vid: int) -> str:
+        """Returns the title of the anime with the given id."""
+        return _string_at(self.arrays['title_offsets'], self.arrays['title_bytes'], anime_vid)
+
+    def genre_name(self, genre_vid: int) -> str:
+        """Returns the name of the genre with the given id."""
+        return _string_at(self.arrays['genre_offsets'], self.arrays['genre_bytes'], genre_vid)
+
+    def anime_uid(self, anime_vid: int) -> int:
+        """Returns the uid of the anime with the given id."""
+        return int(self.arrays['anime_uids'][anime_vid])
+
+    def user_vid(self, username: str) -> Optional[int]:
+        """Returns the id of the user with the given username, or None if they are not in the
+        graph. The username is found by binary search in the string table."""
+        order = self.arrays['username_order']
+        target = username.encode('utf8')
+        i = bisect.bisect_left(range(len(order)), target,
+                               key=lambda j: self._username_bytes(int(order[j])))
+        if i < len(order) and self._username_bytes(int(order[i])) == target and \
+                self.arrays['user_present'][order[i]]:
+            return int(order[i])
+        return None
+
+    def anime_vid(self, uid: int) -> Optional[int]:
+        """Returns the id of the anime with the given uid, or None if it is not in the graph.
+        The uid is found by binary search in the sorted uids, which only touches a few pages
+        of them."""
+        order, sorted_uids = self.arrays['anime_uid_order'], self.arrays['anime_uids_sorted']
+        i = int(np.searchsorted(sorted_uids, uid))
+        if i < len(order) and sorted_uids[i] == uid and self.arrays['anime_present'][order[i]]:
+            return int(order[i])
+        return None
+
+    def reviews(self, user_vid: int) -> tuple[np.ndarray, np.ndarray]:
+        """Returns a tuple (a, b) of the ids of the anime the user reviewed and their scores.
+        Both are views of the arrays of the graph."""
+        start, end = self.arrays['user_indptr'][user_vid:user_vid + 2]
+        return self.arrays['user_anime'][start:end], self.arrays['user_scores'][start:end]
+
+    def most_similar_users(self, user_vid: int, limit: int = 50) -> np.ndarray:
+        """Returns the ids of the users most similar to the given user, up to a limit, as in
+        User.most_similar_users: each anime reviewed by both users adds 5.5 minus the
+        difference of their scores, and only users with a positive total are kept.
+        Ties are broken by the order in which User.most_similar_users meets the users.
+        """
+        own_anime, own_scores = self.reviews(user_vid)
+        indptr = self.arrays['anime_indptr']
+        starts, ends = indptr[own_anime], indptr[own_anime + 1]
+        positions = _concatenated_ranges(starts, ends)
+        others = self.arrays['anime_users'][positions]
+        values = 5.5 - np.abs(np.repeat(own_scores, ends - starts).astype(np.float64) -
+                              self.arrays['anime_scores'][positions])
+        kept = others != user_vid
+        others, values = others[kept], values[kept]
+
+        candidates, first_seen, inverse = np.unique(others, return_index=True,
+                                                    return_inverse=True)
+        similarities = np.bincount(inverse, weights=values, minlength=len(candidates))
+        positive = similarities > 0
+        candidates, first_seen = candidates[positive], first_seen[positive]
+        similarities = similarities[positive]
+        return candidates[top_k_indices(similarities, limit, ties=first_seen)]
+
+    def recommend_by_users(self, user_vid: int, limit: int = 10) -> np.ndarray:
+        """Returns the ids of the anime recommended to the given user, up to a limit, as in
+        RecommendationEngine.recommend_by_users with the 'custom' measure: the favorites of
+        the most similar users, most similar first, excluding the anime the user reviewed.
+        """
+        similar = self.most_similar_users(user_vid, NUM_SIMILAR_USERS)
+        indptr = self.arrays['user_indptr']
+        positions = _concatenated_ranges(indptr[similar], indptr[similar + 1])
+        anime = self.arrays['user_anime'][positions]
+        favorite = self.arrays['user_scores'][positions] >= SCORE_FAVORITE
+        favorite &= ~np.isin(anime, self.reviews(user_vid)[0])
+        anime = anime[favorite]
+        _, first_seen = np.unique(anime, return_index=True)
+        return anime[np.sort(first_seen)][:limit]
+
+    def best_liked_genres(self, user_vid: int, limit: int = 5) -> tuple[np.ndarray, np.ndarray]:
+        """Returns a tuple (a, b) of the ids of the genres the user likes most, up to a limit,
+        and the liking scores of the user toward them, as in User.best_liked_genres."""
+        start, end = self.arrays['affinity_indptr'][user_vid:user_vid + 2]
+        genres = self.arrays['affinity_genres'][start:end]
+        values = self.arrays['affinity_values'][start:end]
+        liked = values > 0
+        genres, values = genres[liked], values[liked]
+        if len(genres) > limit:
+            order = top_k_indices(values, limit)
+            genres, values = genres[order], values[order]
+        return genres, values
+
+    def recommend_by_genres(self, user_vid: int, limit: int = 10) -> np.ndarray:
+        """Returns the ids of the anime recommended to the given user, up to a limit, as in
+        RecommendationEngine.recommend_by_genres: the popular anime of the genres the user
+        likes most, excluding the anime the user reviewed. Ties are broken by id.
+        """
+        genres, liking = self.best_liked_genres(user_vid)
+        indptr = self.arrays['genre_indptr']
+        lengths = indptr[genres + 1] - indptr[genres]
+        anime = self.arrays['genre_anime'][_concatenated_ranges(indptr[genres],
+                                                                indptr[genres + 1])]
+        popularity = self.arrays['anime_popularity'][anime]
+        num_anime = int(self.arrays['anime_present'].sum())
+        matches = (num_anime - popularity) / 10 * np.repeat(liking, lengths)
+        kept = (popularity >= 0) & ~np.isin(anime, self.reviews(user_vid)[0])
+        candidates, inverse = np.unique(anime[kept], return_inverse=True)
+        scores = np.bincount(inverse, weights=matches[kept], minlength=len(candidates))
+        # The candidates are sorted, so ties are broken by id.
+        return candidates[top_k_indices(scores, limit)]
+
+    def fetch_popular_anime(self, limit: int = 10) -> np.ndarray:
+        """Returns the ids of the most popular anime, up to a limit."""
+        popularity = self.arrays['anime_popularity'].astype(np.float64)
+        popularity[popularity < 0] = np.inf
+        popularity[~self.arrays['anime_present']] = np.nan
+        return top_k_indices(popularity, min(limit, int(self.arrays['anime_present'].sum())),
+                             largest=False)
+
+    def fetch_new_anime(self, limit: int = 10) -> np.ndarray:
+        """Returns the ids of the most recently aired anime, up to a limit."""
+        present = np.flatnonzero(self.arrays['anime_present'])
+        return present[top_k_indices(self.arrays['anime_aired'][present], limit)]
+
+    def _username_bytes(self, user_vid: int) -> bytes:
+        """Returns the UTF-8 bytes of the username of the user with the given id."""
+        offsets = self.arrays['username_offsets']
+        return self.arrays['username_bytes'][offsets[user_vid]:offsets[user_vid + 1]].tobytes()
+
+
+def _adjacency(vertices: list[Vertex], num_ids: int, neighbors: Callable[[Vertex], dict]) \
+        -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns a tuple (a, b, c) of the CSR arrays of the given neighbor dictionaries of the
+    vertices: the row of the vertex with id i holds the ids of its neighbors in
+    b[a[i]:a[i + 1]], in iteration order, and the values of the dictionary in c.
+    Ids of no given vertex have empty rows.
+    """
+    lengths = np.zeros(num_ids, np.int64)
+    for vertex in vertices:
+        lengths[vertex.vid] = len(neighbors(vertex))
+    indptr = np.zeros(num_ids + 1, np.int64)
+    indptr[1:] = np.cumsum(lengths)
+    ids = np.empty(indptr[-1], np.int64)
+    values = np.empty(indptr[-1], np.float64)
+    for vertex in vertices:
+        start, end = indptr[vertex.vid], indptr[vertex.vid + 1]
+        adjacent = neighbors(vertex)
+        ids[start:end] = np.fromiter((v.vid for v in adjacent), np.int64, end - start)
+        values[start:end] = np.fromiter(adjacent.values(), np.float64, end - start)
+    return indptr, ids, values
+
+
+def _by_vid(vertex: Vertex) -> int:
+    """Returns the dense id of the given vertex, as a sorting key."""
+    return vertex.vid
+
+
+def _string_table(strings: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Returns a tuple (a, b) of the start offsets and the concatenated UTF-8 bytes of the
+    given strings. The string i is b[a[i]:a[i + 1]]."""
+    encoded = [string.encode('utf8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, np.int64)
+    offsets[1:] = np.cumsum(np.array([len(data) for data in encoded], np.int64))
+    return offsets, np.frombuffer(b''.join(encoded), np.uint8)
+
+
+def _string_at(offsets: np.ndarray, data: np.ndarray, i: int) -> str:
+    """Returns the string i of the given string table."""
+    return data[offsets[i]:offsets[i + 1]].tobytes().decode('utf8')
+
+
+def _concatenated_ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Returns the concatenation of the ranges [starts[i], ends[i]), without a Python loop."""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, np.int64)
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
@@ -0,0 +1,77 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The benchmark_minhash module.
+
+This module compares the MinHash LSH neighbor search with the
+exact graph-based Jaccard search, on the users of the test set
+extracted from profiles.csv, for several shapes of the index.
+================================================================
+@author: Tu Pham
+"""
+import csv
+from timeit import default_timer as timer
+
+from anime_graph import AnimeGraph, User
+from minhash_lsh import MinHashLSH, strict_jaccard_similarity
+
+# The (num_bands, rows_per_band) shapes of the index to compare.
+INDEX_SHAPES = [(16, 1), (32, 2), (64, 2), (32, 3), (64, 4)]
+
+
+def exact_neighbors(user: User, limit: int) -> list[User]:
+    """Returns the most similar users with a positive exact strict Jaccard similarity,
+    up to a limit, computed over all the users sharing a reviewed anime."""
+    neighbors = user.closest_jaccard_distance_users(limit)
+    return [other for other in neighbors if strict_jaccard_similarity(user, other) > 0]
+
+
+def compare(graph: AnimeGraph, test_users: list[User], limit: int = 50) \
+        -> list[tuple[str, float, float, float, float]]:
+    """Returns a list of tuples (a, b, c, d, e), where a is the name of a search method,
+    b is its index build time, c its total query time over the test users, d its mean recall
+    of the exact neighbors and e its mean number of candidates per query."""
+    start = timer()
+    exact = {user: set(exact_neighbors(user, limit)) for user in test_users}
+    results = [('exact', 0.0, timer() - start, 1.0,
+                sum(len(_co_rating_users(user)) for user in test_users) / len(test_users))]
+
+    for num_bands, rows_per_band in INDEX_SHAPES:
+        start = timer()
+        index = MinHashLSH(num_bands, rows_per_band)
+        index.index_graph(graph)
+        build_time = timer() - start
+
+        start = timer()
+        found = {user: set(index.most_similar_users(user, limit)) for user in test_users}
+        query_time = timer() - start
+
+        recalls = [len(found[user] & exact[user]) / len(exact[user])
+                   for user in test_users if len(exact[user]) > 0]
+        mean_candidates = sum(len(index.candidates(user)) for user in test_users) / \
+            len(test_users)
+        results.append((f'lsh b={num_bands} r={rows_per_band}', build_time, query_time,
+                        sum(recalls) / max(len(recalls), 1), mean_candidates))
+    return results
+
+
+def _co_rating_users(user: User) -> set[User]:
+    """Returns the users that reviewed at least one anime the given user reviewed."""
+    return {other for anime in user.neighbor_anime for other in anime.neighbor_users} - {user}
+
+
+def load_test_users(graph: AnimeGraph, test_file: str) -> list[User]:
+    """Returns the users of the given test file that are in the graph."""
+    with open(test_file) as fp_in:
+        reader = csv.reader(fp_in)
+        return [graph.users[row[0]] for row in reader if row[0] in graph.users]
+
+
+if __name__ == '__main__':
+    from data_loader import create_anime_graph_from_data
+
+    anime_graph = create_anime_graph_from_data('Data/animes.csv', 'Data/profiles.csv',
+                                               'Data/reviews.csv')
+    users = load_test_users(anime_graph, 'Data/profiles_extracted.csv')
+    print(f'{"Method":<16}{"Build (s)":>11}{"Query (s)":>11}{"Recall":>9}{"Candidates":>12}')
+    for name, build, query, recall, candidates in compare(anime_graph, users):
+        print(f'{name:<16}{build:>11.3f}{query:>11.3f}{recall:>9.3f}{candidates:>12.1f}')
@@ -0,0 +1,223 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The benchmark_suite module.
+
+This module contains a reproducible benchmark suite of the
+recommendation paths: graph load, each recommendation strategy,
+every distance measure, trie completion and the fetch rankings.
+Each scale runs in its own process on a synthetic dataset, and
+reports the p50/p95/p99 latencies and the throughput of every
+benchmark, and the peak resident memory of the process. The results
+are saved as JSON, so they can be compared across commits.
+================================================================
+@author: Tu Pham
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Iterable, Optional
+
+import numpy as np
+
+from dataset_generator import generate_dataset
+from distance_measures import cosine_distance, euclidean_distance, jaccard_distance, \
+    manhattan_distance, minkowski_distance
+
+# The default numbers of users of the benchmarked scales.
+DEFAULT_SCALES = [10000, 100000]
+# The default average number of reviews per user.
+DEFAULT_REVIEWS_PER_USER = 20
+# The default number of sampled queries of each benchmark.
+DEFAULT_NUM_QUERIES = 200
+# The default number of seconds after which a benchmark stops sampling.
+DEFAULT_TIME_LIMIT = 10.0
+
+STRATEGIES = ['genres', 'users', 'score prediction', 'latent factors', 'item-item',
+              'pagerank', 'approximate pagerank', 'hybrid']
+DISTANCE_MEASURES = ['custom', 'graph-based jaccard distance', 'approximate jaccard distance',
+                     euclidean_distance, manhattan_distance, minkowski_distance,
+                     cosine_distance, jaccard_distance]
+
+
+def anime_count(num_users: int) -> int:
+    """Returns the number of anime of the scale with the given number of users."""
+    return min(max(num_users // 10, 1000), 20000)
+
+
+def latency_summary(samples: list[float]) -> dict[str, float]:
+    """Returns the number of calls, the p50/p95/p99 latencies in milliseconds and the
+    throughput in calls per second of the given running times in seconds."""
+    p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+    return {'calls': len(samples), 'p50_ms': float(p50), 'p95_ms': float(p95),
+            'p99_ms': float(p99), 'throughput': len(samples) / max(sum(samples), 1e-12)}
+
+
+def time_calls(function: Callable, arguments: Iterable[tuple],
+               time_limit: float = DEFAULT_TIME_LIMIT) -> dict[str, float]:
+    """Returns the latency summary of calling the function on each of the given tuples of
+    arguments. Sampling stops early once the calls took time_limit seconds in total.
+    """
+    samples = []
+    total = 0.0
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        samples.append(time.perf_counter() - start)
+        total += samples[-1]
+        if total >= time_limit:
+            break
+    return latency_summary(samples)
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak resident memory of this process so far, in megabytes."""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def benchmark_scale(num_users: int, reviews_per_user: int = DEFAULT_REVIEWS_PER_USER,
+                    num_queries: int = DEFAULT_NUM_QUERIES,
+                    time_limit: float = DEFAULT_TIME_LIMIT, seed: int = 111) -> dict[str, Any]:
+    """Returns the results of the benchmarks on a synthetic dataset with the given number of
+    users. It is meant to run in a fresh process, so that its peak memory is its own.
+    """
+    from data_loader import create_anime_graph_from_data
+    from recommendation_engine import RecommendationEngine
+    from trie_auto_complete import Trie
+
+    benchmarks = {}
+    num_anime = anime_count(num_users)
+    with tempfile.TemporaryDirectory() as directory:
+        filepaths = generate_dataset(directory, num_users, num_anime,
+                                     num_users * reviews_per_user, seed)
+        start = time.perf_counter()
+        graph = create_anime_graph_from_data(*filepaths)
+        benchmarks['load graph'] = latency_summary([time.perf_counter() - start])
+        rss_after_load = peak_rss_mb()
+
+        engine = RecommendationEngine(graph)
+        rng = random.Random(seed)
+        users = [name for name, user in graph.users.items() if len(user.neighbor_anime) > 0]
+        queries = [(name,) for name in rng.sample(users, min(num_queries, len(users)))]
+
+        for name, build in [('train latent factors', engine.train_latent_factors),
+                            ('build item similarity', engine.build_item_similarity),
+                            ('build pagerank', engine.build_pagerank)]:
+            benchmarks[name] = time_calls(build, [()], time_limit)
+        recommenders = {
+            'genres': engine.recommend_by_genres,
+            'users': engine.recommend_by_users,
+            'score prediction': engine.recommend_by_score_prediction,
+            'latent factors': engine.recommend_by_latent_factors,
+            'item-item': engine.recommend_by_similar_anime,
+            'pagerank': engine.recommend_by_pagerank,
+            'approximate pagerank': lambda username: engine.recommend_by_pagerank(
+                username, approximate=True),
+            'hybrid': engine.hybrid.recommend
+        }
+        # The strategies are called directly, so the recommendation cache is never hit.
+        for strategy in STRATEGIES:
+            benchmarks[f'recommend: {strategy}'] = time_calls(recommenders[strategy], queries,
+                                                              time_limit)
+        for measure in DISTANCE_MEASURES:
+            name = measure if isinstance(measure, str) else measure.__name__
+            benchmarks[f'distance measure: {name}'] = time_calls(
+                lambda username, m=measure: graph.most_similar_users(graph.users[username], m,
+                                                                     limit=100),
+                queries, time_limit)
+
+        names = graph.fetch_all_anime_names()
+        start = time.perf_counter()
+        trie = Trie(names)
+        benchmarks['build trie'] = latency_summary([time.perf_counter() - start])
+        prefixes = [(rng.choice(names)[:rng.randint(1, 4)],) for _ in range(num_queries)]
+        benchmarks['trie completion'] = time_calls(trie.all_suffixes, prefixes, time_limit)
+
+        genres = engine.fetch_all_genres()
+        repeats = [()] * num_queries
+        benchmarks['fetch new anime'] = time_calls(engine.fetch_new_anime, repeats, time_limit)
+        benchmarks['fetch popular anime'] = time_calls(engine.fetch_popular_anime, repeats,
+                                                       time_limit)
+        benchmarks['fetch popular by genre'] = time_calls(
+            engine.fetch_popular_by_genre, [(rng.choice(genres),) for _ in repeats], time_limit)
+        benchmarks['fetch all genres'] = time_calls(engine.fetch_all_genres, repeats,
+                                                    time_limit)
+        benchmarks['fetch anime by name'] = time_calls(
+            engine.fetch_anime_by_name, [(rng.choice(names),) for _ in repeats], time_limit)
+
+        return {'num_users': len(graph.users), 'num_anime': len(graph.anime),
+                'num_reviews': sum(len(user.neighbor_anime) for user in graph.users.values()),
+                'rss_after_load_mb': rss_after_load, 'peak_rss_mb': peak_rss_mb(),
+                'benchmarks': benchmarks}
+
+
+def run_suite(scales: list[int], reviews_per_user: int = DEFAULT_REVIEWS_PER_USER,
+              num_queries: int = DEFAULT_NUM_QUERIES, time_limit: float = DEFAULT_TIME_LIMIT,
+              seed: int = 111) -> dict[str, Any]:
+    """Returns the results of the benchmarks at each of the given scales, in numbers of users.
+    Each scale runs in a new process.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for num_users in scales:
+        with context.Pool(1) as pool:
+            results.append(pool.apply(benchmark_scale, (num_users, reviews_per_user,
+                                                        num_queries, time_limit, seed)))
+    return {'commit': _git_commit(), 'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'config': {'reviews_per_user': reviews_per_user, 'num_queries': num_queries,
+                       'time_limit': time_limit, 'seed': seed},
+            'scales': results}
+
+
+def _git_commit() -> Optional[str]:
+    """Returns the current git commit of the repository, or None if it is unknown."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict[str, Any]) -> None:
+    """Print the given results of the suite as tables."""
+    for scale in results['scales']:
+        print(f'\n{scale["num_users"]} users, {scale["num_anime"]} anime, '
+              f'{scale["num_reviews"]} reviews, peak RSS {scale["peak_rss_mb"]:.0f} MB')
+        print(f'{"Benchmark":<48}{"Calls":>7}{"p50 (ms)":>11}{"p95 (ms)":>11}'
+              f'{"p99 (ms)":>11}{"Calls/s":>11}')
+        for name, summary in scale['benchmarks'].items():
+            print(f'{name:<48}{summary["calls"]:>7}{summary["p50_ms"]:>11.2f}'
+                  f'{summary["p95_ms"]:>11.2f}{summary["p99_ms"]:>11.2f}'
+                  f'{summary["throughput"]:>11.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the recommendation paths.')
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help='the numbers of users of the synthetic datasets')
+    parser.add_argument('--reviews-per-user', type=int, default=DEFAULT_REVIEWS_PER_USER)
+    parser.add_argument('--queries', type=int, default=DEFAULT_NUM_QUERIES)
+    parser.add_argument('--time-limit', type=float, default=DEFAULT_TIME_LIMIT,
+                        help='the seconds after which a benchmark stops sampling')
+    parser.add_argument('--seed', type=int, default=111)
+    parser.add_argument('--output', default='benchmark_results.json')
+    arguments = parser.parse_args()
+
+    suite_results = run_suite(arguments.scales, arguments.reviews_per_user, arguments.queries,
+                              arguments.time_limit, arguments.seed)
+    with open(arguments.output, 'w') as output:
+        json.dump(suite_results, output, indent=2)
+    print_results(suite_results)
@@ -0,0 +1,97 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The benchmark_top_k module.
+
+This module compares the top-k selections of the top_k module with
+the full sorts they replaced, on the shapes of input of their call
+sites, at the scale of the anime catalog and of the user base. Each
+benchmark also checks that both return the same elements in the
+same order.
+================================================================
+@author: Tu Pham
+"""
+import random
+from operator import itemgetter
+from timeit import repeat
+from typing import Callable
+
+import numpy as np
+
+from top_k import top_k, top_k_indices, top_k_keys
+
+# The (name, number of elements, limit) of the benchmarks. 16000 is about the size of the
+# MyAnimeList catalog.
+CASES = [('genre scores (recommend_by_genres)', 16000, 10),
+         ('score predictions (recommend_by_score_prediction)', 16000, 10),
+         ('popularity ranks (fetch_popular_anime)', 16000, 10),
+         ('co-rating similarities (User.most_similar_users)', 100000, 100),
+         ('co-rating similarities (User.most_similar_users)', 1000000, 100),
+         ('pairwise distances (AnimeGraph.most_similar_users)', 1000000, 100),
+         ('liked genres (best_liked_genres)', 40, 5)]
+
+
+def _selections(name: str, size: int, limit: int,
+                rng: random.Random) -> tuple[Callable[[], list], Callable[[], list]]:
+    """Returns a tuple (a, b) of the previous sort-based selection and the current top-k
+    selection of the given benchmark, on random input of the given size with ties."""
+    keys = [object() for _ in range(size)]
+    if name.startswith('genre scores') or name.startswith('co-rating'):
+        mapping = {key: rng.randint(0, 200) / 4 for key in keys}
+
+        def previous() -> list:
+            """Sort the items of the mapping."""
+            result_list = [(key, mapping[key]) for key in mapping]
+            result_list.sort(key=lambda x: x[1], reverse=True)
+            return [tup[0] for tup in result_list[:limit]]
+
+        return previous, lambda: top_k_keys(mapping, limit)
+    elif name.startswith('liked genres'):
+        pairs = [(key, rng.randint(0, 20) / 2) for key in keys]
+
+        def previous() -> list:
+            """Sort a copy of the pairs."""
+            liked_list = list(pairs)
+            liked_list.sort(key=lambda x: x[1], reverse=True)
+            return liked_list[:limit]
+
+        return previous, lambda: top_k(pairs, limit, key=itemgetter(1))
+    else:
+        largest = name.startswith('score')
+        pairs = [(key, rng.randint(0, 1000) / 100) for key in keys]
+
+        def previous() -> list:
+            """Sort a copy of the pairs."""
+            result_list = list(pairs)
+            result_list.sort(key=lambda x: x[1], reverse=largest)
+            return [tup[0] for tup in result_list[:limit]]
+
+        def current() -> list:
+            """Select from an array of the values."""
+            values = np.fromiter((tup[1] for tup in pairs), np.float64, len(pairs))
+            return [pairs[i][0] for i in top_k_indices(values, limit, largest).tolist()]
+
+        return previous, current
+
+
+def run_benchmarks(repetitions: int = 3, seed: int = 111) -> list[tuple[str, int, int, float,
+                                                                         float]]:
+    """Returns a list of tuples (a, b, c, d, e), where a is the name of a benchmark, b the
+    number of elements, c the limit, d the best running time of the full sort and e the best
+    running time of the top-k selection, in seconds."""
+    rng = random.Random(seed)
+    results = []
+    for name, size, limit in CASES:
+        previous, current = _selections(name, size, limit, rng)
+        assert previous() == current(), f'{name}: the selections differ'
+        before = min(repeat(previous, number=1, repeat=repetitions))
+        after = min(repeat(current, number=1, repeat=repetitions))
+        results.append((name, size, limit, before, after))
+    return results
+
+
+if __name__ == '__main__':
+    print(f'{"Benchmark":<52}{"Size":>9}{"k":>5}{"Sort (ms)":>11}{"Top-k (ms)":>12}'
+          f'{"Speedup":>9}')
+    for bench_name, n, k, sort_time, top_k_time in run_benchmarks():
+        print(f'{bench_name:<52}{n:>9}{k:>5}{sort_time * 1000:>11.2f}'
+              f'{top_k_time * 1000:>12.2f}{sort_time / top_k_time:>8.1f}x')
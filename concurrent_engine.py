@@ -0,0 +1,392 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The concurrent_engine module.
+
+This module contains the definition of the ConcurrentRecommendationEngine
+class, which serves recommendations from many threads while users
+register and add reviews. Readers work on an immutable snapshot of
+the graph. A single writer thread applies the mutations in batches to
+a private copy of the graph, and publishes it as the next snapshot
+by swapping one reference.
+
+The engine keeps two copies of the graph. Once the readers of the
+previous snapshot are done, its graph is brought up to date by
+applying the mutations of the current snapshot again, and becomes the
+private copy of the next batch. So a batch costs the work of its
+mutations twice, instead of a copy of the whole graph.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+from anime_graph import AnimeGraph, Anime, User
+from recommendation_cache import RecommendationCache
+from recommendation_engine import RecommendationEngine
+from storage import CsvStorage, Storage
+
+# The default maximum number of mutations applied in one batch.
+DEFAULT_BATCH_SIZE = 256
+# The default number of seconds the writer waits for more mutations before applying a batch.
+DEFAULT_BATCH_INTERVAL = 0.05
+# The maximum number of seconds the writer waits for the readers of the previous snapshot to
+# finish before it copies the graph instead of reusing theirs.
+MAX_READER_WAIT = 1.0
+
+# A queued mutation: a tuple of its kind, its arguments and the future of its result.
+Mutation = tuple[str, tuple, Future]
+
+
+class EngineSnapshot:
+    """An immutable version of the graph, with the engine that reads it.
+    Neither the graph nor its vertices are mutated while the snapshot is current, or while
+    it is read.
+
+    Instance Attributes:
+        - version: The number of batches of mutations applied before this snapshot.
+        - graph: The graph of this snapshot.
+        - engine: The engine reading the graph of this snapshot.
+    """
+    version: int
+    graph: AnimeGraph
+    engine: RecommendationEngine
+
+    # Private Instance Attributes:
+    #     - _changes: The mutations, as tuples of their kind and arguments, that turned the
+    #       graph of the previous snapshot into this one, or None if they cannot be applied
+    #       again because one of them failed.
+    #     - _readers: One element per reader of this snapshot. Appending and popping are
+    #       atomic, so readers do not need a lock.
+    #     - _pinned: Whether the snapshot was handed out without tracking its readers, so that
+    #       its graph must never be reused.
+    _changes: Optional[list[tuple[str, tuple]]]
+    _readers: list[None]
+    _pinned: bool
+
+    def __init__(self, version: int, graph: AnimeGraph, engine: RecommendationEngine,
+                 changes: Optional[list[tuple[str, tuple]]] = None) -> None:
+        """Initialize a snapshot."""
+        self.version = version
+        self.graph = graph
+        self.engine = engine
+        self._changes = changes
+        self._readers = []
+        self._pinned = False
+
+
+class _DiscardingStorage(Storage):
+    """A storage that discards what it is given, to apply mutations that are already stored
+    to a graph."""
+
+    def add_user(self, username: str, gender: str, date_birth: str) -> None:
+        """Discard the user."""
+
+    def add_reviews(self, reviews: Iterable[tuple[str, int, float]]) -> None:
+        """Discard the reviews."""
+
+
+class ConcurrentRecommendationEngine:
+    """A recommendation engine that can be used from several threads.
+
+    Reads take the current snapshot with a few atomic operations and never take a lock, so
+    they scale with the number of threads as far as the interpreter allows. Reads never
+    mutate the snapshot: the LSH index of the users is built before the first snapshot, and
+    the models are only built by the writer. Writes are queued, and their futures are
+    resolved once the snapshot containing them is published, so a thread that waits for its
+    write then reads its own write.
+
+    The recommendation cache is shared by all the snapshots. An entry stays valid in the next
+    snapshot unless the mutations changed the version of its user, or a model was built. The
+    models of the latent factor, item-item and pagerank strategies are carried over to the
+    next snapshots until they are built again.
+
+    Instance Attributes:
+        - batch_size: The maximum number of mutations applied in one batch.
+        - batch_interval: The number of seconds the writer waits for more mutations.
+        - cache: The recommendation cache shared by the snapshots.
+    """
+    batch_size: int
+    batch_interval: float
+    cache: RecommendationCache
+
+    # Private Instance Attributes:
+    #     - _snapshot: The current snapshot. It is only replaced, never mutated.
+    #     - _previous: The snapshot before the current one, whose graph is reused for the
+    #       next batch once it has no readers, or None if there is none.
+    #     - _working: The private copy of the graph the next batch is applied to, or None if
+    #       it is made when the next batch arrives.
+    #     - _queue: The mutations waiting for the writer, then None when closing.
+    #     - _writer: The writer thread.
+    _snapshot: EngineSnapshot
+    _previous: Optional[EngineSnapshot]
+    _working: Optional[AnimeGraph]
+    _queue: queue.Queue[Optional[Mutation]]
+    _writer: threading.Thread
+
+    def __init__(self, graph: AnimeGraph, batch_size: int = DEFAULT_BATCH_SIZE,
+                 batch_interval: float = DEFAULT_BATCH_INTERVAL,
+                 cache: Optional[RecommendationCache] = None) -> None:
+        """Initialize the engine over the given graph and start its writer thread.
+        The graph must not be used directly afterwards: it is the graph of the first
+        snapshot, and is reused by the writer once that snapshot is no longer read.
+        """
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.cache = cache if cache is not None else RecommendationCache()
+        graph.build_lsh_index()
+        self._snapshot = EngineSnapshot(0, graph, RecommendationEngine(graph, self.cache))
+        self._previous = None
+        self._working = graph.copy()
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name='engine-writer',
+                                        daemon=True)
+        self._writer.start()
+
+    def snapshot(self) -> EngineSnapshot:
+        """Returns the current snapshot. Several reads from the same snapshot are consistent
+        with each other.
+        The graph of a snapshot returned here is never reused by the writer, which then
+        copies the whole graph for a later batch: use read for short reads.
+        """
+        snapshot = self._snapshot
+        snapshot._pinned = True
+        return snapshot
+
+    @contextmanager
+    def read(self) -> Iterator[EngineSnapshot]:
+        """Returns a context manager giving the current snapshot, which is not mutated until
+        the context exits. Several reads in the same context are consistent with each other.
+        The writer may wait for the context to exit, so do not wait for a write in it.
+        """
+        while True:
+            snapshot = self._snapshot
+            snapshot._readers.append(None)
+            # The writer only reuses a snapshot that is no longer current and has no readers,
+            # so this reader is either seen by the writer, or sees the newer snapshot.
+            if snapshot is self._snapshot:
+                break
+            snapshot._readers.pop()
+        try:
+            yield snapshot
+        finally:
+            snapshot._readers.pop()
+
+    def recommend(self, username: str, limit: int = 10, strategy: str = 'auto',
+                  distant_measure: Union[Callable[[User, User], float], str] = 'custom') \
+            -> list[Anime]:
+        """Returns the recommendations of RecommendationEngine.recommend for the given user
+        on the current snapshot."""
+        with self.read() as snapshot:
+            return snapshot.engine.recommend(username, limit, strategy, distant_measure)
+
+    def register(self, username: str, gender: str, date_birth: str,
+                 filepath: Union[str, Storage]) -> Future:
+        """Queue the registration of a new user, as in RecommendationEngine.register.
+        Returns the future of whether the registration succeeded.
+        """
+        return self._submit('register', (username, gender, date_birth, filepath))
+
+    def add_review(self, username: str, anime_uid: int, review_score: float,
+                   reviews_filepath: Union[str, Storage]) -> Future:
+        """Queue a review, as in RecommendationEngine.add_review. Its time is the time it
+        is queued at. Returns the future of its completion.
+        """
+        return self._submit('review', (username, anime_uid, review_score, reviews_filepath,
+                                       time.time()))
+
+    def ingest_reviews(self, reviews: list[tuple[str, int, float, Optional[float]]]) -> Future:
+        """Queue reviews that are already in the reviews file, as in
+        RecommendationEngine.ingest_reviews. They are applied as one mutation, and the
+        reviews without a time are given the time they are queued at.
+        Returns the future of the number of users whose reviews changed.
+        """
+        now = time.time()
+        return self._submit('ingest', ([(username, anime_uid, score,
+                                         timestamp if timestamp is not None else now)
+                                        for username, anime_uid, score, timestamp in reviews],))
+
+    def train_latent_factors(self, factors: int = 32, iterations: int = 10,
+                             regularization: float = 0.1) -> Future:
+        """Queue the training of the latent factor model, as in
+        RecommendationEngine.train_latent_factors. Returns the future of the model, which is
+        used from the snapshot published after it."""
+        return self._submit('model', ('train_latent_factors',
+                                      (factors, iterations, regularization)))
+
+    def load_latent_factors(self, filepath: str) -> Future:
+        """Queue the loading of a latent factor model, as in
+        RecommendationEngine.load_latent_factors. Returns the future of its completion."""
+        return self._submit('model', ('load_latent_factors', (filepath,)))
+
+    def build_item_similarity(self, num_neighbors: int = 50) -> Future:
+        """Queue the building of the anime neighbor lists, as in
+        RecommendationEngine.build_item_similarity. Returns the future of the lists."""
+        return self._submit('model', ('build_item_similarity', (num_neighbors,)))
+
+    def load_item_similarity(self, filepath: str) -> Future:
+        """Queue the loading of anime neighbor lists, as in
+        RecommendationEngine.load_item_similarity. Returns the future of its completion."""
+        return self._submit('model', ('load_item_similarity', (filepath,)))
+
+    def build_pagerank(self, restart_probability: float = 0.3) -> Future:
+        """Queue the building of the random walk, as in RecommendationEngine.build_pagerank.
+        Returns the future of the walk."""
+        return self._submit('model', ('build_pagerank', (restart_probability,)))
+
+    def flush(self) -> None:
+        """Wait until all the mutations queued so far are published."""
+        self._submit('flush', ()).result()
+
+    def close(self) -> None:
+        """Publish the queued mutations, then stop the writer thread.
+        The last snapshot can still be read.
+        """
+        self._queue.put(None)
+        self._writer.join()
+
+    def _submit(self, kind: str, args: tuple) -> Future:
+        """Queue a mutation and return the future of its result."""
+        future = Future()
+        self._queue.put((kind, args, future))
+        return future
+
+    def _write_loop(self) -> None:
+        """Apply the queued mutations in batches until the engine is closed.
+        A batch is applied once it is full, or batch_interval seconds after its first
+        mutation arrived.
+        """
+        closing = False
+        while not closing:
+            mutation = self._queue.get()
+            if mutation is None:
+                break
+            batch = [mutation]
+            deadline = time.monotonic() + self.batch_interval
+            while len(batch) < self.batch_size:
+                try:
+                    mutation = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if mutation is None:
+                    closing = True
+                    break
+                batch.append(mutation)
+            self._apply(batch)
+
+    def _apply(self, batch: list[Mutation]) -> None:
+        """Apply the given mutations to the working graph, publish it as the next snapshot,
+        then resolve the futures of the mutations."""
+        if all(kind == 'flush' for kind, _, _ in batch):
+            for _, _, future in batch:
+                future.set_result(None)
+            return
+
+        working = self._next_working_graph()
+        writer = RecommendationEngine(working)
+        current = self._snapshot.engine
+        # The models are indexed by dense ids, which the copies of the graph keep.
+        writer.latent_model = current.latent_model
+        writer.item_model = current.item_model
+        writer.pagerank_model = current.pagerank_model
+        storage_errors = _store_reviews(batch)
+        stored = _DiscardingStorage()
+        outcomes = []
+        changes = []
+        for kind, args, future in batch:
+            if future in storage_errors:
+                # The review was not stored, so it is not added to the graph either.
+                outcomes.append((future, None, storage_errors[future]))
+                continue
+            try:
+                if kind == 'register':
+                    result = writer.register(*args)
+                elif kind == 'review':
+                    result = writer.add_review(args[0], args[1], args[2], stored, args[4])
+                elif kind == 'ingest':
+                    result = writer.ingest_reviews(*args)
+                elif kind == 'model':
+                    result = getattr(writer, args[0])(*args[1])
+                else:
+                    result = None
+                outcomes.append((future, result, None))
+                if changes is not None and kind in {'register', 'review', 'ingest'}:
+                    changes.append((kind, args))
+            except Exception as error:  # The error is reported to the caller of the mutation.
+                outcomes.append((future, None, error))
+                # The graph may be partially mutated, so the next batch copies it instead.
+                changes = None
+
+        self._publish(working, writer, changes)
+        if any(kind == 'model' for kind, _, _ in batch):
+            self.cache.clear()
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _next_working_graph(self) -> AnimeGraph:
+        """Returns the private copy of the graph of the current snapshot that the next batch
+        is applied to: the graph of the previous snapshot, with the changes of the current
+        snapshot applied again, once it has no readers, or a new copy if its readers take more
+        than MAX_READER_WAIT seconds."""
+        previous, current = self._previous, self._snapshot
+        working, self._working, self._previous = self._working, None, None
+        if working is not None:
+            return working
+        if previous is not None:
+            deadline = time.monotonic() + MAX_READER_WAIT
+            while len(previous._readers) > 0 and time.monotonic() < deadline:
+                time.sleep(0.001)
+        if previous is not None and not previous._pinned and len(previous._readers) == 0 \
+                and current._changes is not None:
+            replay = RecommendationEngine(previous.graph)
+            storage = _DiscardingStorage()
+            for kind, args in current._changes:
+                if kind == 'register':
+                    replay.register(args[0], args[1], args[2], storage)
+                elif kind == 'review':
+                    replay.add_review(args[0], args[1], args[2], storage, args[4])
+                else:
+                    replay.ingest_reviews(*args)
+            return previous.graph
+        else:
+            return current.graph.copy()
+
+    def _publish(self, graph: AnimeGraph, writer: RecommendationEngine,
+                 changes: Optional[list[tuple[str, tuple]]]) -> None:
+        """Publish the given graph, with the models of the writer engine that mutated it, as
+        the next snapshot. changes are the mutations applied to the graph, or None if they
+        cannot be applied again."""
+        engine = RecommendationEngine(graph, self.cache)
+        engine.latent_model = writer.latent_model
+        engine.item_model = writer.item_model
+        engine.pagerank_model = writer.pagerank_model
+        self._previous = self._snapshot
+        self._snapshot = EngineSnapshot(self._snapshot.version + 1, graph, engine, changes)
+
+
+def _store_reviews(batch: list[Mutation]) -> dict[Future, Exception]:
+    """Store the reviews of the 'review' mutations of the given batch, with one add_reviews
+    call per storage, and returns the mapping of the futures of the mutations whose reviews
+    could not be stored to the error."""
+    by_target = {}
+    for kind, args, future in batch:
+        if kind == 'review':
+            by_target.setdefault(args[3], []).append((args, future))
+    errors = {}
+    for target, mutations in by_target.items():
+        storage = CsvStorage(reviews_filepath=target) if isinstance(target, str) else target
+        try:
+            storage.add_reviews([(args[0], args[1], args[2]) for args, _ in mutations])
+        except Exception as error:  # Reported to the callers of the mutations.
+            for _, future in mutations:
+                errors[future] = error
+    return errors
+
@@ -8,83 +8,70 @@ datafiles as described in the report.
 @author: Tu Pham
 """
 import csv
+import os
+import instrumentation
 from anime_graph import AnimeGraph
+from anime_metadata import AnimeMetadataStore, iter_rows_with_offsets
 from datetime import datetime
+from storage import CsvStorage, Storage
 
 
 def create_anime_graph_from_data(anime_filepath: str, user_profile_filepath: str,
-                                 review_filepath: str) -> AnimeGraph:
+                                 review_filepath: str, id_maps_filepath: str = '') -> AnimeGraph:
     """Create an AnimeGraph from the given data files.
+    If id_maps_filepath is given, the dense ids of the vertices are kept stable across loads:
+    the id maps saved in that file (if it exists) are reused, and the id maps of the new graph
+    are saved back to it.
     Preconditions:
         - The data files follow the format as described in the report.
     """
-    graph = AnimeGraph()
-    _load_anime_data(graph, anime_filepath)
-    _load_user_data(graph, user_profile_filepath)
-    _load_review_data(graph, review_filepath)
-    return graph
-
-
-def _load_anime_data(graph: AnimeGraph, filepath: str) -> None:
-    """Loads the anime data from a file into the graph.
-    This will also insert new genres into the graph.
-    """
-    with open(filepath, 'r', encoding="utf8") as file:
-        reader = csv.reader(file)
+    return create_anime_graph_from_storage(
+        anime_filepath, CsvStorage(user_profile_filepath, review_filepath), id_maps_filepath)
 
-        # Skip the header
-        next(reader)
-
-        for row in reader:
-            _convert_anime_row_data_types(row)
-            # The data types of elements in row got converted to the correct type already.
-            graph.add_anime(uid=row[0], title=row[1], synopsis=row[2], aired_date=row[4],
-                            total_episodes=row[5], popularity=row[7],
-                            rank=row[8], score=row[9], image_url=row[10])
-            genres = row[3][2:-2].split('\', \'')
-            for genre in genres:
-                if genre != '':
-                    graph.add_anime_genre_edge(int(row[0]), genre)
-
-
-def _load_user_data(graph: AnimeGraph, filepath: str) -> None:
-    """Loads the user data from a file into the graph.
-    This will also insert new default review scores (weighted edges) for the user's
-    favorite anime.
 
+def create_anime_graph_from_storage(anime_filepath: str, storage: Storage,
+                                    id_maps_filepath: str = '') -> AnimeGraph:
+    """Create an AnimeGraph from the given anime data file, and the users and reviews of the
+    given storage. id_maps_filepath is as in create_anime_graph_from_data.
     Preconditions:
-        - The file has the format as described in the report.
+        - The anime data file follows the format as described in the report.
     """
-    with open(filepath, 'r', encoding="utf8") as file:
-        reader = csv.reader(file)
-
-        # Skip the header
-        next(reader)
-
-        for row in reader:
-            _convert_user_row_data_types(row)
-            # The types of elements in row got converted appropriately already.
-            graph.add_user(row[0], row[1], row[2])
-            for fav_uid in row[3]:  # row 3 contains a list of favorite anime uid.
-                # giving a default score of 9 to a favorite anime
-                graph.add_review(row[0], fav_uid, 9)
+    graph = AnimeGraph(AnimeMetadataStore(anime_filepath))
+    if id_maps_filepath != '' and os.path.exists(id_maps_filepath):
+        graph.load_id_maps(id_maps_filepath)
+    with instrumentation.span('load.anime'):
+        _load_anime_data(graph, anime_filepath)
+    storage.load_into(graph)
+    if id_maps_filepath != '':
+        graph.save_id_maps(id_maps_filepath)
+    if instrumentation.enabled():
+        instrumentation.count('anime_loaded', len(graph.anime))
+        instrumentation.count('users_loaded', len(graph.users))
+        instrumentation.count('reviews_loaded', sum(len(user.neighbor_anime)
+                                                    for user in graph.users.values()))
+    return graph
 
 
-def _load_review_data(graph: AnimeGraph, filepath: str) -> None:
-    """Loads the review data from a file into the graph.
-    The reviews will be represented by weighted edges between user and anime
+def _load_anime_data(graph: AnimeGraph, filepath: str) -> None:
+    """Loads the anime data from a file into the graph.
+    This will also insert new genres into the graph.
+    Only the fields used by the recommenders are kept in the graph. The other fields stay in
+    the file, and the offsets of the rows are recorded in the graph's metadata store.
 
     Preconditions:
-        - The file has the format as described in the report.
+        - graph.metadata.filepath == filepath
     """
-    with open(filepath, 'r', encoding="utf8") as file:
-        reader = csv.reader(file)
-
-        # Skip the header
-        next(reader)
-
-        for row in reader:
-            graph.add_review(row[1], int(row[2]), float(row[3]))
+    for offset, length, row in iter_rows_with_offsets(filepath):
+        _convert_anime_row_data_types(row)
+        graph.metadata.add_offset(row[0], offset, length)
+        # The data types of elements in row got converted to the correct type already.
+        graph.add_anime(uid=row[0], title=row[1], synopsis=None, aired_date=row[4],
+                        total_episodes=None, popularity=row[7],
+                        rank=None, score=row[9], image_url=None)
+        genres = row[3][2:-2].split('\', \'')
+        for genre in genres:
+            if genre != '':
+                graph.add_anime_genre_edge(int(row[0]), genre)
 
 
 def _convert_anime_row_data_types(row: list) -> None:
@@ -137,29 +124,6 @@ def _convert_anime_row_data_types(row: list) -> None:
         row[9] = int(float(row[9]))
 
 
-def _convert_user_row_data_types(row: list) -> None:
-    """Convert a row of user data in the csv reader to the usable format by mutating this row.
-    This means:
-        - row[0] is a str (the username)
-        - row[1] becomes a str or None (The gender of the user)
-        - row[2] becomes a int or None (The birth year of the user)
-        - row[3] is a list of str (favorite animes) or an empty List
-    """
-    if row[1] == '':
-        row[1] = None
-
-    year = row[2][-4:]
-    if year.isnumeric():
-        row[2] = int(year)
-    else:
-        row[2] = None
-    fav_list = row[3][2:-2].split('\', \'')
-    if fav_list == ['']:
-        row[3] = []
-    else:
-        row[3] = [int(uid) for uid in fav_list]
-
-
 def user_test_data_extract(profiles_filepath: str, num_to_extract: int) -> None:
     """Separate the profiles data into two new files. One contains some extracted user profiles
     with a part of their liked anime. The other contains those profiles with the remaining
@@ -212,7 +176,8 @@ def remove_user_liked_reviews(extracted_users_filepath: str, review_filepath: st
 
 # Functions to make the data cleaner
 def remove_repeated_profiles(profiles_filepath: str) -> None:
-    """Create a new profiles file with no repeated row"""
+    """Create a new profiles file with no repeated row.
+    This is not needed with a SqliteStorage, which stores each user once."""
     usernames = set()
     with open(profiles_filepath) as fp_in, open('cleaned_profiles.csv', 'w', newline='') as fp_out:
         reader = csv.reader(fp_in)
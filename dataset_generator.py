@@ -0,0 +1,254 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The dataset_generator module.
+
+This module contains a generator of synthetic animes.csv,
+profiles.csv and reviews.csv files, in the formats read by
+data_loader, with distributions resembling the MyAnimeList data:
+the popularity of the anime follows a power law, genres appear
+together the way they do on MyAnimeList, the number of reviews per
+user is heavy-tailed, and every user rates with a personal bias.
+
+The files are streamed: the reviews are generated and written in
+chunks, so the memory used depends on the numbers of users and
+anime, not on the number of reviews.
+================================================================
+@author: Tu Pham
+"""
+import argparse
+import csv
+import os
+from datetime import date
+from typing import Any
+
+import numpy as np
+
+# The default number of reviews generated and written at a time.
+DEFAULT_CHUNK_SIZE = 1 << 20
+# The default exponent of the power law of anime popularity.
+DEFAULT_POPULARITY_EXPONENT = 1.0
+# The maximum number of favorites of a user in profiles.csv.
+MAX_FAVORITES = 5
+# The number of rounds of draws by popularity before the remaining draws are uniform.
+_POPULARITY_ROUNDS = 8
+
+# The genres with their relative frequencies on MyAnimeList.
+GENRE_FREQUENCIES = {
+    'Comedy': 30, 'Action': 24, 'Fantasy': 16, 'Adventure': 15, 'Drama': 14, 'Sci-Fi': 14,
+    'Slice of Life': 11, 'Romance': 11, 'School': 10, 'Shounen': 10, 'Kids': 9,
+    'Supernatural': 8, 'Music': 8, 'Mecha': 6, 'Magic': 6, 'Historical': 5, 'Mystery': 5,
+    'Seinen': 5, 'Sports': 4, 'Shoujo': 4, 'Ecchi': 4, 'Parody': 3, 'Military': 3,
+    'Horror': 3, 'Space': 2, 'Psychological': 2, 'Super Power': 2, 'Martial Arts': 2,
+    'Game': 2, 'Demons': 2, 'Harem': 2, 'Thriller': 1, 'Police': 1, 'Samurai': 1,
+    'Vampire': 1
+}
+# Groups of genres that often appear together. A genre of an anime makes the other genres of
+# its groups GENRE_AFFINITY times more likely for the same anime.
+GENRE_GROUPS = [
+    ['Action', 'Adventure', 'Fantasy', 'Shounen', 'Super Power', 'Martial Arts', 'Demons'],
+    ['Action', 'Sci-Fi', 'Mecha', 'Space', 'Military'],
+    ['Comedy', 'Romance', 'School', 'Slice of Life', 'Shoujo', 'Harem', 'Ecchi'],
+    ['Drama', 'Romance', 'Slice of Life', 'Music'],
+    ['Mystery', 'Psychological', 'Thriller', 'Police', 'Seinen', 'Horror', 'Supernatural'],
+    ['Fantasy', 'Magic', 'Supernatural', 'Vampire', 'Demons'],
+    ['Historical', 'Samurai', 'Military', 'Martial Arts'],
+    ['Comedy', 'Parody', 'Kids', 'Game', 'Sports']
+]
+GENRE_AFFINITY = 8.0
+
+_SYLLABLES = ['a', 'ka', 'ki', 'ko', 'sa', 'shi', 'su', 'to', 'na', 'ni', 'no', 'ha', 'hi',
+              'ma', 'mi', 'mo', 'yu', 'yo', 'ra', 'ri', 'ro', 'se', 'ta', 'te', 'chi', 'tsu',
+              'ga', 'gi', 'go', 'zu', 'ken', 'shin', 'ryuu', 'kai', 'sei']
+_MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def generate_dataset(directory: str, num_users: int, num_anime: int, num_reviews: int,
+                     seed: int = 111,
+                     popularity_exponent: float = DEFAULT_POPULARITY_EXPONENT,
+                     chunk_size: int = DEFAULT_CHUNK_SIZE) -> tuple[str, str, str]:
+    """Write animes.csv, profiles.csv and reviews.csv into the given directory, and return
+    their paths. The same arguments always produce the same files.
+
+    A user never reviews the same anime twice, and reviews at most half of the anime. There
+    are fewer than num_reviews reviews only if that cap is reached.
+
+    Preconditions:
+        - num_users > 0 and num_anime > 0 and num_reviews >= 0
+        - chunk_size > 0
+    """
+    rng = np.random.default_rng(seed)
+    anime_filepath = os.path.join(directory, 'animes.csv')
+    profiles_filepath = os.path.join(directory, 'profiles.csv')
+    reviews_filepath = os.path.join(directory, 'reviews.csv')
+
+    uids, quality = write_anime_file(anime_filepath, num_anime, num_users, num_reviews, rng,
+                                     popularity_exponent)
+    weights = 1 / np.arange(1, num_anime + 1) ** popularity_exponent
+    cumulative = np.cumsum(weights / weights.sum())
+
+    # Heavy-tailed activity: most users review a few anime, and a few users review hundreds.
+    activity = rng.lognormal(0.0, 1.2, num_users)
+    counts = np.minimum(rng.multinomial(num_reviews, activity / activity.sum()),
+                        max(num_anime // 2, 1))
+    bias = rng.normal(0.0, 0.8, num_users)
+
+    with open(profiles_filepath, 'w', encoding='utf8', newline='') as profiles_file, \
+            open(reviews_filepath, 'w', encoding='utf8', newline='') as reviews_file:
+        profiles_writer = csv.writer(profiles_file)
+        profiles_writer.writerow(['profile', 'gender', 'birthday', 'favorites_anime'])
+        reviews_writer = csv.writer(reviews_file)
+        reviews_writer.writerow(['uid', 'profile', 'anime_uid', 'score'])
+
+        review_uid = 0
+        ends = np.cumsum(counts)
+        start_user = 0
+        while start_user < num_users:
+            # The users of the chunk, whose reviews add up to about chunk_size.
+            first = ends[start_user] - counts[start_user]
+            end_user = max(int(np.searchsorted(ends, first + chunk_size, side='right')),
+                           start_user + 1)
+            users, ranks = _sample_reviews(counts[start_user:end_user], cumulative, rng)
+            users += start_user
+            scores = np.clip(np.rint(quality[ranks] + bias[users]
+                                     + rng.normal(0.0, 1.2, len(users))), 1, 10).astype(int)
+
+            _write_profiles(profiles_writer, start_user, end_user, users, uids[ranks], scores,
+                            rng)
+            names = [f'user{user}' for user in users.tolist()]
+            reviews_writer.writerows(zip(range(review_uid, review_uid + len(users)), names,
+                                         uids[ranks].tolist(), scores.tolist()))
+            review_uid += len(users)
+            start_user = end_user
+    return anime_filepath, profiles_filepath, reviews_filepath
+
+
+def write_anime_file(filepath: str, num_anime: int, num_users: int, num_reviews: int,
+                     rng: np.random.Generator,
+                     popularity_exponent: float = DEFAULT_POPULARITY_EXPONENT) \
+        -> tuple[np.ndarray, np.ndarray]:
+    """Write an animes.csv file of num_anime random anime, and return a tuple (a, b) of the
+    uids and the mean scores of the anime, both ordered by popularity, most popular first.
+    """
+    # Like on MyAnimeList, the uids are sparse and unrelated to popularity.
+    uids = rng.choice(3 * num_anime, num_anime, replace=False) + 1
+    # More popular anime tend to be better rated.
+    quality = np.clip(7.4 - 1.2 * np.arange(num_anime) / num_anime
+                      + rng.normal(0.0, 0.6, num_anime), 2.0, 9.3)
+    weights = 1 / np.arange(1, num_anime + 1) ** popularity_exponent
+    members = np.rint(weights / weights.sum() * max(num_reviews, 1) * 3
+                      + rng.integers(0, 50, num_anime)).astype(int)
+    ranked = np.empty(num_anime, dtype=int)
+    ranked[np.argsort(-quality, kind='stable')] = np.arange(1, num_anime + 1)
+    genre_names = list(GENRE_FREQUENCIES)
+    base = np.array(list(GENRE_FREQUENCIES.values()), dtype=float)
+    groups = [np.array([genre_names.index(genre) for genre in group])
+              for group in GENRE_GROUPS]
+
+    with open(filepath, 'w', encoding='utf8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['uid', 'title', 'synopsis', 'genre', 'aired', 'episodes', 'members',
+                         'popularity', 'ranked', 'score', 'img_url', 'link'])
+        for rank in range(num_anime):
+            uid = int(uids[rank])
+            title = _random_title(rng)
+            genres = [genre_names[i] for i in _random_genres(base, groups, rng)]
+            aired = date.fromordinal(int(rng.integers(date(1970, 1, 1).toordinal(),
+                                                      date(2021, 1, 1).toordinal())))
+            episodes = int(rng.choice([1, 12, 13, 24, 26, 50])) if rng.random() < 0.9 else ''
+            writer.writerow([uid, title, f'The story of {title}.', str(genres),
+                             f'{_MONTHS[aired.month - 1]} {aired.day}, {aired.year} to ?',
+                             episodes, int(members[rank]), rank + 1, int(ranked[rank]),
+                             round(float(quality[rank]), 2),
+                             f'https://cdn.myanimelist.net/images/anime/{uid}.jpg',
+                             f'https://myanimelist.net/anime/{uid}'])
+    return uids, quality
+
+
+def _sample_reviews(counts: np.ndarray, cumulative: np.ndarray,
+                    rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """Returns a tuple (a, b) of the users, numbered from 0, and the popularity ranks of the
+    reviewed anime of the reviews of users with the given numbers of reviews, sorted by user.
+    The anime are drawn by popularity, and a user never draws the same anime twice. The
+    draws that keep repeating anime of very active users fall back to uniform draws, so that
+    the loop ends quickly.
+    """
+    num_anime = len(cumulative)
+    missing = counts.copy()
+    keys = np.empty(0, dtype=np.int64)
+    rounds = 0
+    while missing.sum() > 0:
+        users = np.repeat(np.arange(len(counts), dtype=np.int64), missing)
+        if rounds < _POPULARITY_ROUNDS:
+            ranks = np.minimum(np.searchsorted(cumulative, rng.random(len(users))),
+                               num_anime - 1)
+        else:
+            ranks = rng.integers(0, num_anime, len(users))
+        rounds += 1
+        keys = np.sort(np.concatenate([keys, users * num_anime + ranks]))
+        keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+        missing = counts - np.bincount(keys // num_anime, minlength=len(counts))
+    return keys // num_anime, keys % num_anime
+
+
+def _write_profiles(writer: Any, start_user: int, end_user: int, users: np.ndarray,
+                    anime_uids: np.ndarray, scores: np.ndarray,
+                    rng: np.random.Generator) -> None:
+    """Write the profiles of the users from start_user to end_user, given their reviews sorted
+    by user. The favorites of a user are some of the anime they scored 10.
+    """
+    favorite = scores == 10
+    favorite_users = users[favorite].tolist()
+    favorite_uids = anime_uids[favorite].tolist()
+    favorites = {}
+    for user, uid in zip(favorite_users, favorite_uids):
+        user_favorites = favorites.setdefault(user, [])
+        if len(user_favorites) < MAX_FAVORITES:
+            user_favorites.append(str(uid))
+
+    genders = rng.choice(['Male', 'Female', ''], end_user - start_user, p=[0.55, 0.35, 0.10])
+    years = rng.integers(1970, 2010, end_user - start_user)
+    for i, user in enumerate(range(start_user, end_user)):
+        writer.writerow([f'user{user}', genders[i], f'Jan 1, {years[i]}',
+                         str(favorites.get(user, []))])
+
+
+def _random_title(rng: np.random.Generator) -> str:
+    """Returns a random title of one to three made-up words."""
+    words = []
+    for _ in range(int(rng.integers(1, 4))):
+        syllables = rng.choice(_SYLLABLES, int(rng.integers(2, 5)))
+        words.append(''.join(syllables).title())
+    return ' '.join(words)
+
+
+def _random_genres(base: np.ndarray, groups: list[np.ndarray],
+                   rng: np.random.Generator) -> list[int]:
+    """Returns the indexes of the random genres of an anime. The first genre is drawn by the
+    frequencies of the genres, and each next genre favors the groups of the genres drawn."""
+    weights = base.copy()
+    chosen = []
+    for _ in range(min(1 + rng.poisson(1.6), 6)):
+        genre = int(rng.choice(len(weights), p=weights / weights.sum()))
+        chosen.append(genre)
+        weights[genre] = 0
+        for group in groups:
+            if genre in group:
+                weights[group] *= GENRE_AFFINITY
+    return chosen
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic anime dataset.')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--anime', type=int, default=16000)
+    parser.add_argument('--reviews', type=int, default=2000000)
+    parser.add_argument('--seed', type=int, default=111)
+    parser.add_argument('--popularity-exponent', type=float,
+                        default=DEFAULT_POPULARITY_EXPONENT)
+    parser.add_argument('--output-dir', default='.')
+    arguments = parser.parse_args()
+
+    for path in generate_dataset(arguments.output_dir, arguments.users, arguments.anime,
+                                 arguments.reviews, arguments.seed,
+                                 arguments.popularity_exponent):
+        print(f'Wrote {path}')
@@ -0,0 +1,219 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The genre_affinity module.
+
+This module contains the definition of the GenreAffinity class,
+which maintains the liking scores of the users toward the genres:
+the weights of the user-genre edges of an AnimeGraph.
+
+The affinity of a user toward a genre is the sum, over the reviews
+of the user of anime in that genre, of the deviation of the score
+from the neutral score 5.5. A review that overwrites an earlier one
+replaces its deviation instead of adding to it.
+
+Reviews can optionally decay over time: with a half-life h, a review
+written t seconds ago only counts for 0.5 ** (t / h) of its deviation.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Optional, Union
+
+import numpy as np
+from scipy import sparse
+
+if TYPE_CHECKING:
+    from anime_graph import AnimeGraph, Anime, User
+
+# The score of a review that neither raises nor lowers the affinities of its user.
+NEUTRAL_SCORE = 5.5
+
+
+class GenreAffinity:
+    """The maintenance of the user-genre affinities of a graph.
+
+    Without decay, the affinities are always exact. With decay, the affinities of a user are
+    exact as of their last review, which only scales all of them by the same factor: the
+    genres of a user are ranked the same way. recompute brings every user up to a given time.
+
+    Instance Attributes:
+        - half_life: The half-life of the reviews, in seconds, or None if they do not decay.
+    """
+    half_life: Optional[float]
+
+    # Private Instance Attributes:
+    #     - _review_times: A mapping of usernames to the mapping of the uids of the anime they
+    #       reviewed to the times of the reviews. It is only filled when reviews decay, from
+    #       the first review of the user that decays.
+    #     - _updated: A mapping of usernames to the time their affinities are exact at. It is
+    #       only filled when reviews decay.
+    _review_times: dict[str, dict[int, float]]
+    _updated: dict[str, float]
+
+    def __init__(self, half_life: Optional[float] = None) -> None:
+        """Initialize the maintenance of the affinities of a graph without reviews.
+
+        Preconditions:
+            - half_life is None or half_life > 0
+        """
+        self.half_life = half_life
+        self._review_times = {}
+        self._updated = {}
+
+    def apply_review(self, user: User, anime: Anime, old_score: Optional[Union[int, float]],
+                     score: Union[int, float], timestamp: Optional[float] = None) -> None:
+        """Update the affinities of the user toward the genres of the anime for a review with
+        the given score, which replaces the review with old_score if it is not None.
+        timestamp is the time of the review, in seconds since the epoch, or now if it is None.
+        """
+        if self.half_life is None:
+            deviation = score - (NEUTRAL_SCORE if old_score is None else old_score)
+        else:
+            deviation = self._decayed_deviation(user, anime, old_score, score, timestamp)
+
+        for genre in anime.neighbor_genres:
+            if genre in user.neighbor_genres:
+                user.neighbor_genres[genre] += deviation
+                genre.neighbor_users[user] += deviation
+            else:
+                user.neighbor_genres[genre] = deviation
+                genre.neighbor_users[user] = deviation
+
+    def recompute(self, graph: AnimeGraph, now: Optional[float] = None) -> int:
+        """Recompute the affinities of all the users of the graph from their reviews, and
+        returns the number of users whose affinities changed. Their versions are bumped.
+        With decay, the affinities are computed as of now, the current time if it is None.
+
+        The sums are computed for all the users at once, as the product of the users × anime
+        matrix of the (weighted) deviations and the anime × genres membership matrix. It also
+        takes into account genres added to anime after they were reviewed.
+        """
+        if now is None:
+            now = time.time()
+        users = list(graph.users.values())
+        anime = list(graph.anime.values())
+        num_genres = len(graph.genre_ids)
+
+        lengths = np.fromiter((len(user.neighbor_anime) for user in users), np.int64,
+                              len(users))
+        total = int(lengths.sum())
+        rows = np.repeat(np.arange(len(users)), lengths)
+        columns = np.fromiter((ani.vid for user in users for ani in user.neighbor_anime),
+                              np.int64, total)
+        deviations = np.fromiter((score for user in users for score in
+                                  user.neighbor_anime.values()), np.float64, total)
+        deviations -= NEUTRAL_SCORE
+        if self.half_life is not None:
+            times = np.fromiter((time_of[ani.uid] for user in users
+                                 for time_of in [self._times_of(user, self._exact_at(user, now))]
+                                 for ani in user.neighbor_anime), np.float64, total)
+            deviations *= 0.5 ** (np.maximum(now - times, 0.0) / self.half_life)
+        shape = (len(users), len(graph.anime_ids))
+        reviewed = sparse.csr_matrix((np.ones(total), (rows, columns)), shape)
+        weighted = sparse.csr_matrix((deviations, (rows, columns)), shape)
+
+        lengths = np.fromiter((len(ani.neighbor_genres) for ani in anime), np.int64, len(anime))
+        total = int(lengths.sum())
+        membership = sparse.csr_matrix(
+            (np.ones(total), (np.repeat(np.fromiter((ani.vid for ani in anime), np.int64,
+                                                    len(anime)), lengths),
+                              np.fromiter((genre.vid for ani in anime
+                                           for genre in ani.neighbor_genres), np.int64, total))),
+            (len(graph.anime_ids), num_genres))
+
+        # A sum of deviations can be 0, and the product drops it, so the edges are the
+        # nonzero entries of the product of the review counts instead.
+        edges = (reviewed @ membership).tocsr()
+        edges.sort_indices()
+        sums = (weighted @ membership).tocsr()
+        sums.sort_indices()
+        values = np.zeros(len(edges.data))
+        edge_keys = np.repeat(np.arange(len(users)), np.diff(edges.indptr)) * num_genres \
+            + edges.indices
+        sum_keys = np.repeat(np.arange(len(users)), np.diff(sums.indptr)) * num_genres \
+            + sums.indices
+        values[np.searchsorted(edge_keys, sum_keys)] = sums.data
+
+        genre_by_vid = [None] * num_genres
+        for genre in graph.genres.values():
+            genre_by_vid[genre.vid] = genre
+        changed = 0
+        for i, user in enumerate(users):
+            start, end = edges.indptr[i], edges.indptr[i + 1]
+            affinities = {genre_by_vid[vid]: value for vid, value in
+                          zip(edges.indices[start:end].tolist(), values[start:end].tolist())}
+            if self.half_life is not None:
+                self._updated[user.username] = now
+            if affinities != user.neighbor_genres:
+                _replace_affinities(user, affinities)
+                user.version += 1
+                changed += 1
+        return changed
+
+    def copy(self) -> GenreAffinity:
+        """Returns a copy of this maintenance, for a copy of its graph."""
+        affinity = GenreAffinity(self.half_life)
+        affinity._review_times = {username: dict(times)
+                                  for username, times in self._review_times.items()}
+        affinity._updated = dict(self._updated)
+        return affinity
+
+    def _decayed_deviation(self, user: User, anime: Anime,
+                           old_score: Optional[Union[int, float]], score: Union[int, float],
+                           timestamp: Optional[float]) -> float:
+        """Decay the affinities of the user up to the time of a new review of the anime, and
+        returns the weighted deviation of the new review minus the weighted deviation of the
+        review it replaces, if any. A review older than the last one of the user is weighted
+        as of the time of the last one.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        updated = self._exact_at(user, timestamp)
+        now = max(updated, timestamp)
+        if now > updated:
+            factor = self._weight(now - updated)
+            for genre in user.neighbor_genres:
+                user.neighbor_genres[genre] *= factor
+                genre.neighbor_users[user] *= factor
+        self._updated[user.username] = now
+
+        times = self._times_of(user, updated)
+        deviation = (score - NEUTRAL_SCORE) * self._weight(now - timestamp)
+        if old_score is not None:
+            deviation -= (old_score - NEUTRAL_SCORE) * self._weight(now - times[anime.uid])
+        times[anime.uid] = timestamp
+        return deviation
+
+    def _exact_at(self, user: User, now: float) -> float:
+        """Returns the time the affinities of the user are exact at, or now if they have never
+        decayed. It is also the time given to the reviews of the user without a time, in both
+        apply_review and recompute, so that both weight them the same."""
+        return self._updated.get(user.username, now)
+
+    def _times_of(self, user: User, default: float) -> dict[int, float]:
+        """Returns the mapping of the uids of the anime the user reviewed to the times of the
+        reviews. The reviews without a time, written before reviews decayed, are given the
+        default time."""
+        times = self._review_times.setdefault(user.username, {})
+        if len(times) < len(user.neighbor_anime):
+            for anime in user.neighbor_anime:
+                times.setdefault(anime.uid, default)
+        return times
+
+    def _weight(self, age: float) -> float:
+        """Returns the weight of a review of the given age, in seconds."""
+        return 0.5 ** (max(age, 0.0) / self.half_life)
+
+
+def _replace_affinities(user: User, affinities: dict) -> None:
+    """Replace the user-genre edges of the user with the given affinities. The genres the
+    user already had keep their order, so that ties are broken the same way."""
+    for genre in list(user.neighbor_genres):
+        if genre not in affinities:
+            del user.neighbor_genres[genre]
+            del genre.neighbor_users[user]
+    for genre, value in affinities.items():
+        user.neighbor_genres[genre] = value
+        genre.neighbor_users[user] = value
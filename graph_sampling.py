@@ -0,0 +1,204 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The graph_sampling module.
+
+This module contains functions to sample a representative subgraph
+of an AnimeGraph, for exporting it to networkx. The samples are
+reproducible with a seed, and each sampler only visits the sampled
+vertices and their neighbors, not the whole graph.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import random
+from collections import deque
+from typing import Any, Optional
+
+import networkx as nx
+
+# The probability that a random walk jumps back to its starting vertex at each step.
+RESTART_PROBABILITY = 0.15
+# The probability that the fire spreads to one more neighbor in forest fire sampling.
+FORWARD_BURNING_PROBABILITY = 0.7
+
+SAMPLING_METHODS = ('random_walk', 'forest_fire', 'stratified')
+
+
+def sample_subgraph(graph: Any, max_vertices: int, method: str,
+                    seed: Optional[int] = None) -> nx.Graph:
+    """Returns a networkx Graph of a sample of at most max_vertices vertices of the given
+    AnimeGraph, with the anime-user and anime-genre edges between them.
+
+    Preconditions:
+        - method in SAMPLING_METHODS
+        - max_vertices >= 0
+    """
+    rng = random.Random(seed)
+    max_vertices = min(max_vertices, _num_vertices(graph))
+    if max_vertices == 0:
+        return nx.Graph()
+    if method == 'random_walk':
+        vertices = random_walk_sample(graph, max_vertices, rng)
+    elif method == 'forest_fire':
+        vertices = forest_fire_sample(graph, max_vertices, rng)
+    else:
+        vertices = stratified_sample(graph, max_vertices, rng)
+
+    graph_nx = nx.Graph()
+    graph_nx.add_nodes_from((vertex, {'kind': vertex.kind}) for vertex in vertices)
+    graph_nx.add_edges_from(_induced_edges(vertices))
+    return graph_nx
+
+
+def random_walk_sample(graph: Any, max_vertices: int, rng: random.Random) -> list:
+    """Returns the vertices visited by a random walk with restarts, in visiting order.
+    The walk starts again from a new random vertex if it gets stuck.
+    The neighbors of each vertex are collected once, on its first visit, so that a step costs
+    the same whatever the degree of the vertex.
+    """
+    visited = {}
+    # A mapping of the vertices visited so far to the tuple of their exported neighbors.
+    neighbors_of = {}
+    max_vertices = min(max_vertices, _num_vertices(graph))
+    if max_vertices <= 0:
+        return []
+    start = current = _random_vertex(graph, rng)
+    steps_without_progress = 0
+    while len(visited) < max_vertices:
+        if current not in visited:
+            visited[current] = None
+            steps_without_progress = 0
+        else:
+            steps_without_progress += 1
+
+        neighbors = neighbors_of.get(current)
+        if neighbors is None:
+            neighbors = neighbors_of[current] = tuple(_exported_neighbors(current))
+        if steps_without_progress > 100 or len(neighbors) == 0:
+            start = current = _random_vertex(graph, rng)
+        elif rng.random() < RESTART_PROBABILITY:
+            current = start
+        else:
+            current = neighbors[rng.randrange(len(neighbors))]
+    return list(visited)
+
+
+def forest_fire_sample(graph: Any, max_vertices: int, rng: random.Random) -> list:
+    """Returns the vertices burnt by forest fire sampling, in burning order.
+    From each burning vertex, the fire spreads to a geometrically distributed number of its
+    unburnt neighbors. A new fire starts at a random vertex when the current one dies out.
+    """
+    burnt = {}
+    max_vertices = min(max_vertices, _num_vertices(graph))
+    while len(burnt) < max_vertices:
+        seed_vertex = _random_vertex(graph, rng)
+        if seed_vertex in burnt:
+            continue
+        burnt[seed_vertex] = None
+        queue = deque([seed_vertex])
+        while len(queue) > 0 and len(burnt) < max_vertices:
+            vertex = queue.popleft()
+            count = 1
+            while rng.random() < FORWARD_BURNING_PROBABILITY:
+                count += 1
+            unburnt = [v for v in _exported_neighbors(vertex) if v not in burnt]
+            for neighbor in rng.sample(unburnt, min(count, len(unburnt))):
+                if len(burnt) < max_vertices:
+                    burnt[neighbor] = None
+                    queue.append(neighbor)
+    return list(burnt)
+
+
+def stratified_sample(graph: Any, max_vertices: int, rng: random.Random) -> list:
+    """Returns a uniform sample of the vertices of each kind, where the number of vertices of
+    each kind is proportional to the number of vertices of that kind in the graph.
+    All genres are included when the budget allows, since there are only a few of them.
+    """
+    total = len(graph.users) + len(graph.anime) + len(graph.genres)
+    num_genres = min(len(graph.genres), max_vertices)
+    num_anime = min(len(graph.anime),
+                    round((max_vertices - num_genres) * len(graph.anime) / max(total, 1)))
+    num_users = min(len(graph.users), max_vertices - num_genres - num_anime)
+    num_anime = min(len(graph.anime), max_vertices - num_genres - num_users)
+
+    vertices = []
+    for vertices_by_key, id_map, count in [(graph.genres, graph.genre_ids, num_genres),
+                                           (graph.anime, graph.anime_ids, num_anime),
+                                           (graph.users, graph.user_ids, num_users)]:
+        vertices.extend(_sample_vertices(vertices_by_key, id_map, count, rng))
+    return vertices
+
+
+def _sample_vertices(vertices_by_key: dict, id_map: Any, count: int,
+                     rng: random.Random) -> list:
+    """Returns count distinct vertices chosen uniformly at random among the given vertices,
+    by drawing dense ids. Ids that are not used by a vertex of the graph are redrawn.
+
+    Preconditions:
+        - count <= len(vertices_by_key)
+    """
+    chosen = {}
+    while len(chosen) < count:
+        key = id_map.key_of(rng.randrange(len(id_map)))
+        if key in vertices_by_key:
+            chosen[vertices_by_key[key]] = None
+    return list(chosen)
+
+
+def _num_vertices(graph: Any) -> int:
+    """Returns the number of vertices of the graph."""
+    return len(graph.users) + len(graph.anime) + len(graph.genres)
+
+
+def _random_vertex(graph: Any, rng: random.Random) -> Any:
+    """Returns a vertex of the graph chosen uniformly at random.
+
+    Preconditions:
+        - _num_vertices(graph) > 0
+    """
+    while True:
+        index = rng.randrange(len(graph.user_ids) + len(graph.anime_ids) + len(graph.genre_ids))
+        for vertices_by_key, id_map in [(graph.users, graph.user_ids),
+                                        (graph.anime, graph.anime_ids),
+                                        (graph.genres, graph.genre_ids)]:
+            if index < len(id_map):
+                key = id_map.key_of(index)
+                if key in vertices_by_key:
+                    return vertices_by_key[key]
+                break
+            index -= len(id_map)
+
+
+def _exported_neighbors(vertex: Any) -> list:
+    """Returns the neighbors of the vertex along the edges that are exported to networkx:
+    anime-user and anime-genre edges.
+    Neighbors kept in sets are sorted by id, since the iteration order of a set depends on the
+    hash seed of the process, and the samples must be reproducible.
+    """
+    if vertex.kind == 'anime':
+        return list(vertex.neighbor_users) + sorted(vertex.neighbor_genres, key=_by_vid)
+    elif vertex.kind == 'genre':
+        return sorted(vertex.neighbor_anime, key=_by_vid)
+    else:
+        return list(vertex.neighbor_anime)
+
+
+def _by_vid(vertex: Any) -> int:
+    """Returns the dense id of the given vertex, as a sorting key."""
+    return vertex.vid
+
+
+def _induced_edges(vertices: list) -> list[tuple]:
+    """Returns the exported edges between the given vertices.
+    The edges are found from the user and anime endpoints, which have few neighbors compared
+    to popular anime and genres.
+    """
+    sampled = set(vertices)
+    edges = []
+    for vertex in vertices:
+        if vertex.kind == 'user':
+            edges.extend((vertex, anime) for anime in vertex.neighbor_anime if anime in sampled)
+        elif vertex.kind == 'anime':
+            edges.extend((vertex, genre) for genre in vertex.neighbor_genres if genre in sampled)
+    return edges
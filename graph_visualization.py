@@ -20,8 +20,11 @@ please consult our Course Syllabus.
 
 This file is Copyright (c) 2021 David Liu and Isaac Waller.
 """
+import os
+
 import networkx as nx
-from plotly.graph_objs import Scatter, Figure
+import numpy as np
+from plotly.graph_objs import Scattergl, Figure
 import anime_graph
 import plotly.express as px
 
@@ -39,58 +42,82 @@ ANIME_COLOUR = 'rgb(89, 205, 105)'
 USER_COLOUR = 'rgb(105, 89, 205)'
 GENRE_COLOUR = 'rgb(205, 105, 89)'
 
+# Beyond this many edges, only a sample of the edges is drawn.
+MAX_DRAWN_EDGES = 20000
+# The number of cells along each axis of the grid that approximates the repulsive forces.
+LAYOUT_GRID_SIZE = 16
+
 
 def visualize_graph(graph: anime_graph.AnimeGraph,
-                    layout: str = 'spring_layout',
+                    layout: str = 'fast_layout',
                     max_vertices: int = 10000,
-                    output_file: str = '') -> None:
+                    output_file: str = '',
+                    max_edges: int = MAX_DRAWN_EDGES,
+                    layout_cache_file: str = '',
+                    sampling: str = 'greedy') -> None:
     """Use plotly and networkx to visualize the given graph.
 
     Optional arguments:
-        - layout: which graph layout algorithm to use
+        - layout: which graph layout algorithm to use. 'fast_layout' is the grid-approximated
+            force-directed layout of this module. Any other value is the name of a networkx
+            layout function.
         - max_vertices: the maximum number of vertices that can appear in the graph
         - output_file: a filename to save the plotly image to (rather than displaying
             in your web browser)
+        - max_edges: the maximum number of edges drawn. Beyond that, a sample of the edges is
+            drawn, keeping every anime-genre edge first.
+        - layout_cache_file: a .npz file to save the computed layout to. If it already holds
+            a layout of the same vertices, that layout is reused.
+        - sampling: how the vertices are chosen when the graph has more than max_vertices
+            vertices. See AnimeGraph.to_networkx.
     """
-    graph_nx = graph.to_networkx(max_vertices)
+    graph_nx = graph.to_networkx(max_vertices, sampling, seed=111)
+    nodes = list(graph_nx.nodes)
+    kinds = [graph_nx.nodes[k]['kind'] for k in nodes]
 
-    pos = getattr(nx, layout)(graph_nx)
-
-    x_values = [pos[k][0] for k in graph_nx.nodes]
-    y_values = [pos[k][1] for k in graph_nx.nodes]
-    labels = list(graph_nx.nodes)
-    sizes = [10 if graph_nx.nodes[k]['kind'] == 'genre' else 5 for k in graph_nx.nodes]
-    kinds = [graph_nx.nodes[k]['kind'] for k in graph_nx.nodes]
+    if layout == 'fast_layout':
+        positions = _cached_fast_layout(graph_nx, nodes, kinds, layout_cache_file)
+    else:
+        pos = getattr(nx, layout)(graph_nx)
+        positions = np.array([pos[k] for k in nodes], dtype=float).reshape(-1, 2)
 
+    degrees = np.array([graph_nx.degree[k] for k in nodes], dtype=float)
+    sizes = np.where(np.array(kinds) == 'genre', 10, 4 + np.minimum(np.log1p(degrees), 6))
     colours = [ANIME_COLOUR if kind == 'anime'
                else USER_COLOUR if kind == 'user' else GENRE_COLOUR for kind in kinds]
-
-    x_edges = []
-    y_edges = []
-    for edge in graph_nx.edges:
-        x_edges += [pos[edge[0]][0], pos[edge[1]][0], None]
-        y_edges += [pos[edge[0]][1], pos[edge[1]][1], None]
-
-    trace3 = Scatter(x=x_edges,
-                     y=y_edges,
-                     mode='lines',
-                     name='edges',
-                     line=dict(color=LINE_COLOUR, width=1),
-                     hoverinfo='none',
-                     )
-    trace4 = Scatter(x=x_values,
-                     y=y_values,
-                     mode='markers',
-                     name='nodes',
-                     marker=dict(symbol='circle-dot',
-                                 size=sizes,
-                                 color=colours,
-                                 line=dict(color=VERTEX_BORDER_COLOUR, width=0.5)
-                                 ),
-                     text=labels,
-                     hovertemplate='%{text}',
-                     hoverlabel={'namelength': 0}
-                     )
+    labels = [str(k) for k in nodes]
+
+    # The edge coordinates, with a NaN after every edge to break the line.
+    edge_index = _drawn_edges(graph_nx, nodes, kinds, max_edges)
+    x_edges = np.full((len(edge_index), 3), np.nan)
+    y_edges = np.full((len(edge_index), 3), np.nan)
+    if len(edge_index) > 0:
+        x_edges[:, 0] = positions[edge_index[:, 0], 0]
+        x_edges[:, 1] = positions[edge_index[:, 1], 0]
+        y_edges[:, 0] = positions[edge_index[:, 0], 1]
+        y_edges[:, 1] = positions[edge_index[:, 1], 1]
+
+    # WebGL traces render tens of thousands of points, where SVG traces would stall.
+    trace3 = Scattergl(x=x_edges.ravel(),
+                       y=y_edges.ravel(),
+                       mode='lines',
+                       name='edges',
+                       line=dict(color=LINE_COLOUR, width=1),
+                       hoverinfo='none',
+                       )
+    trace4 = Scattergl(x=positions[:, 0],
+                       y=positions[:, 1],
+                       mode='markers',
+                       name='nodes',
+                       marker=dict(symbol='circle',
+                                   size=sizes,
+                                   color=colours,
+                                   line=dict(color=VERTEX_BORDER_COLOUR, width=0.5)
+                                   ),
+                       text=labels,
+                       hovertemplate='%{text}',
+                       hoverlabel={'namelength': 0}
+                       )
 
     data1 = [trace3, trace4]
     fig = Figure(data=data1)
@@ -104,6 +131,108 @@ def visualize_graph(graph: anime_graph.AnimeGraph,
         fig.write_image(output_file)
 
 
+def _drawn_edges(graph_nx: nx.Graph, nodes: list, kinds: list[str], max_edges: int,
+                 seed: int = 111) -> np.ndarray:
+    """Returns an array of shape (m, 2) of the indices in nodes of the endpoints of the edges
+    to draw. If there are more than max_edges edges, the anime-genre edges are kept and the
+    rest of the budget is filled with a random sample of the user edges.
+    """
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = np.array([(index[u], index[v]) for u, v in graph_nx.edges],
+                     dtype=np.int64).reshape(-1, 2)
+    if len(edges) <= max_edges:
+        return edges
+
+    is_user = np.array(kinds) == 'user'
+    user_edge = is_user[edges[:, 0]] | is_user[edges[:, 1]]
+    kept = edges[~user_edge][:max_edges]
+    user_edges = edges[user_edge]
+    budget = max_edges - len(kept)
+    sample = np.random.default_rng(seed).choice(len(user_edges), budget, replace=False)
+    return np.concatenate([kept, user_edges[np.sort(sample)]])
+
+
+def _cached_fast_layout(graph_nx: nx.Graph, nodes: list, kinds: list[str],
+                        cache_file: str) -> np.ndarray:
+    """Returns the positions of the given nodes computed by fast_layout.
+    If cache_file holds a layout of the same nodes, it is returned instead. Otherwise, the new
+    layout is saved to cache_file (if it is not '').
+    """
+    keys = np.array([kind + ':' + _vertex_key(node) for node, kind in zip(nodes, kinds)])
+    if cache_file != '' and os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            if np.array_equal(cached['keys'], keys):
+                return cached['positions']
+
+    positions = fast_layout(graph_nx, nodes)
+    if cache_file != '':
+        np.savez(cache_file, keys=keys, positions=positions)
+    return positions
+
+
+def _vertex_key(vertex: anime_graph.Vertex) -> str:
+    """Returns the key that identifies the given vertex among the vertices of its kind."""
+    if isinstance(vertex, anime_graph.User):
+        return vertex.username
+    elif isinstance(vertex, anime_graph.Anime):
+        return str(vertex.uid)
+    else:
+        return str(vertex)
+
+
+def fast_layout(graph_nx: nx.Graph, nodes: list, iterations: int = 60,
+                seed: int = 111) -> np.ndarray:
+    """Returns an array of shape (n, 2) of positions of the given nodes, computed by a
+    force-directed (Fruchterman-Reingold) layout.
+
+    Attractive forces are computed along the edges. The repulsive forces between all pairs of
+    vertices are approximated, as in Barnes-Hut, by the repulsion of the centres of mass of
+    the cells of a LAYOUT_GRID_SIZE × LAYOUT_GRID_SIZE grid. Each iteration therefore takes
+    O(n * LAYOUT_GRID_SIZE ** 2 + m) time instead of O(n ** 2).
+    """
+    n = len(nodes)
+    positions = np.random.default_rng(seed).uniform(-1.0, 1.0, (n, 2))
+    if n <= 1:
+        return positions
+    adjacency = nx.to_scipy_sparse_array(graph_nx, nodelist=nodes, format='coo')
+    rows, cols = adjacency.row, adjacency.col
+    k = 2.0 / np.sqrt(n)  # The optimal distance between vertices, on a 2 × 2 square.
+    temperature = 0.1
+    cells = LAYOUT_GRID_SIZE
+
+    for _ in range(iterations):
+        displacement = np.zeros((n, 2))
+
+        # Attraction along edges. Each undirected edge appears twice in the adjacency.
+        delta = positions[rows] - positions[cols]
+        distance = np.maximum(np.linalg.norm(delta, axis=1), 1e-9)
+        force = delta * (distance / k)[:, None]
+        np.add.at(displacement, rows, -force)
+
+        # Repulsion from the centres of mass of the grid cells.
+        low = positions.min(axis=0)
+        span = np.maximum(positions.max(axis=0) - low, 1e-9)
+        cell = np.minimum((positions - low) / span * cells, cells - 1).astype(np.int64)
+        cell_id = cell[:, 0] * cells + cell[:, 1]
+        mass = np.bincount(cell_id, minlength=cells * cells).astype(float)
+        occupied = np.flatnonzero(mass)
+        centres = np.stack([np.bincount(cell_id, positions[:, 0], cells * cells),
+                            np.bincount(cell_id, positions[:, 1], cells * cells)],
+                           axis=1)[occupied] / mass[occupied, None]
+        delta_x = positions[:, 0, None] - centres[None, :, 0]
+        delta_y = positions[:, 1, None] - centres[None, :, 1]
+        weight = (mass[occupied] * k * k) / np.maximum(delta_x ** 2 + delta_y ** 2, 1e-6)
+        displacement[:, 0] += (delta_x * weight).sum(axis=1)
+        displacement[:, 1] += (delta_y * weight).sum(axis=1)
+
+        # Move every vertex by at most the current temperature.
+        length = np.maximum(np.linalg.norm(displacement, axis=1), 1e-9)
+        positions += displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature *= 0.95
+
+    return positions
+
+
 ###############################################################################
 # ========================= Custom functions ================================ #
 ###############################################################################
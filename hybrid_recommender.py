@@ -0,0 +1,175 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The hybrid_recommender module.
+
+This module contains the definition of the HybridRecommender class,
+which cascades the strategies of a RecommendationEngine: cheap
+candidate generators run first, then an expensive re-ranker runs
+over their candidates only. Each request has a latency budget, and
+the result of the last stage that completed within the budget is
+returned.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Callable, Optional, Union
+
+from recommendation_scoring import NUM_SIMILAR_USERS, SCORE_FAVORITE
+
+if TYPE_CHECKING:
+    from anime_graph import Anime, User
+    from recommendation_engine import RecommendationEngine
+
+# The default latency budget of a request, in seconds.
+DEFAULT_BUDGET = 0.1
+# The default number of candidates each generator produces.
+DEFAULT_NUM_CANDIDATES = 100
+RERANKERS = ('users', 'score prediction')
+
+
+class HybridResult:
+    """The result of a hybrid recommendation.
+
+    Instance Attributes:
+        - anime: The recommended anime.
+        - stages: The stages that ran, in order, as tuples (a, b, c) of the name of the stage,
+        its running time in seconds and whether it completed. The result comes from the last
+        completed stage.
+        - over_budget: Whether the latency budget ran out before all the stages ran.
+    """
+    anime: list[Anime]
+    stages: list[tuple[str, float, bool]]
+    over_budget: bool
+
+    def __init__(self, anime: list[Anime], stages: list[tuple[str, float, bool]],
+                 over_budget: bool) -> None:
+        """Initialize a result."""
+        self.anime = anime
+        self.stages = stages
+        self.over_budget = over_budget
+
+
+class HybridRecommender:
+    """A cascade of the strategies of a recommendation engine.
+
+    The candidate generators are, in order: genre popularity, then item-item similarity if
+    the engine has its neighbor lists, then the most popular anime for users without
+    reviews. Their candidates are merged by taking one from each in turn. The re-ranker then
+    orders the candidates, either by the favorites of similar users ('users') or by
+    predicted scores ('score prediction').
+
+    Instance Attributes:
+        - engine: The engine whose strategies are cascaded.
+        - num_candidates: The number of candidates each generator produces.
+    """
+    engine: RecommendationEngine
+    num_candidates: int
+
+    # Private Instance Attributes:
+    #     - _clock: The function returning the current time in seconds.
+    _clock: Callable[[], float]
+
+    def __init__(self, engine: RecommendationEngine,
+                 num_candidates: int = DEFAULT_NUM_CANDIDATES,
+                 clock: Callable[[], float] = time.perf_counter) -> None:
+        """Initialize a hybrid recommender over the given engine."""
+        self.engine = engine
+        self.num_candidates = num_candidates
+        self._clock = clock
+
+    def recommend(self, username: str, limit: int = 10, budget: float = DEFAULT_BUDGET,
+                  reranker: str = 'users',
+                  distant_measure: Union[Callable[[User, User], float], str] = 'custom') \
+            -> HybridResult:
+        """Returns the hybrid recommendations for the given user, up to a limit.
+        A stage only starts while there is budget left. The re-rankers check the budget as
+        they go, and an interrupted re-ranking is discarded.
+
+        Preconditions:
+            - reranker in RERANKERS
+        """
+        deadline = self._clock() + budget
+        stages = []
+        user = self.engine.fetch_user(username)
+        generators = [('genres', lambda: self.engine.recommend_by_genres(
+            username, self.num_candidates))]
+        if self.engine.item_model is not None:
+            generators.append(('item-item', lambda: self.engine.recommend_by_similar_anime(
+                username, self.num_candidates)))
+
+        candidate_lists = []
+        for name, generator in generators:
+            if self._clock() >= deadline and len(stages) > 0:
+                return HybridResult(_merge(candidate_lists)[:limit], stages, True)
+            start = self._clock()
+            candidate_lists.append(generator())
+            stages.append((name, self._clock() - start, True))
+        candidates = _merge(candidate_lists)
+
+        if len(candidates) == 0:
+            start = self._clock()
+            exclusions = set(user.neighbor_anime)
+            popular = self.engine.fetch_popular_anime(limit + len(exclusions))
+            stages.append(('popular', self._clock() - start, True))
+            return HybridResult([a for a in popular if a not in exclusions][:limit], stages,
+                                self._clock() >= deadline)
+        if self._clock() >= deadline:
+            return HybridResult(candidates[:limit], stages, True)
+
+        start = self._clock()
+        if reranker == 'users':
+            reranked = self._rerank_by_users(user, candidates, distant_measure, deadline)
+        else:
+            reranked = self._rerank_by_score_prediction(user, candidates, deadline)
+        stages.append((reranker, self._clock() - start, reranked is not None))
+        if reranked is None:
+            return HybridResult(candidates[:limit], stages, True)
+        return HybridResult(reranked[:limit], stages, False)
+
+    def _rerank_by_users(self, user: User, candidates: list[Anime],
+                         distant_measure: Union[Callable[[User, User], float], str],
+                         deadline: float) -> Optional[list[Anime]]:
+        """Returns the candidates ordered by the favorites of similar users: the candidates
+        that are a favorite of a more similar user come first, and the candidates that are
+        no similar user's favorite keep their order at the end.
+        Returns None if the deadline passes, which abandons the search for similar users.
+        """
+        similar_users = self.engine.similar_users(user.username, NUM_SIMILAR_USERS,
+                                                  distant_measure,
+                                                  stop=lambda: self._clock() >= deadline)
+        if self._clock() >= deadline:
+            return None
+        rank = {}
+        for i, other in enumerate(similar_users):
+            for anime, score in other.neighbor_anime.items():
+                if score >= SCORE_FAVORITE and anime not in rank:
+                    rank[anime] = i
+        order = sorted(range(len(candidates)),
+                       key=lambda j: (rank.get(candidates[j], len(similar_users)), j))
+        return [candidates[j] for j in order]
+
+    def _rerank_by_score_prediction(self, user: User, candidates: list[Anime],
+                                    deadline: float) -> Optional[list[Anime]]:
+        """Returns the candidates ordered by their predicted score for the user, ties kept in
+        candidate order. Returns None if the deadline passes.
+        """
+        predictions = []
+        for anime in candidates:
+            if self._clock() >= deadline:
+                return None
+            predictions.append(self.engine.predict_review_score(user, anime))
+        order = sorted(range(len(candidates)), key=lambda j: -predictions[j])
+        return [candidates[j] for j in order]
+
+
+def _merge(candidate_lists: list[list[Anime]]) -> list[Anime]:
+    """Returns the anime of the given lists without duplicates, taking one from each list in
+    turn."""
+    merged = {}
+    for i in range(max((len(lst) for lst in candidate_lists), default=0)):
+        for lst in candidate_lists:
+            if i < len(lst):
+                merged.setdefault(lst[i], None)
+    return list(merged)
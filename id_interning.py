@@ -0,0 +1,100 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The id_interning module.
+
+This module contains the definition of the IdMap class, which
+assigns contiguous integer ids to the keys of the vertices of an
+AnimeGraph (usernames, anime uids and genre names), so that the
+vertices can index NumPy arrays directly.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import Optional, Union
+
+# The key of a vertex: a username, an anime uid or a genre name.
+Key = Union[str, int]
+
+
+class IdMap:
+    """A bidirectional mapping between vertex keys and contiguous integer ids.
+    Ids are assigned in insertion order, starting from 0, and never change. An id map that
+    was saved and loaded back keeps the ids of all its keys, even the keys that are no longer
+    in the graph, so that arrays indexed by id stay valid across snapshots.
+
+    Representation Invariants:
+        - all(self._ids[self._keys[i]] == i for i in range(len(self._keys)))
+    """
+    # Private Instance Attributes:
+    #     - _ids: A mapping of keys to their ids.
+    #     - _keys: The keys, where the key with id i is at index i.
+    _ids: dict[Key, int]
+    _keys: list[Key]
+
+    def __init__(self, keys: Optional[list[Key]] = None) -> None:
+        """Initialize an id map, where the given keys get the ids 0, 1, 2, ... in order."""
+        self._ids = {}
+        self._keys = []
+        for key in keys if keys is not None else []:
+            self.intern(key)
+
+    def __len__(self) -> int:
+        """Returns the number of ids assigned so far."""
+        return len(self._keys)
+
+    def __contains__(self, key: Key) -> bool:
+        """Returns whether the given key has an id."""
+        return key in self._ids
+
+    def intern(self, key: Key) -> int:
+        """Returns the id of the given key, assigning the next id to it if it has none."""
+        if key not in self._ids:
+            self._ids[key] = len(self._keys)
+            self._keys.append(key)
+        return self._ids[key]
+
+    def id_of(self, key: Key) -> int:
+        """Returns the id of the given key.
+
+        Preconditions:
+            - key in self
+        """
+        return self._ids[key]
+
+    def key_of(self, vid: int) -> Key:
+        """Returns the key with the given id.
+
+        Preconditions:
+            - 0 <= vid < len(self)
+        """
+        return self._keys[vid]
+
+    def keys(self) -> list[Key]:
+        """Returns the list of keys, where the key with id i is at index i."""
+        return list(self._keys)
+
+    def copy(self) -> IdMap:
+        """Returns an id map with the same ids, which can assign new ids independently."""
+        id_map = IdMap()
+        id_map._ids = dict(self._ids)
+        id_map._keys = list(self._keys)
+        return id_map
+
+
+def save_id_maps(id_maps: dict[str, IdMap], filepath: str) -> None:
+    """Save the given named id maps to a json file.
+    The file is replaced atomically, so a reader never sees a partially written file.
+    """
+    temp_filepath = filepath + '.tmp'
+    with open(temp_filepath, 'w', encoding='utf8') as file:
+        json.dump({name: id_map.keys() for name, id_map in id_maps.items()}, file)
+    os.replace(temp_filepath, filepath)
+
+
+def load_id_maps(filepath: str) -> dict[str, IdMap]:
+    """Returns the named id maps saved in the given json file."""
+    with open(filepath, encoding='utf8') as file:
+        return {name: IdMap(keys) for name, keys in json.load(file).items()}
@@ -0,0 +1,299 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The instrumentation module.
+
+This module contains the instrumentation layer of the hot paths:
+named spans timing the stages of a computation, counters (users
+compared, anime scored, cache hits...) and histograms. The
+recorded metrics can be exported to a JSON file or in the
+Prometheus text format, and a profiler can be run around any block.
+
+Instrumentation is disabled by default, and then a span costs one
+attribute check, and counters and histograms are not touched. Set
+the ANIME_INSTRUMENTATION environment variable to 1, or call
+enable(), to record metrics.
+
+The module-level functions use the default Instrumentation:
+
+    with instrumentation.span('engine.recommend'):
+        ...
+    instrumentation.count('users_compared', len(candidates))
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import bisect
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+from typing import Any, ContextManager, Iterator
+
+# The default upper bounds of the buckets of the span histograms, in seconds.
+SECONDS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+# The default upper bounds of the buckets of the other histograms.
+COUNT_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+# The prefix of the names of the metrics in the Prometheus text format.
+PROMETHEUS_PREFIX = 'anime'
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+class Histogram:
+    """A histogram of observed values, with fixed buckets.
+
+    Instance Attributes:
+        - bounds: The upper bounds of the buckets, in increasing order. The last bucket has
+        no upper bound.
+        - counts: The number of observations in each bucket. It has one more element than
+        bounds.
+        - total: The sum of the observations.
+        - count: The number of observations.
+    """
+    bounds: tuple[float, ...]
+    counts: list[int]
+    total: float
+    count: int
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        """Initialize an empty histogram with the given bucket bounds."""
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Add an observation."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def to_dict(self) -> dict[str, Any]:
+        """Returns a JSON-serializable description of this histogram."""
+        return {'count': self.count, 'sum': self.total,
+                'buckets': {str(bound): n for bound, n in zip(self.bounds, self.counts)},
+                'overflow': self.counts[-1]}
+
+
+class Instrumentation:
+    """A registry of spans, counters and histograms.
+
+    The updates take a lock, so the metrics are exact when several threads record them.
+
+    Instance Attributes:
+        - enabled: Whether metrics are recorded.
+        - counters: A mapping of the names of the counters to their values.
+        - histograms: A mapping of the names of the histograms to the histograms.
+        - spans: A mapping of the names of the spans to the histograms of their durations,
+        in seconds.
+    """
+    enabled: bool
+    counters: dict[str, float]
+    histograms: dict[str, Histogram]
+    spans: dict[str, Histogram]
+
+    # Private Instance Attributes:
+    #     - _lock: The lock of the updates of the metrics.
+    _lock: threading.Lock
+
+    def __init__(self, enabled: bool = False) -> None:
+        """Initialize an instrumentation without metrics."""
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        """Start recording metrics."""
+        self.enabled = True
+
+    def disable(self) -> None:
+        """Stop recording metrics. The metrics recorded so far are kept."""
+        self.enabled = False
+
+    def reset(self) -> None:
+        """Remove all the recorded metrics."""
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.spans = {}
+
+    def span(self, name: str) -> ContextManager:
+        """Returns a context manager recording the duration of its block in the span with the
+        given name. It does nothing if the instrumentation is disabled."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def count(self, name: str, amount: float = 1) -> None:
+        """Add the given amount to the counter with the given name."""
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float,
+                bounds: tuple[float, ...] = COUNT_BUCKETS) -> None:
+        """Add an observation to the histogram with the given name. The bounds of the buckets
+        are only used when the histogram is created."""
+        if self.enabled:
+            with self._lock:
+                if name not in self.histograms:
+                    self.histograms[name] = Histogram(bounds)
+                self.histograms[name].observe(value)
+
+    def record_span(self, name: str, seconds: float) -> None:
+        """Add a duration to the span with the given name."""
+        with self._lock:
+            if name not in self.spans:
+                self.spans[name] = Histogram(SECONDS_BUCKETS)
+            self.spans[name].observe(seconds)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Returns a JSON-serializable description of the recorded metrics."""
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'histograms': {name: h.to_dict() for name, h in self.histograms.items()},
+                    'spans': {name: h.to_dict() for name, h in self.spans.items()}}
+
+    def to_prometheus(self, prefix: str = PROMETHEUS_PREFIX) -> str:
+        """Returns the recorded metrics in the Prometheus text exposition format.
+        The spans are one histogram, labelled by span name.
+        """
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                metric = f'{prefix}_{_metric_name(name)}_total'
+                lines.extend([f'# TYPE {metric} counter', f'{metric} {value}'])
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f'{prefix}_{_metric_name(name)}'
+                lines.append(f'# TYPE {metric} histogram')
+                lines.extend(_prometheus_histogram(metric, '', histogram))
+            if len(self.spans) > 0:
+                metric = f'{prefix}_span_seconds'
+                lines.append(f'# TYPE {metric} histogram')
+                for name, histogram in sorted(self.spans.items()):
+                    lines.extend(_prometheus_histogram(
+                        metric, f'span="{_label_value(name)}",', histogram))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, filepath: str) -> None:
+        """Write the recorded metrics to the given file: in the Prometheus text format if its
+        extension is .prom, and as JSON otherwise."""
+        if filepath.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), indent=2)
+        with open(filepath, 'w') as file:
+            file.write(content)
+
+
+class _Span:
+    """The context manager of an enabled span."""
+    __slots__ = ('_owner', '_name', '_start')
+    _owner: Instrumentation
+    _name: str
+    _start: float
+
+    def __init__(self, owner: Instrumentation, name: str) -> None:
+        """Initialize a span of the given instrumentation."""
+        self._owner = owner
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self) -> _Span:
+        """Start timing."""
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Record the duration of the block, even if it raised an exception."""
+        self._owner.record_span(self._name, time.perf_counter() - self._start)
+
+
+@contextlib.contextmanager
+def profile(filepath: str, interval: float = 0.001) -> Iterator[None]:
+    """Profile the block and write the report to the given file.
+    The sampling profiler pyinstrument is used if it is installed, and writes a text report
+    with the given sampling interval in seconds. Otherwise, the block runs under cProfile, and
+    the file holds its statistics, readable with pstats.
+    """
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(filepath)
+        return
+
+    profiler = Profiler(interval=interval)
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        with open(filepath, 'w') as file:
+            file.write(profiler.output_text(unicode=True))
+
+
+def _metric_name(name: str) -> str:
+    """Returns the given name with the characters Prometheus does not allow replaced."""
+    return ''.join(c if c.isalnum() else '_' for c in name)
+
+
+def _label_value(value: str) -> str:
+    """Returns the given label value with the backslashes, double quotes and line feeds
+    escaped, as the Prometheus text format requires."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _prometheus_histogram(metric: str, labels: str, histogram: Histogram) -> list[str]:
+    """Returns the Prometheus lines of a histogram with the given metric name and labels.
+    The labels are either empty or end with a comma, and their values are escaped."""
+    lines = []
+    cumulative = 0
+    for bound, n in zip(histogram.bounds, histogram.counts):
+        cumulative += n
+        lines.append(f'{metric}_bucket{{{labels}le="{bound}"}} {cumulative}')
+    lines.append(f'{metric}_bucket{{{labels}le="+Inf"}} {histogram.count}')
+    suffix = f'{{{labels.rstrip(",")}}}' if labels != '' else ''
+    lines.append(f'{metric}_sum{suffix} {histogram.total}')
+    lines.append(f'{metric}_count{suffix} {histogram.count}')
+    return lines
+
+
+# The default instrumentation, used by the hot paths of the recommenders and the loader.
+DEFAULT = Instrumentation(os.environ.get('ANIME_INSTRUMENTATION', '') == '1')
+
+span = DEFAULT.span
+count = DEFAULT.count
+observe = DEFAULT.observe
+enable = DEFAULT.enable
+disable = DEFAULT.disable
+reset = DEFAULT.reset
+export = DEFAULT.export
+
+
+def enabled() -> bool:
+    """Returns whether the default instrumentation records metrics."""
+    return DEFAULT.enabled
+
+
+if __name__ == '__main__':
+    from data_loader import create_anime_graph_from_data
+    from recommendation_engine import RecommendationEngine
+
+    enable()
+    engine = RecommendationEngine(create_anime_graph_from_data(
+        'Data/animes.csv', 'Data/profiles.csv', 'Data/reviews.csv'))
+    for username in ['DesolatePsyche', 'baekbeans']:
+        for strategy in ['genres', 'users', 'score prediction']:
+            engine.recommend(username, 10, strategy)
+    print(DEFAULT.to_prometheus())
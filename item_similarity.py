@@ -0,0 +1,182 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The item_similarity module.
+
+This module contains the definition of the ItemSimilarityModel
+class, an item-based collaborative filtering model. For each anime,
+the most similar anime under the adjusted cosine similarity of
+their review scores are precomputed offline from the sparse review
+matrix, and stored as compact neighbor lists. A user is served by
+aggregating the neighbor lists of the anime they reviewed.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import numpy as np
+from scipy import sparse
+
+from id_interning import IdMap
+
+# The default number of neighbors kept for each anime.
+DEFAULT_NUM_NEIGHBORS = 50
+# The default shrinkage of similarities toward 0 for pairs with few common reviewers: a
+# similarity is multiplied by co_count / (co_count + shrinkage).
+DEFAULT_SHRINKAGE = 10.0
+# The maximum number of similarity values held in memory at once while building the model.
+_BLOCK_ENTRIES = 1 << 22
+
+
+class ItemSimilarityModel:
+    """The top neighbors of each anime, in CSR form: the neighbors of the anime with dense id
+    i are neighbor_ids[neighbor_indptr[i]:neighbor_indptr[i + 1]], most similar first.
+
+    Instance Attributes:
+        - neighbor_indptr: The int64 array of the start of the neighbor list of each anime id.
+        - neighbor_ids: The int32 array of the anime ids of the neighbors.
+        - similarities: The float32 array of the shrunk adjusted cosine similarity of each
+        neighbor.
+        - co_counts: The int32 array of the number of users who reviewed both the anime and
+        each neighbor.
+        - anime_ids: The id map of anime uids the model was built with.
+    """
+    neighbor_indptr: np.ndarray
+    neighbor_ids: np.ndarray
+    similarities: np.ndarray
+    co_counts: np.ndarray
+    anime_ids: IdMap
+
+    def __init__(self, neighbor_indptr: np.ndarray, neighbor_ids: np.ndarray,
+                 similarities: np.ndarray, co_counts: np.ndarray, anime_ids: IdMap) -> None:
+        """Initialize a model with the given neighbor lists."""
+        self.neighbor_indptr = neighbor_indptr.astype(np.int64)
+        self.neighbor_ids = neighbor_ids.astype(np.int32)
+        self.similarities = similarities.astype(np.float32)
+        self.co_counts = co_counts.astype(np.int32)
+        self.anime_ids = anime_ids
+
+    def neighbors(self, anime_vid: int) -> list[tuple[int, float]]:
+        """Returns the list of (anime id, similarity) of the neighbors of the anime with the
+        given dense id, most similar first."""
+        if anime_vid >= len(self.neighbor_indptr) - 1:
+            return []
+        start, end = self.neighbor_indptr[anime_vid], self.neighbor_indptr[anime_vid + 1]
+        return list(zip(self.neighbor_ids[start:end].tolist(),
+                        self.similarities[start:end].tolist()))
+
+    def aggregate(self, anime_vids: np.ndarray, weights: np.ndarray) \
+            -> tuple[np.ndarray, np.ndarray]:
+        """Returns a tuple (a, b) of the anime ids that are neighbors of the given anime and
+        their scores, where the score of an anime is the sum over the given anime of their
+        weight times their similarity to it. Only the neighbor lists of the given anime are
+        read, so this takes time proportional to their number times the list length.
+        """
+        known = anime_vids < len(self.neighbor_indptr) - 1
+        anime_vids, weights = anime_vids[known], weights[known]
+        starts = self.neighbor_indptr[anime_vids]
+        lengths = self.neighbor_indptr[anime_vids + 1] - starts
+        if lengths.sum() == 0:
+            return np.zeros(0, np.int32), np.zeros(0)
+        # The positions of all the entries of the lists, without a Python loop over them.
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + \
+            np.arange(lengths.sum())
+        candidates, inverse = np.unique(self.neighbor_ids[positions], return_inverse=True)
+        scores = np.bincount(inverse, weights=np.repeat(weights, lengths) *
+                             self.similarities[positions], minlength=len(candidates))
+        return candidates, scores
+
+    def save(self, filepath: str) -> None:
+        """Save the model to a .npz file."""
+        np.savez(filepath, neighbor_indptr=self.neighbor_indptr, neighbor_ids=self.neighbor_ids,
+                 similarities=self.similarities, co_counts=self.co_counts,
+                 anime_keys=np.array(self.anime_ids.keys(), dtype=np.int64))
+
+    @staticmethod
+    def load(filepath: str) -> ItemSimilarityModel:
+        """Returns the model saved in the given .npz file."""
+        with np.load(filepath) as data:
+            return ItemSimilarityModel(data['neighbor_indptr'], data['neighbor_ids'],
+                                       data['similarities'], data['co_counts'],
+                                       IdMap(data['anime_keys'].tolist()))
+
+
+def build_item_similarity(ratings: sparse.csr_matrix, anime_ids: IdMap,
+                          num_neighbors: int = DEFAULT_NUM_NEIGHBORS,
+                          shrinkage: float = DEFAULT_SHRINKAGE) -> ItemSimilarityModel:
+    """Returns the model of the num_neighbors most similar anime of each anime, given the
+    users × anime matrix of review scores.
+
+    The adjusted cosine similarity of two anime is the cosine of their columns after the
+    mean score of each user is subtracted from their reviews. The co-occurrence counts, the
+    number of users who reviewed both anime, shrink the similarity of pairs with little
+    support. Both are sparse matrix products, computed for a block of anime at a time so
+    that only a block of the anime × anime matrices is in memory. Anime with no common
+    reviewer are never neighbors.
+    """
+    ratings = ratings.tocsr().astype(np.float64)
+    counts = np.diff(ratings.indptr)
+    sums = np.asarray(ratings.sum(axis=1)).ravel()
+    means = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    centred = sparse.csr_matrix((ratings.data - np.repeat(means, counts), ratings.indices,
+                                 ratings.indptr), shape=ratings.shape)
+    reviewed = sparse.csr_matrix((np.ones(ratings.nnz), ratings.indices, ratings.indptr),
+                                 shape=ratings.shape)
+    centred_t = centred.T.tocsr()
+    reviewed_t = reviewed.T.tocsr()
+    centred = centred.tocsc()
+    reviewed = reviewed.tocsc()
+    norms = np.sqrt(np.asarray(centred.multiply(centred).sum(axis=0)).ravel())
+
+    num_anime = ratings.shape[1]
+    num_neighbors = min(num_neighbors, max(num_anime - 1, 0))
+    block_size = max(1, _BLOCK_ENTRIES // max(num_anime, 1))
+    lists = []
+    for first in range(0, num_anime, block_size):
+        block = np.arange(first, min(first + block_size, num_anime))
+        dots = (centred_t @ centred[:, block]).toarray()
+        co_counts = (reviewed_t @ reviewed[:, block]).toarray()
+        scale = norms[:, None] * norms[None, block]
+        similarity = np.divide(dots, scale, out=np.zeros_like(dots), where=scale > 0)
+        similarity *= co_counts / (co_counts + shrinkage)
+        similarity[co_counts == 0] = -np.inf
+        similarity[block, np.arange(len(block))] = -np.inf
+        lists.extend(_top_neighbors(similarity, co_counts, num_neighbors))
+
+    lengths = np.array([len(ids) for ids, _, _ in lists], dtype=np.int64)
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    if len(lists) == 0:
+        return ItemSimilarityModel(indptr, np.zeros(0), np.zeros(0), np.zeros(0), anime_ids)
+    return ItemSimilarityModel(indptr, np.concatenate([tup[0] for tup in lists]),
+                               np.concatenate([tup[1] for tup in lists]),
+                               np.concatenate([tup[2] for tup in lists]), anime_ids)
+
+
+def _top_neighbors(similarity: np.ndarray, co_counts: np.ndarray, num_neighbors: int) \
+        -> list[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Returns, for each column of the given block of similarities, a tuple (a, b, c) of the
+    row ids of its num_neighbors largest finite values, these values and their co-occurrence
+    counts, largest first, ties broken by the smaller id.
+    """
+    if num_neighbors == 0:
+        return [(np.zeros(0, np.int64), np.zeros(0), np.zeros(0))] * similarity.shape[1]
+    best = np.argpartition(-similarity, num_neighbors - 1, axis=0)[:num_neighbors]
+    lists = []
+    for column in range(similarity.shape[1]):
+        rows = best[:, column]
+        values = similarity[rows, column]
+        order = np.lexsort((rows, -values))
+        rows, values = rows[order], values[order]
+        kept = np.isfinite(values)
+        lists.append((rows[kept], values[kept], co_counts[rows[kept], column]))
+    return lists
+
+
+if __name__ == '__main__':
+    from data_loader import create_anime_graph_from_data
+
+    # Build offline. The id maps are saved with the graph so that later loads of the data
+    # give the same dense ids, which the saved neighbor lists are indexed by.
+    anime_graph = create_anime_graph_from_data('Data/animes.csv', 'Data/profiles.csv',
+                                               'Data/reviews.csv', 'Data/id_maps.json')
+    build_item_similarity(anime_graph.to_sparse().ratings,
+                          anime_graph.anime_ids).save('Data/item_similarity.npz')
@@ -0,0 +1,181 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The matrix_factorization module.
+
+This module contains the definition of the LatentFactorModel class
+and the alternating least squares (ALS) training of the model over
+the users × anime review scores of an AnimeGraph. Training runs
+offline, vectorized with NumPy, and the factors are saved as compact
+float32 arrays. Serving a user is a single matrix-vector product
+followed by a top-k selection.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import numpy as np
+from scipy import sparse
+
+from id_interning import IdMap
+
+# The default number of latent factors.
+DEFAULT_FACTORS = 32
+# The default regularization strength, scaled by the number of reviews of each row.
+DEFAULT_REGULARIZATION = 0.1
+# The default number of ALS iterations. Each iteration solves for users, then anime.
+DEFAULT_ITERATIONS = 10
+# The number of conjugate gradient steps of each half of an ALS iteration.
+_CG_STEPS = 3
+
+
+class LatentFactorModel:
+    """A latent factor model of the review scores. The predicted score of a user for an
+    anime is global_mean + user_factors[u] @ anime_factors[a], where u and a are their dense
+    ids.
+
+    Instance Attributes:
+        - user_factors: The float32 array of shape (number of user ids, factors).
+        - anime_factors: The float32 array of shape (number of anime ids, factors).
+        - global_mean: The mean of all review scores.
+        - user_ids: The id map of usernames the model was trained with.
+        - anime_ids: The id map of anime uids the model was trained with.
+        - regularization: The regularization strength used in training and fold-in.
+    """
+    user_factors: np.ndarray
+    anime_factors: np.ndarray
+    global_mean: float
+    user_ids: IdMap
+    anime_ids: IdMap
+    regularization: float
+
+    def __init__(self, user_factors: np.ndarray, anime_factors: np.ndarray,
+                 global_mean: float, user_ids: IdMap, anime_ids: IdMap,
+                 regularization: float = DEFAULT_REGULARIZATION) -> None:
+        """Initialize a model with the given factors."""
+        self.user_factors = user_factors.astype(np.float32)
+        self.anime_factors = anime_factors.astype(np.float32)
+        self.global_mean = global_mean
+        self.user_ids = user_ids
+        self.anime_ids = anime_ids
+        self.regularization = regularization
+
+    def user_vector(self, username: str, anime_uids: list[int],
+                    scores: list[float]) -> np.ndarray:
+        """Returns the latent factors of the given user. A user that was not in the training
+        data is folded in: their factors are solved from the given reviews, with the anime
+        factors fixed.
+        """
+        if username in self.user_ids and self.user_ids.id_of(username) < len(self.user_factors):
+            return self.user_factors[self.user_ids.id_of(username)]
+
+        known = [(self.anime_ids.id_of(uid), score) for uid, score in zip(anime_uids, scores)
+                 if uid in self.anime_ids and self.anime_ids.id_of(uid) < len(self.anime_factors)]
+        factors = self.anime_factors.shape[1]
+        if len(known) == 0:
+            return np.zeros(factors, np.float32)
+        vids = np.array([vid for vid, _ in known])
+        centred = np.array([score for _, score in known]) - self.global_mean
+        rated = self.anime_factors[vids].astype(np.float64)
+        gram = rated.T @ rated + self.regularization * len(known) * np.eye(factors)
+        return np.linalg.solve(gram, rated.T @ centred).astype(np.float32)
+
+    def predict_scores(self, user_vector: np.ndarray) -> np.ndarray:
+        """Returns the predicted scores of the user with the given factors for every anime id.
+        """
+        return self.anime_factors @ user_vector + np.float32(self.global_mean)
+
+    def save(self, filepath: str) -> None:
+        """Save the model to a .npz file."""
+        np.savez(filepath, user_factors=self.user_factors, anime_factors=self.anime_factors,
+                 global_mean=np.float32(self.global_mean),
+                 regularization=np.float32(self.regularization),
+                 user_keys=np.array(self.user_ids.keys(), dtype=str),
+                 anime_keys=np.array(self.anime_ids.keys(), dtype=np.int64))
+
+    @staticmethod
+    def load(filepath: str) -> LatentFactorModel:
+        """Returns the model saved in the given .npz file."""
+        with np.load(filepath) as data:
+            return LatentFactorModel(data['user_factors'], data['anime_factors'],
+                                     float(data['global_mean']),
+                                     IdMap(data['user_keys'].tolist()),
+                                     IdMap(data['anime_keys'].tolist()),
+                                     float(data['regularization']))
+
+
+def train_als(ratings: sparse.csr_matrix, factors: int = DEFAULT_FACTORS,
+              regularization: float = DEFAULT_REGULARIZATION,
+              iterations: int = DEFAULT_ITERATIONS, seed: int = 111) \
+        -> tuple[np.ndarray, np.ndarray, float]:
+    """Returns a tuple (a, b, c) of the user factors, the anime factors and the global mean
+    that fit the given users × anime matrix of review scores by alternating least squares.
+    Only the stored entries of the matrix are reviews. The regularization of each row is
+    scaled by its number of reviews (weighted-lambda regularization).
+    """
+    ratings = ratings.tocsr()
+    global_mean = float(ratings.data.mean()) if ratings.nnz > 0 else 0.0
+    centred = sparse.csr_matrix((ratings.data.astype(np.float64) - global_mean,
+                                 ratings.indices, ratings.indptr), shape=ratings.shape)
+    centred_t = centred.T.tocsr()
+
+    rng = np.random.default_rng(seed)
+    user_factors = np.zeros((ratings.shape[0], factors))
+    anime_factors = rng.normal(0.0, 0.1, (ratings.shape[1], factors))
+    for _ in range(iterations):
+        user_factors = _least_squares(centred, anime_factors, user_factors, regularization)
+        anime_factors = _least_squares(centred_t, user_factors, anime_factors, regularization)
+    return user_factors.astype(np.float32), anime_factors.astype(np.float32), global_mean
+
+
+def _least_squares(matrix: sparse.csr_matrix, fixed: np.ndarray, current: np.ndarray,
+                   regularization: float) -> np.ndarray:
+    """Returns the factors of the rows of the given matrix that approximately minimize the
+    regularized squared error of its stored entries, given the fixed factors of its columns.
+
+    The normal equations of all the rows are solved at once by a few steps of the conjugate
+    gradient method, starting from the current factors. A step only needs sparse
+    matrix-vector products over the reviews, so it costs O(reviews × factors) instead of the
+    O(reviews × factors²) of forming every row's Gram matrix.
+    """
+    counts = np.diff(matrix.indptr)
+    entry_rows = np.repeat(np.arange(matrix.shape[0]), counts)
+    entries = fixed[matrix.indices]
+    damping = regularization * counts[:, None]
+
+    def gram_product(x: np.ndarray) -> np.ndarray:
+        """Returns (F_r^T F_r + damping_r I) x_r for every row r, where F_r holds the fixed
+        factors of the entries of row r."""
+        projections = np.einsum('ij,ij->i', entries, x[entry_rows])
+        weighted = sparse.csr_matrix((projections, matrix.indices, matrix.indptr),
+                                     shape=matrix.shape)
+        return weighted @ fixed + damping * x
+
+    solved = current.copy()
+    residual = matrix @ fixed - gram_product(solved)
+    direction = residual.copy()
+    residual_norms = np.einsum('ij,ij->i', residual, residual)
+    for _ in range(_CG_STEPS):
+        product = gram_product(direction)
+        curvature = np.einsum('ij,ij->i', direction, product)
+        step = np.divide(residual_norms, curvature, out=np.zeros_like(curvature),
+                         where=curvature > 0)
+        solved += step[:, None] * direction
+        residual -= step[:, None] * product
+        new_norms = np.einsum('ij,ij->i', residual, residual)
+        direction = residual + np.divide(new_norms, residual_norms,
+                                         out=np.zeros_like(new_norms),
+                                         where=residual_norms > 0)[:, None] * direction
+        residual_norms = new_norms
+    return solved
+
+
+if __name__ == '__main__':
+    from data_loader import create_anime_graph_from_data
+
+    # Train offline. The id maps are saved with the graph so that later loads of the data
+    # give the same dense ids, which the saved factors are indexed by.
+    anime_graph = create_anime_graph_from_data('Data/animes.csv', 'Data/profiles.csv',
+                                               'Data/reviews.csv', 'Data/id_maps.json')
+    user_f, anime_f, mean = train_als(anime_graph.to_sparse().ratings)
+    LatentFactorModel(user_f, anime_f, mean, anime_graph.user_ids,
+                      anime_graph.anime_ids).save('Data/latent_factors.npz')
@@ -0,0 +1,90 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The memory_report module.
+
+This module contains functions to measure how much memory the
+vertices of an AnimeGraph take, compared with the equivalent
+vertices that keep their attributes in a per-instance __dict__
+and hold their heavy fields and aired dates as full objects.
+================================================================
+@author: Tu Pham
+"""
+import sys
+from datetime import datetime
+
+from anime_graph import AnimeGraph, Vertex
+
+
+class _DictVertex:
+    """A vertex that stores its attributes in a __dict__, for comparison purposes."""
+
+
+def _slot_names(vertex: Vertex) -> list[str]:
+    """Returns the names of all the slots of the given vertex."""
+    names = []
+    for cls in type(vertex).__mro__:
+        names.extend(getattr(cls, '__slots__', ()))
+    return names
+
+
+def _dict_vertex_size(vertex: Vertex) -> int:
+    """Returns the size in bytes of an equivalent vertex that uses a __dict__."""
+    equivalent = _DictVertex()
+    for name in _slot_names(vertex):
+        setattr(equivalent, name, getattr(vertex, name))
+    return sys.getsizeof(equivalent) + sys.getsizeof(equivalent.__dict__)
+
+
+def graph_memory_report(graph: AnimeGraph) -> dict[str, tuple[int, int]]:
+    """Returns a mapping of the memory categories of the graph vertices to a tuple (a, b),
+    where a is the number of bytes used by the previous representation (per-instance
+    __dict__, resident heavy fields, datetime aired dates, duplicated strings) and b is the number
+    of bytes used by the current compact representation.
+    """
+    report = {}
+    for kind, vertices in [('users', graph.users.values()), ('anime', graph.anime.values()),
+                           ('genres', graph.genres.values())]:
+        before = sum(_dict_vertex_size(v) for v in vertices)
+        after = sum(sys.getsizeof(v) for v in vertices)
+        report[kind] = (before, after)
+
+    # The heavy fields used to be resident. Now only the offset index stays in memory.
+    # The fields are peeked at, so that measuring them does not fill the LRU cache.
+    fields_before = 0
+    for anime in graph.anime.values():
+        fields_before += sum(sys.getsizeof(field) for field in graph.metadata.peek(anime.uid))
+    fields_after = graph.metadata.resident_size() + graph.metadata.index_size()
+    report['heavy fields'] = (fields_before, fields_after)
+
+    # The aired dates used to be datetime objects.
+    report['aired dates'] = (len(graph.anime) * sys.getsizeof(datetime(1900, 1, 1)),
+                             sum(sys.getsizeof(anime.aired_ordinal)
+                                 for anime in graph.anime.values()))
+
+    # Every user used to hold their own copy of the gender string.
+    genders = [user.gender for user in graph.users.values() if user.gender is not None]
+    distinct = {id(gender): gender for gender in genders}
+    report['genders'] = (sum(sys.getsizeof(gender) for gender in genders),
+                         sum(sys.getsizeof(gender) for gender in distinct.values()))
+    return report
+
+
+def print_memory_report(report: dict[str, tuple[int, int]]) -> None:
+    """Print the given memory report as a table."""
+    print(f'{"Category":<14}{"Before (MB)":>14}{"After (MB)":>14}{"Saved (MB)":>14}')
+    total_before = 0
+    total_after = 0
+    for category, (before, after) in report.items():
+        total_before += before
+        total_after += after
+        print(f'{category:<14}{before / 2 ** 20:>14.2f}{after / 2 ** 20:>14.2f}'
+              f'{(before - after) / 2 ** 20:>14.2f}')
+    print(f'{"total":<14}{total_before / 2 ** 20:>14.2f}{total_after / 2 ** 20:>14.2f}'
+          f'{(total_before - total_after) / 2 ** 20:>14.2f}')
+
+
+if __name__ == '__main__':
+    from data_loader import create_anime_graph_from_data
+
+    print_memory_report(graph_memory_report(
+        create_anime_graph_from_data('Data/animes.csv', 'Data/profiles.csv', 'Data/reviews.csv')))
@@ -0,0 +1,221 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The minhash_lsh module.
+
+This module contains the definition of the MinHashLSH class, an
+approximate nearest neighbor index of users under the Jaccard
+similarity of their reviews. MinHash signatures of the users'
+reviewed anime are split into bands, and users whose signatures
+agree on a whole band become candidate neighbors. Only candidates
+are compared exactly.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Callable, Optional
+
+import numpy as np
+
+import instrumentation
+from top_k import top_k_indices
+
+if TYPE_CHECKING:
+    from anime_graph import AnimeGraph, User
+
+# A Mersenne prime larger than every token, so that (a * x + b) fits in 64 bits.
+_PRIME = (1 << 31) - 1
+
+# The default shape of the index. More bands give a higher recall, more rows per band give
+# fewer candidates. The similarity at which a pair becomes a candidate with probability 1/2
+# is about (1 / num_bands) ** (1 / rows_per_band).
+DEFAULT_NUM_BANDS = 32
+DEFAULT_ROWS_PER_BAND = 2
+
+
+class MinHashLSH:
+    """A banded locality-sensitive hashing index of MinHash signatures of users.
+
+    If strict is True, the tokens of a user are the (anime, score) pairs of their reviews,
+    so that the signatures estimate the Jaccard similarity where only reviews with equal
+    scores count as shared, as in distance_measures.jaccard_distance. Otherwise, the tokens
+    are the reviewed anime.
+
+    Instance Attributes:
+        - num_bands: The number of bands of a signature.
+        - rows_per_band: The number of MinHash values in a band.
+        - strict: Whether the tokens include the review scores.
+    """
+    num_bands: int
+    rows_per_band: int
+    strict: bool
+
+    # Private Instance Attributes:
+    #     - _a, _b: The coefficients of the hash functions (a * x + b) mod _PRIME.
+    #     - _signatures: A mapping of users to a tuple (version, signature), where version
+    #       is the version of the user the signature was computed from.
+    #     - _buckets: For each band, a mapping of band values to the users having them.
+    _a: np.ndarray
+    _b: np.ndarray
+    _signatures: dict[User, tuple[int, np.ndarray]]
+    _buckets: list[dict[bytes, set[User]]]
+
+    def __init__(self, num_bands: int = DEFAULT_NUM_BANDS,
+                 rows_per_band: int = DEFAULT_ROWS_PER_BAND,
+                 strict: bool = True, seed: int = 111) -> None:
+        """Initialize an empty index."""
+        self.num_bands = num_bands
+        self.rows_per_band = rows_per_band
+        self.strict = strict
+        rng = np.random.default_rng(seed)
+        num_hashes = num_bands * rows_per_band
+        self._a = rng.integers(1, _PRIME, num_hashes, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, num_hashes, dtype=np.uint64)
+        self._signatures = {}
+        self._buckets = [{} for _ in range(num_bands)]
+
+    def __len__(self) -> int:
+        """Returns the number of users in the index."""
+        return len(self._signatures)
+
+    def index_graph(self, graph: AnimeGraph, chunk_size: int = 32768) -> None:
+        """Add all the users of the given graph that have reviews to the index.
+        The signatures are computed for batches of users whose reviews add up to about
+        chunk_size tokens at a time.
+        """
+        batch = []
+        batch_tokens = 0
+        for user in graph.users.values():
+            if user not in self._signatures and len(user.neighbor_anime) > 0:
+                batch.append(user)
+                batch_tokens += len(user.neighbor_anime)
+                if batch_tokens >= chunk_size:
+                    self._add_batch(batch)
+                    batch = []
+                    batch_tokens = 0
+        self._add_batch(batch)
+
+    def update(self, user: User) -> None:
+        """Add the given user to the index, or recompute their signature if their reviews
+        changed since it was computed. Users without reviews are not indexed.
+        """
+        if user in self._signatures:
+            version, signature = self._signatures[user]
+            if version == user.version:
+                return
+            self._remove(user, signature)
+        if len(user.neighbor_anime) == 0:
+            return
+
+        signature = self._signature(user)
+        self._signatures[user] = (user.version, signature)
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(key, set()).add(user)
+
+    def candidates(self, user: User) -> set[User]:
+        """Returns the users that share at least one band with the given user.
+        The index is not changed: if the user is not in the index, or their reviews changed
+        since their signature was computed, a new signature is computed but not stored. So
+        several threads can look up candidates at the same time.
+        """
+        if user in self._signatures and self._signatures[user][0] == user.version:
+            signature = self._signatures[user][1]
+        elif len(user.neighbor_anime) == 0:
+            return set()
+        else:
+            signature = self._signature(user)
+        found = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            found.update(self._buckets[band].get(key, ()))
+        found.discard(user)
+        return found
+
+    def most_similar_users(self, user: User, limit: int = 50,
+                           stop: Optional[Callable[[], bool]] = None) -> list[User]:
+        """Returns the candidate neighbors of the given user with the highest exact strict
+        Jaccard similarity, up to a limit, most similar first.
+        stop is checked before each exact comparison: once it returns True, the search is
+        abandoned and the returned list is incomplete.
+        """
+        scored = []
+        for other in self.candidates(user):
+            if stop is not None and stop():
+                break
+            scored.append((other, strict_jaccard_similarity(user, other)))
+        instrumentation.count('pairwise_comparisons', len(scored))
+        instrumentation.count('users_compared', len(scored))
+        similarities = np.fromiter((tup[1] for tup in scored), np.float64, len(scored))
+        vids = np.fromiter((tup[0].vid for tup in scored), np.int64, len(scored))
+        return [scored[i][0] for i in top_k_indices(similarities, limit, ties=vids).tolist()]
+
+    def copy(self, users: dict[str, User]) -> MinHashLSH:
+        """Returns a copy of this index for a copy of its graph, whose users by username are
+        given. The signatures, which are never mutated, are shared with this index."""
+        index = MinHashLSH(self.num_bands, self.rows_per_band, self.strict)
+        index._a, index._b = self._a, self._b
+        index._signatures = {users[user.username]: entry
+                             for user, entry in self._signatures.items()}
+        index._buckets = [{key: {users[user.username] for user in bucket}
+                           for key, bucket in buckets.items()} for buckets in self._buckets]
+        return index
+
+    def _add_batch(self, users: list[User]) -> None:
+        """Add the given users, which all have reviews and are not in the index yet."""
+        if len(users) == 0:
+            return
+        lengths = np.array([len(user.neighbor_anime) for user in users])
+        tokens = np.concatenate([self._tokens(user) for user in users])
+        hashes = (self._a[:, None] * tokens[None, :] + self._b[:, None]) % np.uint64(_PRIME)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        signatures = np.minimum.reduceat(hashes, starts, axis=1).T
+        for user, signature in zip(users, signatures):
+            self._signatures[user] = (user.version, signature)
+            for band, key in enumerate(self._band_keys(signature)):
+                self._buckets[band].setdefault(key, set()).add(user)
+
+    def _remove(self, user: User, signature: np.ndarray) -> None:
+        """Remove the given user, with the given signature, from the buckets."""
+        del self._signatures[user]
+        for band, key in enumerate(self._band_keys(signature)):
+            bucket = self._buckets[band][key]
+            bucket.discard(user)
+            if len(bucket) == 0:
+                del self._buckets[band][key]
+
+    def _signature(self, user: User) -> np.ndarray:
+        """Returns the MinHash signature of the tokens of the given user."""
+        x = self._tokens(user)
+        hashes = (self._a[:, None] * x[None, :] + self._b[:, None]) % np.uint64(_PRIME)
+        return hashes.min(axis=1)
+
+    def _tokens(self, user: User) -> np.ndarray:
+        """Returns the tokens of the reviews of the given user, reduced modulo _PRIME."""
+        if self.strict:
+            tokens = [anime.uid * 64 + round(score * 4) for anime, score in
+                      user.neighbor_anime.items()]
+        else:
+            tokens = [anime.uid for anime in user.neighbor_anime]
+        return np.array(tokens, dtype=np.uint64) % np.uint64(_PRIME)
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        """Returns the bucket key of each band of the given signature."""
+        bands = signature.reshape(self.num_bands, self.rows_per_band)
+        return [band.tobytes() for band in bands]
+
+
+def strict_jaccard_similarity(user1: User, user2: User) -> float:
+    """Returns the Jaccard similarity of the reviews of two users, where two reviews of the
+    same anime are shared only if they have the same score. This is 1 - jaccard_distance.
+    """
+    if len(user1.neighbor_anime) > len(user2.neighbor_anime):
+        user1, user2 = user2, user1
+    if len(user1.neighbor_anime) == 0:
+        return 0.0
+    common_count = 0
+    strict_count = 0
+    reviews2 = user2.neighbor_anime
+    for anime, score in user1.neighbor_anime.items():
+        if anime in reviews2:
+            common_count += 1
+            strict_count += int(score == reviews2[anime])
+    return strict_count / (len(user1.neighbor_anime) + len(reviews2) - common_count)
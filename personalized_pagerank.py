@@ -0,0 +1,163 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The personalized_pagerank module.
+
+This module contains the definition of the PersonalizedPageRank
+class, a random walk with restart recommender over the users, anime
+and genres of an AnimeGraph. The walk restarts at the anime a user
+reviewed, and the anime it visits most often are recommended. The
+visiting probabilities are computed exactly by sparse power
+iteration, or approximately by simulating a batch of walks.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+from scipy import sparse
+
+from id_interning import IdMap
+from sparse_graph import SparseAnimeGraph
+
+# The default probability that the walk restarts at each step.
+DEFAULT_RESTART_PROBABILITY = 0.3
+# The default L1 distance between two iterates below which the power iteration stops.
+DEFAULT_TOLERANCE = 1e-6
+# The default maximum number of power iterations.
+DEFAULT_MAX_ITERATIONS = 100
+# The default number of simulated walks of the Monte-Carlo approximation.
+DEFAULT_NUM_WALKS = 2000
+
+
+class PersonalizedPageRank:
+    """The transition probabilities of a random walk on a snapshot of an AnimeGraph.
+
+    The vertices are numbered with users first, then anime, then genres, each in the order of
+    their dense ids. The edges are undirected, with weights:
+        - user–anime: the review score divided by 10.
+        - anime–genre: 1.
+        - user–genre: the positive part of the genre deviation of the user, divided by their
+        number of reviews and by 10, i.e. their mean liking of the genre per review on the
+        same scale as the scores.
+    From a vertex, the walk follows an edge with probability proportional to its weight.
+
+    Instance Attributes:
+        - transition: The column-stochastic transition matrix. Column i holds the
+        probabilities of the steps from vertex i. Columns of isolated vertices are empty.
+        - num_users: The number of user ids.
+        - num_anime: The number of anime ids.
+        - restart_probability: The probability that the walk restarts at each step.
+        - anime_ids: The id map of anime uids the graph was numbered with.
+    """
+    transition: sparse.csr_matrix
+    num_users: int
+    num_anime: int
+    restart_probability: float
+    anime_ids: IdMap
+
+    # Private Instance Attributes:
+    #     - _row_starts, _targets, _cumulative: The steps of the walk in CSR form, for the
+    #       Monte-Carlo simulation. The possible steps from vertex i are
+    #       _targets[_row_starts[i]:_row_starts[i + 1]], and _cumulative holds i plus the
+    #       cumulative probabilities of these steps, so that a step is sampled for many
+    #       walks at once with a single np.searchsorted over the whole array.
+    _row_starts: np.ndarray
+    _targets: np.ndarray
+    _cumulative: np.ndarray
+
+    def __init__(self, sparse_graph: SparseAnimeGraph,
+                 restart_probability: float = DEFAULT_RESTART_PROBABILITY) -> None:
+        """Initialize the walk on the given sparse graph."""
+        ratings = sparse_graph.ratings.astype(np.float64) / 10
+        membership = sparse_graph.membership.astype(np.float64)
+        counts = np.diff(ratings.indptr).astype(np.float64)
+        affinity = sparse_graph.affinity.tocsr().astype(np.float64)
+        affinity.data = np.maximum(affinity.data, 0.0) / 10
+        affinity = sparse.diags(1 / np.maximum(counts, 1)) @ affinity
+
+        self.num_users, self.num_anime = ratings.shape
+        self.restart_probability = restart_probability
+        self.anime_ids = sparse_graph.anime_ids
+
+        weights = sparse.bmat([[None, ratings, affinity],
+                               [ratings.T, None, membership],
+                               [affinity.T, membership.T, None]], format='csr')
+        weights.eliminate_zeros()
+        degrees = np.asarray(weights.sum(axis=1)).ravel()
+        steps = sparse.diags(np.divide(1.0, degrees, out=np.zeros_like(degrees),
+                                       where=degrees > 0)) @ weights
+        steps = steps.tocsr()
+        steps.sort_indices()
+        self.transition = steps.T.tocsr()
+
+        self._row_starts = steps.indptr
+        self._targets = steps.indices
+        row_of_entry = np.repeat(np.arange(steps.shape[0]), np.diff(steps.indptr))
+        # The last step of each row ends exactly at row + 1, despite rounding errors.
+        cumulative = np.cumsum(steps.data) - np.repeat(
+            np.concatenate([[0.0], np.cumsum(steps.data)])[steps.indptr[:-1]],
+            np.diff(steps.indptr))
+        cumulative[steps.indptr[1:][np.diff(steps.indptr) > 0] - 1] = 1.0
+        self._cumulative = row_of_entry + cumulative
+
+    def restart_vector(self, anime_vids: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """Returns the restart distribution over all the vertices that is proportional to the
+        given weights on the anime with the given dense ids.
+        Anime ids that were not in the graph snapshot are ignored.
+        """
+        known = anime_vids < self.num_anime
+        restart = np.zeros(self.transition.shape[0])
+        np.add.at(restart, self.num_users + anime_vids[known], weights[known])
+        total = restart.sum()
+        return restart / total if total > 0 else restart
+
+    def anime_scores(self, restart: np.ndarray, tolerance: float = DEFAULT_TOLERANCE,
+                     max_iterations: int = DEFAULT_MAX_ITERATIONS) -> tuple[np.ndarray, int]:
+        """Returns a tuple (a, b), where a is the personalized PageRank of each anime id for
+        the given restart distribution, and b is the number of power iterations run.
+        The iteration stops early when successive iterates are within tolerance in L1
+        distance. The probability of the walk at an isolated vertex goes back to the restart
+        distribution, so that the ranks always sum to 1.
+        """
+        ranks = restart.copy()
+        iterations = 0
+        while iterations < max_iterations:
+            iterations += 1
+            walked = self.transition @ ranks
+            lost = 1.0 - walked.sum()
+            updated = (1 - self.restart_probability) * walked + \
+                (self.restart_probability + (1 - self.restart_probability) * lost) * restart
+            converged = np.abs(updated - ranks).sum() < tolerance
+            ranks = updated
+            if converged:
+                break
+        return ranks[self.num_users:self.num_users + self.num_anime], iterations
+
+    def approximate_anime_scores(self, restart: np.ndarray, num_walks: int = DEFAULT_NUM_WALKS,
+                                 seed: Optional[int] = None) -> np.ndarray:
+        """Returns an estimate of the personalized PageRank of each anime id for the given
+        restart distribution: the fraction of the visits of num_walks simulated walks that
+        are to that anime. Each walk starts at the restart distribution and stops with the
+        restart probability at each step, or at an isolated vertex.
+        All the walks take their steps together, as NumPy array operations.
+        """
+        rng = np.random.default_rng(seed)
+        nonzero = np.flatnonzero(restart)
+        if len(nonzero) == 0:
+            return np.zeros(self.num_anime)
+        positions = rng.choice(nonzero, size=num_walks, p=restart[nonzero])
+        visits = np.zeros(self.transition.shape[0])
+        while len(positions) > 0:
+            visits += np.bincount(positions, minlength=len(visits))
+            starts = self._row_starts[positions]
+            moving = (rng.random(len(positions)) >= self.restart_probability) & \
+                (self._row_starts[positions + 1] > starts)
+            positions = positions[moving]
+            draws = positions + rng.random(len(positions))
+            # A draw lies in [row, row + 1), so the search lands within the row of its walk.
+            chosen = np.searchsorted(self._cumulative, draws, side='right')
+            chosen = np.minimum(chosen, self._row_starts[positions + 1] - 1)
+            positions = self._targets[chosen]
+        return visits[self.num_users:self.num_users + self.num_anime] / visits.sum()
@@ -0,0 +1,129 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The rating_store module.
+
+This module contains the rating store file format: the arrays of
+an ArrayGraph (the CSR review scores of users and anime as int32 ids
+and float32 scores, the genre affinities, the anime attributes and
+the string tables of usernames, titles and genre names) written one
+after the other as fixed-width binary arrays.
+
+Opening a store maps the file into memory and wraps each array with
+a read-only NumPy view of the mapping. Nothing is parsed or copied,
+so opening takes the same time whatever the size of the graph, and
+the pages of the file are only read from disk when the similarity
+and ranking methods of the ArrayGraph first touch them. Processes
+that open the same store share its pages in the page cache.
+
+The layout of a store is:
+    - the 8 bytes of MAGIC,
+    - the length in bytes of the header, as a little-endian uint64,
+    - the header: a UTF-8 JSON object with the format version and, for each array, its
+      offset in the file in bytes, its length and its dtype,
+    - the arrays, each starting at a multiple of _ALIGNMENT bytes.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+
+import numpy as np
+
+from array_graph import ARRAY_DTYPES, ArrayGraph
+
+# The first bytes of a rating store file.
+MAGIC = b'ANIMERS\x00'
+# The version of the format written by save_graph. Version 2 added anime_uids_sorted.
+FORMAT_VERSION = 2
+# The alignment of each array in the file, in bytes.
+_ALIGNMENT = 64
+
+
+def save_graph(array_graph: ArrayGraph, filepath: str) -> None:
+    """Write the arrays of the given graph to a rating store file.
+    The file is replaced atomically, so a reader never sees a partially written store.
+    """
+    layout = {}
+    header = b''
+    # The offsets depend on the length of the header, which depends on the offsets, so the
+    # header is laid out again until its length does not change.
+    while True:
+        start = -(-(len(MAGIC) + 8 + len(header)) // _ALIGNMENT) * _ALIGNMENT
+        offset = start
+        for name in ARRAY_DTYPES:
+            array = array_graph.arrays[name]
+            layout[name] = [offset, len(array), np.dtype(ARRAY_DTYPES[name]).str]
+            offset += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+        new_header = json.dumps({'version': FORMAT_VERSION, 'arrays': layout}).encode('utf8')
+        stable = len(new_header) == len(header)
+        header = new_header
+        if stable:
+            break
+
+    temp_filepath = filepath + '.tmp'
+    with open(temp_filepath, 'wb') as file:
+        file.write(MAGIC)
+        file.write(len(header).to_bytes(8, 'little'))
+        file.write(header)
+        for name, (offset, _, _) in layout.items():
+            file.write(b'\x00' * (offset - file.tell()))
+            file.write(np.ascontiguousarray(array_graph.arrays[name], ARRAY_DTYPES[name])
+                       .tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_filepath, filepath)
+
+
+def open_graph(filepath: str) -> ArrayGraph:
+    """Returns the ArrayGraph over read-only views of the arrays of the given rating store
+    file, which is mapped into memory. The mapping is released once the graph and every
+    view of its arrays are no longer used.
+
+    Raises ValueError if the file is not a rating store of this version, or was written on a
+    machine of a different byte order.
+    """
+    with open(filepath, 'rb') as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{filepath} is not a rating store')
+    header_length = int.from_bytes(buffer[len(MAGIC):len(MAGIC) + 8], 'little')
+    header = json.loads(buffer[len(MAGIC) + 8:len(MAGIC) + 8 + header_length].decode('utf8'))
+    if header['version'] != FORMAT_VERSION:
+        raise ValueError(f'{filepath} has version {header["version"]} of the format, '
+                         f'not {FORMAT_VERSION}')
+
+    arrays = {}
+    for name, dtype in ARRAY_DTYPES.items():
+        offset, length, dtype_str = header['arrays'][name]
+        if dtype_str != np.dtype(dtype).str:
+            raise ValueError(f'{filepath}: {name} has dtype {dtype_str}, '
+                             f'not {np.dtype(dtype).str}')
+        if offset + length * np.dtype(dtype).itemsize > len(buffer):
+            raise ValueError(f'{filepath} is truncated')
+        arrays[name] = np.frombuffer(buffer, dtype, length, offset)
+    return ArrayGraph(arrays)
+
+
+if __name__ == '__main__':
+    import time
+    from data_loader import create_anime_graph_from_data
+
+    start = time.perf_counter()
+    graph = create_anime_graph_from_data('Data/animes.csv', 'Data/profiles.csv',
+                                         'Data/reviews.csv')
+    built = ArrayGraph.from_graph(graph)
+    print(f'load from CSV and convert: {time.perf_counter() - start:.3f} s')
+    save_graph(built, 'Data/ratings.store')
+
+    start = time.perf_counter()
+    stored = open_graph('Data/ratings.store')
+    print(f'open the rating store: {(time.perf_counter() - start) * 1000:.3f} ms')
+    user_vid = stored.user_vid('DesolatePsyche')
+    start = time.perf_counter()
+    recommended = stored.recommend_by_users(user_vid)
+    print(f'first recommendation, faulting pages in: '
+          f'{(time.perf_counter() - start) * 1000:.3f} ms')
+    print([stored.title(vid) for vid in recommended.tolist()])
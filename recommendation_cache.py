@@ -0,0 +1,124 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The recommendation_cache module.
+
+This module contains the definition of the RecommendationCache
+class, which keeps recent recommendation results so that they are
+not computed again while nothing relevant to the user has changed.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+# The default maximum number of cached results.
+DEFAULT_MAX_SIZE = 1024
+# The default number of seconds a cached result stays valid.
+DEFAULT_TTL = 600.0
+
+
+class RecommendationCache:
+    """A cache of recommendation results, with least-recently-used eviction.
+
+    Each entry is stored with the version of the user state it was computed from. An entry
+    is only returned for the same version, so bumping the version of a user (e.g. when they
+    add a review) invalidates all of their entries. Entries also expire after ttl seconds,
+    since the reviews of other users change the results too.
+
+    The cache can be shared between threads without a lock: each operation tolerates entries
+    that other threads remove concurrently. The metrics may undercount under contention.
+
+    Instance Attributes:
+        - max_size: The maximum number of entries.
+        - ttl: The number of seconds an entry stays valid.
+        - hits: The number of lookups that returned a cached result.
+        - misses: The number of lookups that did not.
+        - evictions: The number of entries removed to make room for new ones.
+        - expirations: The number of entries removed because they were older than ttl.
+        - invalidations: The number of entries removed because the user state changed.
+    """
+    max_size: int
+    ttl: float
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    invalidations: int
+
+    # Private Instance Attributes:
+    #     - _entries: A mapping of keys to tuples (version, expiry time, result), in
+    #       least-recently-used order.
+    #     - _clock: The function returning the current time in seconds.
+    _entries: OrderedDict[Hashable, tuple[int, float, Any]]
+    _clock: Callable[[], float]
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl: float = DEFAULT_TTL,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """Initialize an empty cache."""
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        """Returns the number of entries in the cache."""
+        return len(self._entries)
+
+    def get(self, key: Hashable, version: int) -> Optional[Any]:
+        """Returns the result cached for the given key and user state version.
+        Returns None if there is no such valid result.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        entry_version, expiry, result = entry
+        if entry_version != version:
+            self._entries.pop(key, None)
+            self.invalidations += 1
+            self.misses += 1
+            return None
+        elif expiry <= self._clock():
+            self._entries.pop(key, None)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        try:
+            self._entries.move_to_end(key)
+        except KeyError:
+            pass  # Removed by another thread since the lookup, but the result is still valid.
+        self.hits += 1
+        return result
+
+    def put(self, key: Hashable, version: int, result: Any) -> None:
+        """Cache the result computed for the given key at the given user state version.
+        The least recently used entry is evicted if the cache is full.
+        """
+        self._entries[key] = (version, self._clock() + self.ttl, result)
+        try:
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        except KeyError:
+            pass  # Another thread removed the entry or emptied the cache meanwhile.
+
+    def clear(self) -> None:
+        """Remove all entries. The metrics are kept."""
+        self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        """Returns the metrics of this cache."""
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expirations': self.expirations,
+                'invalidations': self.invalidations}
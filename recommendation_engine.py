@@ -9,15 +9,28 @@ class and its related function implementations.
 """
 
 from __future__ import annotations
-from typing import Optional, Callable, Union
-import csv
+from typing import Optional, Callable, Union, Iterable
+
+import numpy as np
 
 import graph_visualization
+import instrumentation
 from anime_graph import AnimeGraph, Anime, User
 from distance_measures import jaccard_distance
+from hybrid_recommender import HybridRecommender
+from item_similarity import ItemSimilarityModel, build_item_similarity
+from matrix_factorization import LatentFactorModel, train_als
+from personalized_pagerank import PersonalizedPageRank
+from recommendation_cache import RecommendationCache
+from recommendation_explain import Explanation, explain
+from recommendation_scoring import NUM_LIKED_GENRES, NUM_SIMILAR_USERS, favorite_anime, \
+    genre_scores, predicted_scores
+from storage import CsvStorage, Storage
+from top_k import top_k_indices, top_k_keys
 
-# The lowest score that indicate a favorite anime.
-SCORE_FAVORITE = 9
+# The strategies of recommend.
+STRATEGIES = ('auto', 'genres', 'users', 'score prediction', 'latent factors', 'item-item',
+              'pagerank', 'approximate pagerank', 'hybrid')
 
 
 class RecommendationEngine:
@@ -28,20 +41,40 @@ class RecommendationEngine:
         - graph: The graph containing anime, users, and genres.
         - gui: The gui instance of the class GUI, for interaction with the app user.
         - anime_id_to_name: A mapping of anime ids to their name for name look up.
+        - cache: The cache of the results of recommend.
+        - latent_model: The latent factor model of the 'latent factors' strategy, or None if
+        it has not been trained or loaded yet, in which case the strategy recommends nothing.
+        - item_model: The anime neighbor lists of the 'item-item' strategy, or None if they
+        have not been built or loaded yet, in which case the strategy recommends nothing.
+        - pagerank_model: The random walk of the 'pagerank' strategies, or None if it has not
+        been built yet, in which case the strategies recommend nothing.
+        - hybrid: The cascade of strategies of the 'hybrid' strategy.
     """
     _graph: AnimeGraph
+    cache: RecommendationCache
+    latent_model: Optional[LatentFactorModel]
+    item_model: Optional[ItemSimilarityModel]
+    pagerank_model: Optional[PersonalizedPageRank]
+    hybrid: HybridRecommender
 
-    def __init__(self, graph: AnimeGraph) -> None:
+    def __init__(self, graph: AnimeGraph, cache: Optional[RecommendationCache] = None) -> None:
         """Initializing the Engine."""
         self._graph = graph
+        self.cache = cache if cache is not None else RecommendationCache()
+        self.latent_model = None
+        self.item_model = None
+        self.pagerank_model = None
+        self.hybrid = HybridRecommender(self)
 
     def check_user_exists(self, username: str) -> bool:
         """Returns whether the username is in the system."""
         return username in self._graph.users
 
-    def register(self, username: str, gender: str, date_birth: str, filepath: str) -> bool:
+    def register(self, username: str, gender: str, date_birth: str,
+                 filepath: Union[str, Storage]) -> bool:
         """Register for a new user. If the user is already in the system, return false.
         If the registering is successful, return true.
+        filepath is the profiles file the user is appended to, or the storage they are saved in.
         Preconditions:
             - username != ''
             - gender in {'male', 'female', 'other'}
@@ -51,32 +84,51 @@ class RecommendationEngine:
         if username in self._graph.users:
             return False
         else:
-            new_row = [username, gender, date_birth, []]
-            with open(filepath, 'a+', newline='') as fd:
-                writer = csv.writer(fd)
-                writer.writerow(new_row)
+            storage = CsvStorage(profiles_filepath=filepath) if isinstance(filepath, str) \
+                else filepath
+            storage.add_user(username, gender, date_birth)
             self._graph.add_user(username, gender, int(date_birth[-4:]))
             return True
 
     def add_review(self, username: str, anime_uid: int, review_score: float,
-                   reviews_filepath: str) -> None:
+                   reviews_filepath: Union[str, Storage],
+                   timestamp: Optional[float] = None) -> None:
         """Add a review to the database and the graph.
+        reviews_filepath is the reviews file the review is appended to, or the storage it is
+        saved in. timestamp is the time of the review, or now if it is None.
         Preconditions:
             - username in self._graph
             - anime in self._graph
         """
-        # String form of the score
-        s = str(review_score)
-        # For now we don't use the details of categorized score yet
-        pseudo_details = {'Overall': s, 'Story': s, 'Animation': s, 'Sound': s,
-                          'Character': s, 'Enjoyment': s}
-        # The '0' is a temporary review ID, we don't need it for now.
-        new_row = ['0', username, anime_uid, s, pseudo_details]
-        with open(reviews_filepath, 'a+', newline='') as fd:
-            writer = csv.writer(fd)
-            writer.writerow(new_row)
+        storage = CsvStorage(reviews_filepath=reviews_filepath) \
+            if isinstance(reviews_filepath, str) else reviews_filepath
+        storage.add_review(username, anime_uid, review_score)
         # This will overwrite the current user-anime edge, if there is any.
-        self._graph.add_review(username, anime_uid, review_score)
+        self._graph.add_review(username, anime_uid, review_score, timestamp)
+
+    def ingest_reviews(self, reviews: Iterable[tuple[str, int, float, Optional[float]]]) \
+            -> int:
+        """Add reviews that are already in the reviews file, as tuples (username, anime_uid,
+        score, timestamp), to the graph only. Returns the number of users whose reviews
+        changed. Their cached recommendations are invalidated by their new versions.
+        """
+        return len(self._graph.add_reviews(reviews))
+
+    def fetch_user(self, username: str) -> User:
+        """Returns the user with the given username.
+        Preconditions:
+            - username in self._graph.users
+        """
+        return self._graph.users[username]
+
+    def similar_users(self, username: str, limit: int = 100,
+                      distant_measure: Union[Callable[[User, User], float], str] = 'custom',
+                      stop: Optional[Callable[[], bool]] = None) -> list[User]:
+        """Returns the users most similar to the given user, up to a limit, most similar
+        first. The search is abandoned once stop returns True, and the list is then
+        incomplete."""
+        return self._graph.most_similar_users(self._graph.users[username], distant_measure,
+                                              limit=limit, stop=stop)
 
     def fetch_new_anime(self, limit: int = 10) -> list[Anime]:
         """Returns a list of newly released anime, up to a limit."""
@@ -99,40 +151,95 @@ class RecommendationEngine:
         """Return the list of all anime genres, sorted in alphabetical order."""
         return self._graph.fetch_all_genres()
 
-    def recommend(self, username: str, limit: int = 10) -> list[Anime]:
+    def recommend(self, username: str, limit: int = 10, strategy: str = 'auto',
+                  distant_measure: Union[Callable[[User, User], float], str] = 'custom') \
+            -> list[Anime]:
         """Returns a list of anime for the given user, as suggestions.
         Returns an empty list if the user has not reviewed any anime.
+        Results are cached until the user adds a review or the cache entry expires.
         Function Parameters:
             - limit: the maximum number of allowed
+            - strategy: 'auto' chooses by the number of reviews of the user. Otherwise, one of
+            'genres', 'users', 'score prediction', 'latent factors', 'item-item', 'pagerank',
+            'approximate pagerank' or 'hybrid'.
+            - distant_measure: the measure of user proximity of the 'users' strategy.
+
+        Raises ValueError if strategy is not in STRATEGIES.
         """
-        if len(self._graph.users[username].neighbor_anime) == 0:
-            return []
-        elif len(self._graph.users[username].neighbor_anime) < 3:
-            return self.recommend_by_genres(username, limit)
-        else:
-            return self.recommend_by_users(username, limit)
+        if strategy not in STRATEGIES:
+            raise ValueError(f'Unknown strategy: {strategy}')
+        user = self._graph.users[username]
+        # A callable measure is keyed by the callable itself, which is hashable, so that two
+        # different lambdas or partial functions never share an entry.
+        key = (username, strategy, limit, distant_measure)
+        cached = self.cache.get(key, user.version)
+        if cached is not None:
+            instrumentation.count('cache_hits')
+            return list(cached)
+        instrumentation.count('cache_misses')
+
+        cacheable = True
+        # The stages of each strategy have their own spans.
+        with instrumentation.span('engine.recommend'):
+            if strategy == 'auto':
+                if len(user.neighbor_anime) == 0:
+                    result = []
+                elif len(user.neighbor_anime) < 3:
+                    result = self.recommend_by_genres(username, limit)
+                else:
+                    result = self.recommend_by_users(username, limit, distant_measure)
+            elif strategy == 'genres':
+                result = self.recommend_by_genres(username, limit)
+            elif strategy == 'users':
+                result = self.recommend_by_users(username, limit, distant_measure)
+            elif strategy == 'latent factors':
+                result = self.recommend_by_latent_factors(username, limit)
+            elif strategy == 'item-item':
+                result = self.recommend_by_similar_anime(username, limit)
+            elif strategy in {'pagerank', 'approximate pagerank'}:
+                result = self.recommend_by_pagerank(username, limit, strategy != 'pagerank')
+            elif strategy == 'hybrid':
+                hybrid_result = self.hybrid.recommend(username, limit,
+                                                      distant_measure=distant_measure)
+                result = hybrid_result.anime
+                # A result degraded by the latency budget is not cached, so that the next
+                # request tries the whole cascade again.
+                cacheable = not hybrid_result.over_budget
+            else:  # strategy == 'score prediction'
+                result = self.recommend_by_score_prediction(username, limit)
+
+        instrumentation.observe('recommendations_returned', len(result))
+        if cacheable:
+            self.cache.put(key, user.version, result)
+        return list(result)
+
+    def explain(self, username: str, limit: int = 10, strategy: str = 'auto',
+                distant_measure: Union[Callable[[User, User], float], str] = 'custom') \
+            -> Explanation:
+        """Returns the recommendations of recommend for the given user, computed again without
+        the cache, with the work each stage did, its running time, and the neighbors, genres
+        or anime each recommendation came from.
+
+        Preconditions:
+            - username in self._graph.users
+        """
+        return explain(self, self._graph, username, limit, strategy, distant_measure)
+
+    def cache_stats(self) -> dict[str, int]:
+        """Returns the hit, miss and eviction metrics of the recommendation cache."""
+        return self.cache.stats()
 
     def recommend_by_genres(self, username: str, limit: int = 10) -> list[Anime]:
         """Returns a list of most matched anime in term of genres, up to a limit, sorted by match
         score and popularity, excluding the anime in the set exclusions."""
         user = self._graph.users[username]
-        genres = user.best_liked_genres(5)
-        matched_so_far = {}
-        num_ani = len(self._graph.anime)
+        genres = user.best_liked_genres(NUM_LIKED_GENRES)
         exclusions = set(user.neighbor_anime.keys())
-        for tup in genres:
-            for anime in tup[0].neighbor_anime:
-                if anime not in exclusions and anime.popularity is not None:
-                    if anime in matched_so_far:
-                        matched_so_far[anime] += (num_ani - anime.popularity) / 10 * tup[1]
-                    else:
-                        matched_so_far[anime] = (num_ani - anime.popularity) / 10 * tup[1]
-        result_list = [(ani, matched_so_far[ani]) for ani in matched_so_far]
-        result_list.sort(key=lambda x: x[1], reverse=True)
-        if len(result_list) <= limit:
-            return [ele[0] for ele in result_list]
-        else:
-            return [ele[0] for ele in result_list[:limit]]
+        with instrumentation.span('genres.score'):
+            matched_so_far, _ = genre_scores(genres, exclusions, len(self._graph.anime))
+        instrumentation.count('anime_scored', len(matched_so_far))
+        with instrumentation.span('genres.sort'):
+            return top_k_keys(matched_so_far, limit)
 
     def recommend_by_users(self, username: str, limit: int = 10,
                            distant_measure: Union[Callable[[User, User], float], str] = 'custom') \
@@ -140,35 +247,176 @@ class RecommendationEngine:
         """Returns a list of anime recommendations, up to a limit, based on similar users.
         """
         user = self._graph.users[username]
-        # By default, get 100 most similar users.
         exclusions = set(user.neighbor_anime.keys())
-        similar_users = self._graph.most_similar_users(user, distant_measure, limit=100)
-        recommended_so_far = set()
-        result_list = []
-        for user in similar_users:
-            for anime in user.neighbor_anime:
-                rating = user.neighbor_anime[anime]
-                if anime not in exclusions and rating >= SCORE_FAVORITE and \
-                        anime not in recommended_so_far:
-                    recommended_so_far.add(anime)
-                    # Adding like this keeps the most relevant recommendations to the start of the
-                    # list.
-                    result_list.append(anime)
-                    if len(result_list) >= limit:
-                        return result_list
-        return result_list
+        with instrumentation.span('users.similar_users'):
+            similar_users = self._graph.most_similar_users(user, distant_measure,
+                                                           limit=NUM_SIMILAR_USERS)
+        instrumentation.observe('similar_users_found', len(similar_users))
+        with instrumentation.span('users.collect_favorites'):
+            return favorite_anime(similar_users, exclusions, limit)[0]
 
     def recommend_by_score_prediction(self, username: str, limit: int = 10) -> list[Anime]:
         """Returns a list of anime recommendations, up to a limit, based on score predictions
         calculated from similar users."""
         user = self._graph.users[username]
         exclusions = set(user.neighbor_anime.keys())
-        scores_so_far = []
-        for anime in self._graph.anime.values():
-            if anime not in exclusions:
-                scores_so_far.append((anime, self.predict_review_score(user, anime)))
-        scores_so_far.sort(key=lambda x: x[1], reverse=True)
-        return [tup[0] for tup in scores_so_far[:limit]]
+        with instrumentation.span('score_prediction.predict'):
+            candidates, scores = predicted_scores(user, self._graph.anime.values(), exclusions,
+                                                  self.predict_review_score)
+        instrumentation.count('anime_scored', len(candidates))
+        with instrumentation.span('score_prediction.sort'):
+            return [candidates[i] for i in top_k_indices(scores, limit).tolist()]
+
+    def train_latent_factors(self, factors: int = 32, iterations: int = 10,
+                             regularization: float = 0.1) -> LatentFactorModel:
+        """Train the latent factor model on the reviews currently in the graph, use it for the
+        'latent factors' strategy, and return it."""
+        ratings = self._graph.to_sparse().ratings
+        user_factors, anime_factors, global_mean = train_als(ratings, factors, regularization,
+                                                             iterations)
+        self.latent_model = LatentFactorModel(user_factors, anime_factors, global_mean,
+                                              self._graph.user_ids, self._graph.anime_ids,
+                                              regularization)
+        self.cache.clear()
+        return self.latent_model
+
+    def load_latent_factors(self, filepath: str) -> None:
+        """Load the latent factor model saved in the given file, and use it for the
+        'latent factors' strategy.
+
+        Preconditions:
+            - The model was trained on a graph whose id maps were saved, and this graph was
+            loaded with the same id maps.
+        """
+        self.latent_model = LatentFactorModel.load(filepath)
+        self.cache.clear()
+
+    def recommend_by_latent_factors(self, username: str, limit: int = 10) -> list[Anime]:
+        """Returns a list of anime recommendations, up to a limit, with the highest scores
+        predicted by the latent factor model. Returns an empty list if no model was trained
+        with train_latent_factors or loaded with load_latent_factors: training takes much
+        longer than a request.
+        Users who were not in the training data are folded into the model from their reviews.
+        """
+        model = self.latent_model
+        user = self._graph.users[username]
+        if model is None or len(user.neighbor_anime) == 0:
+            return []
+
+        reviews = user.neighbor_anime
+        scores = model.predict_scores(model.user_vector(username, [a.uid for a in reviews],
+                                                        list(reviews.values())))
+        instrumentation.count('anime_scored', len(scores))
+        for anime in reviews:
+            if anime.uid in model.anime_ids and model.anime_ids.id_of(anime.uid) < len(scores):
+                scores[model.anime_ids.id_of(anime.uid)] = -np.inf
+
+        # Select the best candidates, with a margin for anime no longer in the graph, ties
+        # broken by id.
+        result = []
+        for vid in top_k_indices(scores, limit + len(reviews)).tolist():
+            uid = model.anime_ids.key_of(vid)
+            if scores[vid] > -np.inf and uid in self._graph.anime:
+                result.append(self._graph.anime[uid])
+                if len(result) >= limit:
+                    break
+        return result
+
+    def build_item_similarity(self, num_neighbors: int = 50) -> ItemSimilarityModel:
+        """Build the anime neighbor lists from the reviews currently in the graph, use them for
+        the 'item-item' strategy, and return them."""
+        self.item_model = build_item_similarity(self._graph.to_sparse().ratings,
+                                                self._graph.anime_ids, num_neighbors)
+        self.cache.clear()
+        return self.item_model
+
+    def load_item_similarity(self, filepath: str) -> None:
+        """Load the anime neighbor lists saved in the given file, and use them for the
+        'item-item' strategy.
+
+        Preconditions:
+            - The lists were built on a graph whose id maps were saved, and this graph was
+            loaded with the same id maps.
+        """
+        self.item_model = ItemSimilarityModel.load(filepath)
+        self.cache.clear()
+
+    def recommend_by_similar_anime(self, username: str, limit: int = 10) -> list[Anime]:
+        """Returns a list of anime recommendations, up to a limit, that are most similar to
+        the anime the user reviewed. Each reviewed anime votes for its neighbors with its
+        similarity to them, weighted by how much the user's score is above their mean score.
+        If all the scores of the user are equal, all the votes have weight 1.
+        Returns an empty list if the neighbor lists were not built with build_item_similarity
+        or loaded with load_item_similarity.
+        """
+        model = self.item_model
+        if model is None:
+            return []
+        reviews = self._graph.users[username].neighbor_anime
+        known = [(model.anime_ids.id_of(anime.uid), score) for anime, score in reviews.items()
+                 if anime.uid in model.anime_ids]
+        if len(known) == 0:
+            return []
+
+        vids = np.array([vid for vid, _ in known])
+        weights = np.array([score for _, score in known], dtype=np.float64)
+        weights -= weights.mean()
+        if not weights.any():
+            weights[:] = 1.0
+        candidates, scores = model.aggregate(vids, weights)
+        instrumentation.count('anime_scored', len(candidates))
+        order = np.lexsort((candidates, -scores))
+        result = []
+        for i in order.tolist():
+            uid = model.anime_ids.key_of(int(candidates[i]))
+            if scores[i] > 0 and uid in self._graph.anime and \
+                    self._graph.anime[uid] not in reviews:
+                result.append(self._graph.anime[uid])
+                if len(result) >= limit:
+                    break
+        return result
+
+    def build_pagerank(self, restart_probability: float = 0.3) -> PersonalizedPageRank:
+        """Build the random walk on the current graph, use it for the 'pagerank' strategies,
+        and return it."""
+        self.pagerank_model = PersonalizedPageRank(self._graph.to_sparse(), restart_probability)
+        self.cache.clear()
+        return self.pagerank_model
+
+    def recommend_by_pagerank(self, username: str, limit: int = 10,
+                              approximate: bool = False) -> list[Anime]:
+        """Returns a list of anime recommendations, up to a limit, with the highest
+        personalized PageRank for the user: the anime most visited by a random walk on the
+        users, anime and genres that restarts at the anime the user reviewed, weighted by
+        score. If approximate is True, the ranks are estimated by simulated walks instead of
+        power iteration. Returns an empty list if the walk was not built with build_pagerank.
+        """
+        model = self.pagerank_model
+        if model is None:
+            return []
+        reviews = self._graph.users[username].neighbor_anime
+        known = [(model.anime_ids.id_of(anime.uid), score) for anime, score in reviews.items()
+                 if anime.uid in model.anime_ids]
+        restart = model.restart_vector(np.array([vid for vid, _ in known], dtype=np.int64),
+                                       np.array([score for _, score in known], dtype=np.float64))
+        if not restart.any():
+            return []
+        if approximate:
+            scores = model.approximate_anime_scores(restart, seed=0)
+        else:
+            scores, iterations = model.anime_scores(restart)
+            instrumentation.observe('pagerank_iterations', iterations)
+        instrumentation.count('anime_scored', len(scores))
+
+        k = min(limit + len(reviews), int(np.count_nonzero(scores)))
+        result = []
+        for vid in top_k_indices(scores, k).tolist():
+            uid = model.anime_ids.key_of(vid)
+            if uid in self._graph.anime and self._graph.anime[uid] not in reviews:
+                result.append(self._graph.anime[uid])
+                if len(result) >= limit:
+                    break
+        return result
 
     def predict_review_score(self, user: User, anime: Anime) -> float:
         """Predict the score that the given user would give the given book.
@@ -190,10 +438,7 @@ class RecommendationEngine:
                 total_weight += score
 
         if total_weight > 0:
-            res = weighted_total_rating / total_weight
-            if res == 10.0:
-                print(anime)
-            return res
+            return weighted_total_rating / total_weight
         else:
             return anime.score if anime.score is not None else 0
 
@@ -0,0 +1,305 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The recommendation_explain module.
+
+This module contains the explain mode of the RecommendationEngine:
+the recommendations of a strategy for a user, along with the work it
+took (candidate neighbors visited, pairwise comparisons, anime scored,
+anime excluded, and the time of each stage) and the provenance of
+each recommendation, i.e. which neighbors, genres or reviewed anime
+contributed to it and by how much.
+
+The explained strategies return the same recommendations as the
+strategies of the engine. They bypass the recommendation cache.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Any, Callable, Union
+
+import numpy as np
+
+from distance_measures import jaccard_distance
+from recommendation_scoring import NUM_LIKED_GENRES, NUM_SIMILAR_USERS, SCORE_FAVORITE, \
+    favorite_anime, genre_scores, predicted_scores
+from top_k import top_k, top_k_indices, top_k_keys
+
+if TYPE_CHECKING:
+    from anime_graph import AnimeGraph, Anime, User, Vertex
+    from recommendation_engine import RecommendationEngine
+
+# The maximum number of contributions listed for a recommendation.
+MAX_CONTRIBUTIONS = 5
+
+
+class Explanation:
+    """The recommendations of a strategy for a user, with their cost and provenance.
+
+    Instance Attributes:
+        - username: The user the recommendations are for.
+        - strategy: The strategy that made the recommendations.
+        - anime: The recommended anime.
+        - stages: The stages of the strategy, in order, as tuples (a, b) of the name of the
+        stage and its running time in seconds.
+        - neighbors_visited: The number of candidate neighbor users that were scored.
+        - pairwise_comparisons: The number of similarity computations, or co-rating updates,
+        between the user and another user.
+        - anime_scored: The number of anime given a score.
+        - items_excluded: The number of anime skipped because the user already reviewed them.
+        - provenance: A mapping of each recommended anime to the list of tuples (a, b) of the
+        users, genres or anime a that contributed to it, and their contributions b, largest
+        contributions first.
+    """
+    username: str
+    strategy: str
+    anime: list[Anime]
+    stages: list[tuple[str, float]]
+    neighbors_visited: int
+    pairwise_comparisons: int
+    anime_scored: int
+    items_excluded: int
+    provenance: dict[Anime, list[tuple[Vertex, float]]]
+
+    def __init__(self, username: str, strategy: str) -> None:
+        """Initialize an explanation without recommendations or costs."""
+        self.username = username
+        self.strategy = strategy
+        self.anime = []
+        self.stages = []
+        self.neighbors_visited = 0
+        self.pairwise_comparisons = 0
+        self.anime_scored = 0
+        self.items_excluded = 0
+        self.provenance = {}
+
+    def total_time(self) -> float:
+        """Returns the total running time of the stages, in seconds."""
+        return sum(seconds for _, seconds in self.stages)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Returns a JSON-serializable description of this explanation."""
+        return {'username': self.username, 'strategy': self.strategy,
+                'anime': [anime.uid for anime in self.anime],
+                'stages': [{'name': name, 'seconds': seconds} for name, seconds in self.stages],
+                'total_seconds': self.total_time(),
+                'neighbors_visited': self.neighbors_visited,
+                'pairwise_comparisons': self.pairwise_comparisons,
+                'anime_scored': self.anime_scored,
+                'items_excluded': self.items_excluded,
+                'provenance': {str(anime.uid): [{'source': _vertex_name(source),
+                                                 'kind': source.kind, 'contribution': amount}
+                                                for source, amount in contributions]
+                               for anime, contributions in self.provenance.items()}}
+
+
+def explain(engine: RecommendationEngine, graph: AnimeGraph, username: str, limit: int = 10,
+            strategy: str = 'auto',
+            distant_measure: Union[Callable[[User, User], float], str] = 'custom') \
+        -> Explanation:
+    """Returns the explanation of the recommendations of the given strategy, as named in
+    RecommendationEngine.recommend, for the given user.
+    The 'genres', 'users', 'score prediction' and 'item-item' strategies have a full cost
+    breakdown and provenance. The other strategies only have their stage times and the number
+    of anime scored.
+
+    Raises ValueError if the strategy is not one of the strategies of recommend.
+
+    Preconditions:
+        - username in graph.users
+    """
+    user = graph.users[username]
+    if strategy == 'auto':
+        if len(user.neighbor_anime) == 0:
+            return Explanation(username, 'auto')
+        strategy = 'genres' if len(user.neighbor_anime) < 3 else 'users'
+
+    if strategy == 'genres':
+        return _explain_genres(graph, user, limit)
+    elif strategy == 'users':
+        return _explain_users(engine, graph, user, limit, distant_measure)
+    elif strategy == 'item-item':
+        return _explain_similar_anime(engine, user, limit)
+    elif strategy == 'hybrid':
+        explanation = Explanation(username, strategy)
+        result = engine.hybrid.recommend(username, limit, distant_measure=distant_measure)
+        explanation.anime = result.anime
+        explanation.stages = [(name, seconds) for name, seconds, _ in result.stages]
+        return explanation
+    elif strategy in {'latent factors', 'pagerank', 'approximate pagerank'}:
+        explanation = Explanation(username, strategy)
+        start = time.perf_counter()
+        if strategy == 'latent factors':
+            explanation.anime = engine.recommend_by_latent_factors(username, limit)
+        else:
+            explanation.anime = engine.recommend_by_pagerank(username, limit,
+                                                             strategy != 'pagerank')
+        explanation.stages.append(('recommend', time.perf_counter() - start))
+        explanation.anime_scored = len(graph.anime)
+        explanation.items_excluded = len(user.neighbor_anime)
+        return explanation
+    elif strategy == 'score prediction':
+        return _explain_score_prediction(engine, graph, user, limit)
+    else:
+        raise ValueError(f'Unknown strategy: {strategy}')
+
+
+def _explain_genres(graph: AnimeGraph, user: User, limit: int) -> Explanation:
+    """Returns the explanation of RecommendationEngine.recommend_by_genres. An anime gets a
+    contribution from each liked genre it belongs to."""
+    explanation = Explanation(user.username, 'genres')
+    start = time.perf_counter()
+    genres = user.best_liked_genres(NUM_LIKED_GENRES)
+    explanation.stages.append(('best liked genres', time.perf_counter() - start))
+
+    start = time.perf_counter()
+    contributions = {}
+    matched_so_far, explanation.items_excluded = genre_scores(
+        genres, set(user.neighbor_anime.keys()), len(graph.anime), contributions)
+    explanation.anime_scored = len(matched_so_far)
+    explanation.stages.append(('score', time.perf_counter() - start))
+
+    start = time.perf_counter()
+    explanation.anime = top_k_keys(matched_so_far, limit)
+    explanation.stages.append(('sort', time.perf_counter() - start))
+    explanation.provenance = {anime: _largest(contributions[anime])
+                              for anime in explanation.anime}
+    return explanation
+
+
+def _explain_users(engine: RecommendationEngine, graph: AnimeGraph, user: User, limit: int,
+                   distant_measure: Union[Callable[[User, User], float], str]) -> Explanation:
+    """Returns the explanation of RecommendationEngine.recommend_by_users. An anime gets a
+    contribution from each similar user who has it as a favorite: their score of the anime.
+    The first of them is the one that made the anime recommended. The costs only count the
+    work of the strategy, which stops once it has enough anime, not the work of collecting
+    the other contributions."""
+    explanation = Explanation(user.username, 'users')
+    start = time.perf_counter()
+    similar_users = engine.similar_users(user.username, NUM_SIMILAR_USERS, distant_measure)
+    explanation.stages.append(('similar users', time.perf_counter() - start))
+    explanation.neighbors_visited, explanation.pairwise_comparisons = \
+        _neighbor_search_cost(graph, user, distant_measure)
+
+    start = time.perf_counter()
+    result_list, explanation.anime_scored, explanation.items_excluded = favorite_anime(
+        similar_users, set(user.neighbor_anime.keys()), limit)
+    explanation.stages.append(('collect favorites', time.perf_counter() - start))
+    explanation.anime = result_list
+
+    contributions = {anime: [] for anime in result_list}
+    for other in similar_users:
+        for anime in result_list:
+            if other.neighbor_anime.get(anime, 0) >= SCORE_FAVORITE:
+                contributions[anime].append((other, other.neighbor_anime[anime]))
+    explanation.provenance = {anime: contributions[anime][:MAX_CONTRIBUTIONS]
+                              for anime in result_list}
+    return explanation
+
+
+def _explain_score_prediction(engine: RecommendationEngine, graph: AnimeGraph, user: User,
+                              limit: int) -> Explanation:
+    """Returns the explanation of RecommendationEngine.recommend_by_score_prediction. An anime
+    gets a contribution from each user who reviewed it: their share of the predicted score,
+    i.e. their score weighted by their Jaccard similarity with the user."""
+    explanation = Explanation(user.username, 'score prediction')
+    start = time.perf_counter()
+    candidates, scores = predicted_scores(user, graph.anime.values(),
+                                          set(user.neighbor_anime.keys()),
+                                          engine.predict_review_score)
+    explanation.stages.append(('predict scores', time.perf_counter() - start))
+    explanation.anime_scored = len(candidates)
+    explanation.items_excluded = len(graph.anime) - len(candidates)
+    explanation.pairwise_comparisons = sum(len(anime.neighbor_users) for anime in candidates)
+    explanation.neighbors_visited = len({other for anime in candidates
+                                         for other in anime.neighbor_users})
+
+    start = time.perf_counter()
+    explanation.anime = [candidates[i] for i in top_k_indices(scores, limit).tolist()]
+    explanation.stages.append(('sort', time.perf_counter() - start))
+
+    for anime in explanation.anime:
+        weighted = [(other, 1 - jaccard_distance(user, other), rating)
+                    for other, rating in anime.neighbor_users.items()]
+        total_weight = sum(weight for _, weight, _ in weighted if weight > 0)
+        explanation.provenance[anime] = _largest(
+            [(other, weight * rating / total_weight) for other, weight, rating in weighted
+             if weight > 0])
+    return explanation
+
+
+def _explain_similar_anime(engine: RecommendationEngine, user: User,
+                           limit: int) -> Explanation:
+    """Returns the explanation of RecommendationEngine.recommend_by_similar_anime. An anime
+    gets a contribution from each reviewed anime it is a neighbor of: its vote. The neighbors
+    visited are the reviewed anime whose neighbor lists are read."""
+    explanation = Explanation(user.username, 'item-item')
+    start = time.perf_counter()
+    explanation.anime = engine.recommend_by_similar_anime(user.username, limit)
+    explanation.stages.append(('aggregate neighbors', time.perf_counter() - start))
+
+    model = engine.item_model
+    if model is None:
+        return explanation
+    reviews = user.neighbor_anime
+    known = [(anime, model.anime_ids.id_of(anime.uid), score)
+             for anime, score in reviews.items() if anime.uid in model.anime_ids]
+    if len(known) == 0:
+        return explanation
+    # The votes are weighted as in recommend_by_similar_anime.
+    weights = np.array([score for _, _, score in known], dtype=np.float64)
+    weights -= weights.mean()
+    if not weights.any():
+        weights[:] = 1.0
+    explanation.neighbors_visited = len(known)
+    recommended = {anime.uid: anime for anime in explanation.anime}
+    candidates = set()
+    contributions = {anime: [] for anime in explanation.anime}
+    for (anime, vid, _), weight in zip(known, weights.tolist()):
+        for neighbor_vid, similarity in model.neighbors(vid):
+            explanation.pairwise_comparisons += 1
+            candidates.add(neighbor_vid)
+            uid = model.anime_ids.key_of(neighbor_vid)
+            if uid in recommended:
+                contributions[recommended[uid]].append((anime, weight * similarity))
+    explanation.anime_scored = len(candidates)
+    reviewed_uids = {anime.uid for anime in reviews}
+    explanation.items_excluded = sum(1 for vid in candidates
+                                     if model.anime_ids.key_of(vid) in reviewed_uids)
+    explanation.provenance = {anime: _largest(amounts) for anime, amounts in
+                              contributions.items()}
+    return explanation
+
+
+def _neighbor_search_cost(graph: AnimeGraph, user: User,
+                          distant_measure: Union[Callable[[User, User], float], str]) \
+        -> tuple[int, int]:
+    """Returns a tuple (a, b) of the number of candidate neighbors and the number of pairwise
+    comparisons of AnimeGraph.most_similar_users for the given user and distance measure."""
+    if distant_measure in ('custom', 'graph-based jaccard distance'):
+        # Every review of a reviewed anime by another user is one co-rating update.
+        updates = sum(len(anime.neighbor_users) - 1 for anime in user.neighbor_anime)
+        candidates = {other for anime in user.neighbor_anime for other in anime.neighbor_users}
+        candidates.discard(user)
+        return len(candidates), updates
+    elif distant_measure == 'approximate jaccard distance':
+        num_candidates = len(graph.lsh_index.candidates(user))
+        return num_candidates, num_candidates
+    else:
+        return len(graph.users) - 1, len(graph.users) - 1
+
+
+def _largest(contributions: list[tuple[Vertex, float]]) -> list[tuple[Vertex, float]]:
+    """Returns the MAX_CONTRIBUTIONS largest of the given contributions, largest first."""
+    return top_k(contributions, MAX_CONTRIBUTIONS, key=lambda x: x[1])
+
+
+def _vertex_name(vertex: Vertex) -> Union[str, int]:
+    """Returns the key of the given vertex: a username, an anime uid or a genre name."""
+    if vertex.kind == 'user':
+        return vertex.username
+    elif vertex.kind == 'anime':
+        return vertex.uid
+    else:
+        return vertex.genre_name
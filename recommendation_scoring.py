@@ -0,0 +1,89 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The recommendation_scoring module.
+
+This module contains the scoring loops of the 'genres', 'users' and
+'score prediction' strategies, and their constants. They are shared
+by the strategies of the RecommendationEngine, which only need the
+scores, and by the explain mode, which also records the work they
+did and where each score came from.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Callable, Iterable, Optional
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from anime_graph import Anime, Genre, User, Vertex
+
+# The lowest score that indicates a favorite anime.
+SCORE_FAVORITE = 9
+# The number of genres the user likes most that the 'genres' strategy matches anime with.
+NUM_LIKED_GENRES = 5
+# The number of most similar users whose favorites the 'users' strategy recommends.
+NUM_SIMILAR_USERS = 100
+
+
+def genre_scores(genres: list[tuple[Genre, float]], exclusions: set[Anime], num_anime: int,
+                 contributions: Optional[dict[Anime, list[tuple[Vertex, float]]]] = None) \
+        -> tuple[dict[Anime, float], int]:
+    """Returns a tuple (a, b) of the mapping of the anime of the given liked genres to their
+    match scores, and the number of anime skipped because they are in exclusions. An anime
+    gets from each liked genre it belongs to its liking score, weighted by the popularity of
+    the anime among num_anime anime. Anime without a popularity are not scored.
+    If contributions is given, the tuple (genre, amount) of each liked genre is appended to
+    the list of each anime it contributed to.
+    """
+    scores = {}
+    excluded = 0
+    for genre, liking in genres:
+        for anime in genre.neighbor_anime:
+            if anime in exclusions:
+                excluded += 1
+            elif anime.popularity is not None:
+                amount = (num_anime - anime.popularity) / 10 * liking
+                if anime in scores:
+                    scores[anime] += amount
+                else:
+                    scores[anime] = amount
+                if contributions is not None:
+                    contributions.setdefault(anime, []).append((genre, amount))
+    return scores, excluded
+
+
+def favorite_anime(similar_users: list[User], exclusions: set[Anime],
+                   limit: int) -> tuple[list[Anime], int, int]:
+    """Returns a tuple (a, b, c) of the favorite anime of the given users that are not in
+    exclusions, up to a limit, the number of reviews visited and the number of them skipped
+    because their anime is in exclusions. The anime are in order of the users, then of their
+    reviews, so the favorites of the most similar users come first.
+    """
+    recommended_so_far = set()
+    result_list = []
+    visited = 0
+    excluded = 0
+    for user in similar_users:
+        for anime, rating in user.neighbor_anime.items():
+            visited += 1
+            if anime in exclusions:
+                excluded += 1
+            elif rating >= SCORE_FAVORITE and anime not in recommended_so_far:
+                recommended_so_far.add(anime)
+                result_list.append(anime)
+                if len(result_list) >= limit:
+                    return result_list, visited, excluded
+    return result_list, visited, excluded
+
+
+def predicted_scores(user: User, anime: Iterable[Anime], exclusions: set[Anime],
+                     predict: Callable[[User, Anime], float]) \
+        -> tuple[list[Anime], np.ndarray]:
+    """Returns a tuple (a, b) of the given anime that are not in exclusions, in order, and
+    the array of the scores predict gives them for the user."""
+    candidates = [ani for ani in anime if ani not in exclusions]
+    scores = np.fromiter((predict(user, ani) for ani in candidates), np.float64,
+                         len(candidates))
+    return candidates, scores
@@ -0,0 +1,442 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The recommendation_server module.
+
+This module contains the definition of the RecommendationServer
+class, a headless HTTP/JSON service over the recommendation engine,
+built on asyncio streams. The event loop only parses requests and
+writes responses: recommendations and searches run on a thread pool
+against the snapshots of a ConcurrentRecommendationEngine, and
+registrations and reviews go through its single writer.
+
+Endpoints:
+    - GET  /users/<username>                  Whether the user exists (login check).
+    - POST /users                             Register {username, gender, date_birth}.
+    - POST /reviews                           Add {username, anime_uid, score}.
+    - GET  /recommend?username=&limit=&strategy=
+    - GET  /search?q=&limit=                  Anime whose titles start with q.
+    - GET  /anime?name=                       The anime with the given title.
+    - GET  /anime/new?limit=
+    - GET  /anime/popular?limit=
+    - GET  /genres
+    - GET  /genres/<genre>/popular?limit=
+    - GET  /metrics                           The instrumentation metrics, for Prometheus.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Union
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import instrumentation
+from anime_graph import Anime
+from concurrent_engine import ConcurrentRecommendationEngine, EngineSnapshot
+from recommendation_engine import STRATEGIES
+from storage import Storage
+from trie_auto_complete import Trie
+
+# The default number of threads computing recommendations and searches.
+DEFAULT_NUM_THREADS = 4
+# The number of seconds an idle keep-alive connection stays open.
+DEFAULT_IDLE_TIMEOUT = 15.0
+# The maximum size of a request body, in bytes.
+MAX_BODY_SIZE = 1 << 16
+# The maximum number of results of a list endpoint.
+MAX_LIMIT = 100
+
+_REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large',
+            414: 'URI Too Long', 431: 'Request Header Fields Too Large',
+            500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    """An error that is reported to the client with the given HTTP status.
+
+    Instance Attributes:
+        - status: The HTTP status code.
+        - message: The description of the error.
+    """
+    status: int
+    message: str
+
+    def __init__(self, status: int, message: str) -> None:
+        """Initialize an error."""
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class RecommendationServer:
+    """A local HTTP/JSON recommendation service.
+
+    Connections are kept alive between requests unless the client asks otherwise. Concurrent
+    identical read requests are coalesced: while a recommendation or a search is being
+    computed, the same request on the same snapshot waits for that computation instead of
+    starting another one.
+
+    Instance Attributes:
+        - engine: The engine serving the requests.
+        - trie: The trie of anime titles, for searches.
+        - profiles_filepath: The path to the profiles file that registrations are added to, or
+        the storage they are saved in.
+        - reviews_filepath: The path to the reviews file that reviews are added to, or the
+        storage they are saved in.
+        - idle_timeout: The number of seconds an idle connection stays open.
+    """
+    engine: ConcurrentRecommendationEngine
+    trie: Trie
+    profiles_filepath: Union[str, Storage]
+    reviews_filepath: Union[str, Storage]
+    idle_timeout: float
+
+    # Private Instance Attributes:
+    #     - _executor: The threads running the computations.
+    #     - _in_flight: A mapping of the keys of the read requests being computed to their
+    #       futures.
+    #     - _server: The asyncio server, or None if it is not started.
+    _executor: ThreadPoolExecutor
+    _in_flight: dict[tuple, asyncio.Future]
+    _server: Optional[asyncio.AbstractServer]
+
+    def __init__(self, engine: ConcurrentRecommendationEngine,
+                 profiles_filepath: Union[str, Storage], reviews_filepath: Union[str, Storage],
+                 num_threads: int = DEFAULT_NUM_THREADS,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT) -> None:
+        """Initialize a server over the given engine."""
+        self.engine = engine
+        with engine.read() as snapshot:
+            self.trie = Trie(snapshot.graph.fetch_all_anime_names())
+        self.profiles_filepath = profiles_filepath
+        self.reviews_filepath = reviews_filepath
+        self.idle_timeout = idle_timeout
+        self._executor = ThreadPoolExecutor(num_threads, thread_name_prefix='recommend')
+        self._in_flight = {}
+        self._server = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080) -> int:
+        """Start listening on the given address, and return the port.
+        Port 0 picks a free port."""
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        """Serve requests until the task is cancelled."""
+        await self._server.serve_forever()
+
+    async def close(self) -> None:
+        """Stop listening, then wait for the computations in progress."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=True)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader,
+                                 writer: asyncio.StreamWriter) -> None:
+        """Serve the requests of a connection, one after the other, until the client closes
+        it, asks to close it, or stays idle for idle_timeout seconds."""
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), self.idle_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except HTTPError as error:  # The request cannot be framed, so the connection ends.
+                    writer.write(_response(error.status, {'error': error.message}, False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, target, headers, body, keep_alive = request
+                try:
+                    status, payload = await self._dispatch(method, target, body)
+                except HTTPError as error:
+                    status, payload = error.status, {'error': error.message}
+                except Exception as error:  # Reported to the client instead of dropping it.
+                    status, payload = 500, {'error': repr(error)}
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, target: str, body: bytes) -> tuple[int, Any]:
+        """Returns a tuple (a, b) of the status and the JSON payload of the response to the
+        given request.
+        The snapshot is only held while the event loop runs. The computations on the executor
+        read the snapshot that is current when they start.
+        """
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip('/').split('/') if part != '']
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if method == 'POST' and parts == ['users']:
+            return await self._register(_json_body(body))
+        elif method == 'POST' and parts == ['reviews']:
+            return await self._add_review(_json_body(body))
+        elif method != 'GET':
+            raise HTTPError(405, f'{method} is not allowed on {url.path}')
+
+        if parts == ['recommend']:
+            username = _required(query, 'username')
+            limit, strategy = _limit(query), query.get('strategy', 'auto')
+            if strategy not in STRATEGIES:
+                raise HTTPError(400, f'unknown strategy {strategy}')
+            with self.engine.read() as snapshot:
+                version, exists = snapshot.version, snapshot.engine.check_user_exists(username)
+            if not exists:
+                raise HTTPError(404, f'unknown user {username}')
+            anime = await self._coalesced(('recommend', version, username, limit, strategy),
+                                          self.engine.recommend, username, limit, strategy)
+            return 200, {'anime': [_anime_json(a) for a in anime]}
+        elif parts == ['search']:
+            prefix, limit = _required(query, 'q'), _limit(query)
+            with self.engine.read() as snapshot:
+                version = snapshot.version
+            anime = await self._coalesced(('search', version, prefix, limit),
+                                          self._search, prefix, limit)
+            return 200, {'anime': [_anime_json(a) for a in anime]}
+        elif parts in (['anime', 'new'], ['anime', 'popular']) or \
+                (len(parts) == 3 and parts[0] == 'genres' and parts[2] == 'popular'):
+            limit = _limit(query)
+            if parts[0] == 'anime':
+                name, args = f'fetch_{parts[1]}_anime', (limit,)
+            else:
+                name, args = 'fetch_popular_by_genre', (parts[1], limit)
+            with self.engine.read() as snapshot:
+                version = snapshot.version
+                if parts[0] == 'genres' and parts[1] not in snapshot.graph.genres:
+                    raise HTTPError(404, f'unknown genre {parts[1]}')
+            anime = await self._coalesced((name, version) + args, self._fetch, name, *args)
+            return 200, {'anime': [_anime_json(a) for a in anime]}
+        with self.engine.read() as snapshot:
+            return self._read(snapshot, url.path, parts, query)
+
+    def _read(self, snapshot: EngineSnapshot, path: str, parts: list[str],
+              query: dict[str, str]) -> tuple[int, Any]:
+        """Returns a tuple (a, b) of the status and the JSON payload of the response to the
+        given GET request, which only does a lookup on the given snapshot."""
+        if len(parts) == 2 and parts[0] == 'users':
+            return 200, {'username': parts[1],
+                         'exists': snapshot.engine.check_user_exists(parts[1])}
+        elif parts == ['anime']:
+            anime = snapshot.engine.fetch_anime_by_name(_required(query, 'name'))
+            if anime is None:
+                raise HTTPError(404, 'unknown anime')
+            return 200, _anime_json(anime)
+        elif parts == ['genres']:
+            return 200, {'genres': snapshot.engine.fetch_all_genres()}
+        elif parts == ['metrics']:
+            return 200, instrumentation.DEFAULT.to_prometheus()
+        raise HTTPError(404, f'no endpoint {path}')
+
+    async def _register(self, fields: dict) -> tuple[int, Any]:
+        """Register the user described by the given fields."""
+        username = str(_required(fields, 'username'))
+        gender = str(fields.get('gender', 'other'))
+        date_birth = str(_required(fields, 'date_birth'))
+        if username == '' or gender not in {'male', 'female', 'other'} or \
+                not date_birth[-4:].isdigit():
+            raise HTTPError(400, 'invalid registration')
+        registered = await asyncio.wrap_future(self.engine.register(
+            username, gender, date_birth, self.profiles_filepath))
+        if not registered:
+            raise HTTPError(409, f'user {username} already exists')
+        return 201, {'username': username, 'registered': True}
+
+    async def _add_review(self, fields: dict) -> tuple[int, Any]:
+        """Add the review described by the given fields."""
+        username = str(_required(fields, 'username'))
+        try:
+            anime_uid = int(_required(fields, 'anime_uid'))
+            score = float(_required(fields, 'score'))
+        except (TypeError, ValueError):
+            raise HTTPError(400, 'anime_uid and score must be numbers')
+        with self.engine.read() as snapshot:
+            user_exists = username in snapshot.graph.users
+            anime_exists = anime_uid in snapshot.graph.anime
+        if not user_exists:
+            raise HTTPError(404, f'unknown user {username}')
+        elif not anime_exists:
+            raise HTTPError(404, f'unknown anime {anime_uid}')
+        elif not 1 <= score <= 10:
+            raise HTTPError(400, 'score must be between 1 and 10')
+        await asyncio.wrap_future(self.engine.add_review(username, anime_uid, score,
+                                                         self.reviews_filepath))
+        return 201, {'username': username, 'anime_uid': anime_uid, 'score': score}
+
+    async def _coalesced(self, key: tuple, function: Callable, *args: Any) -> Any:
+        """Returns the result of function(*args), computed on the executor.
+        If a computation with the same key is in progress, waits for its result instead.
+        """
+        if key in self._in_flight:
+            return await asyncio.shield(self._in_flight[key])
+        future = asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+        self._in_flight[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            del self._in_flight[key]
+
+    def _fetch(self, name: str, *args: Any) -> list[Anime]:
+        """Returns the anime listed by the given fetch method of the engine of the current
+        snapshot, called with the given arguments."""
+        with self.engine.read() as snapshot:
+            return getattr(snapshot.engine, name)(*args)
+
+    def _search(self, prefix: str, limit: int) -> list[Anime]:
+        """Returns the anime whose titles start with the given prefix, up to a limit, in the
+        case-insensitive order of their titles, as in the search bar of the application."""
+        names = self.trie.all_suffixes(prefix)
+        names.sort(key=lambda word: word.lower())
+        anime_so_far = []
+        with self.engine.read() as snapshot:
+            for name in names:
+                anime = snapshot.engine.fetch_anime_by_name(name)
+                if anime is not None:
+                    anime_so_far.append(anime)
+                    if len(anime_so_far) >= limit:
+                        break
+        return anime_so_far
+
+
+async def _read_line(reader: asyncio.StreamReader, status: int, message: str) -> bytes:
+    """Returns the next line of the connection, with its line break.
+
+    Raises HTTPError with the given status and message if the line is longer than the limit of
+    the reader.
+    """
+    try:
+        return await reader.readline()
+    except ValueError:  # The limit of the reader was overrun.
+        raise HTTPError(status, message)
+
+
+async def _read_request(reader: asyncio.StreamReader) \
+        -> Optional[tuple[str, str, dict[str, str], bytes, bool]]:
+    """Returns a tuple (a, b, c, d, e) of the method, the target, the headers and the body of
+    the next request on the connection, and whether the connection stays open after it.
+    Returns None if the client closed the connection.
+    """
+    request_line = await _read_line(reader, 414, 'request line is too long')
+    if request_line == b'':
+        return None
+    try:
+        method, target, version = request_line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(400, 'malformed request line')
+    headers = {}
+    while True:
+        line = await _read_line(reader, 431, 'header line is too long')
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', '0'))
+    except ValueError:
+        raise HTTPError(400, 'Content-Length must be an integer')
+    if length < 0:
+        raise HTTPError(400, 'Content-Length must not be negative')
+    elif length > MAX_BODY_SIZE:
+        raise HTTPError(413, 'request body is too large')
+    body = await reader.readexactly(length) if length > 0 else b''
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+    return method.upper(), target, headers, body, keep_alive
+
+
+def _response(status: int, payload: Any, keep_alive: bool) -> bytes:
+    """Returns the bytes of an HTTP response with the given status and payload. A string
+    payload is sent as plain text, and any other payload as JSON."""
+    if isinstance(payload, str):
+        body = payload.encode('utf8')
+        content_type = 'text/plain; version=0.0.4'
+    else:
+        body = json.dumps(payload).encode('utf8')
+        content_type = 'application/json'
+    head = (f'HTTP/1.1 {status} {_REASONS.get(status, "")}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+    return head.encode('latin-1') + body
+
+
+def _json_body(body: bytes) -> dict:
+    """Returns the JSON object in the given request body."""
+    try:
+        fields = json.loads(body)
+    except ValueError:
+        raise HTTPError(400, 'the body is not valid JSON')
+    if not isinstance(fields, dict):
+        raise HTTPError(400, 'the body must be a JSON object')
+    return fields
+
+
+def _required(fields: dict, name: str) -> Any:
+    """Returns the value of the given required field or query parameter."""
+    if name not in fields:
+        raise HTTPError(400, f'missing {name}')
+    return fields[name]
+
+
+def _limit(query: dict[str, str]) -> int:
+    """Returns the limit query parameter, 10 by default, capped at MAX_LIMIT."""
+    try:
+        return max(0, min(int(query.get('limit', '10')), MAX_LIMIT))
+    except ValueError:
+        raise HTTPError(400, 'limit must be an integer')
+
+
+def _anime_json(anime: Anime) -> dict[str, Any]:
+    """Returns the JSON object describing the given anime."""
+    return {'uid': anime.uid, 'title': anime.title, 'score': anime.score,
+            'popularity': anime.popularity, 'aired_date': anime.aired_date.date().isoformat()}
+
+
+def run_server(anime_filepath: str, profiles_filepath: str, reviews_filepath: str,
+               host: str = '127.0.0.1', port: int = 8080, follow_reviews: bool = False) -> None:
+    """Load the data files and serve them on the given local address until interrupted.
+    If follow_reviews is True, the reviews other processes append to the reviews file are
+    applied as they arrive. The reviews the server appends itself are then applied a second
+    time, which does not change them. The ingestor does not save its offset: a restarted
+    server loads the whole reviews file again, and follows it from its end."""
+    from data_loader import create_anime_graph_from_data
+    from review_ingestor import ReviewIngestor
+
+    # The reviews appended while the file is being loaded are applied again, which is harmless.
+    loaded_size = os.path.getsize(reviews_filepath)
+    graph = create_anime_graph_from_data(anime_filepath, profiles_filepath, reviews_filepath)
+    engine = ConcurrentRecommendationEngine(graph)
+    ingestor = ReviewIngestor(engine, reviews_filepath, start_offset=loaded_size)
+    if follow_reviews:
+        ingestor.start()
+
+    async def serve() -> None:
+        """Start the server and serve until cancelled."""
+        server = RecommendationServer(engine, profiles_filepath, reviews_filepath)
+        bound_port = await server.start(host, port)
+        print(f'Serving on http://{host}:{bound_port}')
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+            ingestor.stop()
+            engine.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    run_server('Data/animes.csv', 'Data/profiles.csv', 'Data/reviews.csv')
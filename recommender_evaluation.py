@@ -147,6 +147,43 @@ def get_popular_guess_nums(recommender: RecommendationEngine, test_file: str) ->
     return (correct_count, running_time)
 
 
+def get_latent_factor_guess_nums(recommender: RecommendationEngine, test_file: str) \
+        -> tuple[int, float]:
+    """This function runs through the test file. For each user, it tries to provide a list of
+    recommendations, based on the scores predicted by the latent factor model, twice the length
+    of the user's list of liked anime in the test file.
+    Then, it look for how many recommendations match the animes in the list in test file.
+
+    It returns a list of tuples. Each tuple contains the number of correct guesses and the
+    running time. The model is trained first if it was not trained or loaded yet, and the
+    running time includes the training.
+
+    Preconditions:
+        - The test_file is the file extracted from profiles.csv, containing usernames and the
+        corresponding extracted anime liked list.
+    """
+    correct_count = 0
+    start = timer()
+    if recommender.latent_model is None:
+        recommender.train_latent_factors()
+    with open(test_file) as fp_in:
+        reader = csv.reader(fp_in)
+
+        for row in reader:
+            liked_list = [int(uid) for uid in row[3][2:-2].split('\', \'')]
+            num_liked = len(liked_list)
+            recommendations = [anime.uid
+                               for anime in
+                               recommender.recommend_by_latent_factors(row[0], num_liked * 2)]
+            for uid in liked_list:
+                if uid in recommendations:
+                    correct_count += 1
+
+    end = timer()
+    running_time = end - start
+    return (correct_count, running_time)
+
+
 def get_recommender_evaluations(measures: list[Union[str, Callable]],
                                 recommender: RecommendationEngine) -> list[tuple[str, int, float]]:
     """Return a list of tuples, corresponding to the name of user proximity measures, the number
@@ -163,6 +200,9 @@ def get_recommender_evaluations(measures: list[Union[str, Callable]],
     count, running_time = get_content_guess_nums(recommender,
                                                  'Data/profiles_extracted.csv')
     res_so_far.append(('content-filtering by genre', count, running_time))
+    count, running_time = get_latent_factor_guess_nums(recommender,
+                                                       'Data/profiles_extracted.csv')
+    res_so_far.append(('latent factors (ALS)', count, running_time))
     count, running_time = get_popular_guess_nums(recommender,
                                                  'Data/profiles_extracted.csv')
     res_so_far.append(('always return most popular animes', count, running_time))
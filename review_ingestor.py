@@ -0,0 +1,356 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The review_ingestor module.
+
+This module contains the definition of the ReviewIngestor class,
+which follows a reviews file that other processes append to, and
+applies the new reviews to a running engine in batches, without a
+restart.
+
+The file has the format of reviews.csv. Only complete rows are
+read, so a row that is still being written is picked up by the next
+poll. A quoted field may span several lines, so a row ends only at a
+line break after an even number of quote characters, as in
+anime_metadata.iter_rows_with_offsets. The byte offset of the first review not applied yet can be
+saved to a file after each batch, so that a restarted ingestor
+resumes where it stopped. A batch applied again after a crash does
+not change the graph, since a review overwrites the previous review
+of the same user and anime.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import BinaryIO, Optional, Union
+
+import instrumentation
+from concurrent_engine import ConcurrentRecommendationEngine
+from instrumentation import Histogram, SECONDS_BUCKETS
+from recommendation_engine import RecommendationEngine
+
+# The default maximum number of reviews applied in one batch.
+DEFAULT_BATCH_SIZE = 1024
+# The default number of seconds between two polls of the file.
+DEFAULT_POLL_INTERVAL = 0.2
+# The maximum number of bytes read from the file at once. A longer row is skipped.
+READ_SIZE = 1 << 20
+
+_LOGGER = logging.getLogger(__name__)
+
+# A review: a tuple of the username, the anime uid, the score and the time of the review in
+# seconds since the epoch, or None.
+Review = tuple[str, int, float, Optional[float]]
+
+
+class ReviewIngestor:
+    """A follower of a reviews file, applying the reviews appended to it to an engine.
+
+    The freshness lag of a review is the time from when it was written to the file to when
+    recommendations can see it. If the file has a column of review times, they are used.
+    Otherwise, the reviews read in one poll are taken to be written at the last modification
+    of the file, which underestimates the lag by at most the poll interval.
+
+    Instance Attributes:
+        - engine: The engine the reviews are applied to.
+        - filepath: The path of the followed reviews file.
+        - offset: The byte offset in the file of the first review not applied yet.
+        - offset_filepath: The file the offset is saved to after each batch, or None.
+        - batch_size: The maximum number of reviews applied in one batch.
+        - poll_interval: The number of seconds between two polls of the file.
+        - timestamp_column: The column of the times of the reviews, in seconds since the
+        epoch, or None if the file has no such column.
+        - reviews_applied: The number of reviews applied so far.
+        - rows_skipped: The number of rows that could not be decoded or parsed, or that
+        were longer than READ_SIZE bytes.
+        - batches: The number of batches applied so far.
+        - errors: The number of polls of the background thread that failed.
+        - lag: The histogram of the freshness lags of the applied reviews, in seconds.
+    """
+    engine: Union[RecommendationEngine, ConcurrentRecommendationEngine]
+    filepath: str
+    offset: int
+    offset_filepath: Optional[str]
+    batch_size: int
+    poll_interval: float
+    timestamp_column: Optional[int]
+    reviews_applied: int
+    rows_skipped: int
+    batches: int
+    errors: int
+    lag: Histogram
+
+    # Private Instance Attributes:
+    #     - _inode: The inode of the followed file when the offset was last saved, used to
+    #       notice that the file was replaced, or None if it is unknown.
+    #     - _stop: The event stopping the background thread.
+    #     - _thread: The background thread, or None if it is not running.
+    _inode: Optional[int]
+    _stop: threading.Event
+    _thread: Optional[threading.Thread]
+
+    def __init__(self, engine: Union[RecommendationEngine, ConcurrentRecommendationEngine],
+                 filepath: str, offset_filepath: Optional[str] = None, start_offset: int = 0,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 timestamp_column: Optional[int] = None) -> None:
+        """Initialize an ingestor of the given file. It resumes from the offset saved in
+        offset_filepath if that file exists, and from start_offset otherwise: use the size of
+        the file before it was loaded into the graph to only follow the new reviews.
+        """
+        self.engine = engine
+        self.filepath = filepath
+        self.offset = start_offset
+        self.offset_filepath = offset_filepath
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.timestamp_column = timestamp_column
+        self.reviews_applied = 0
+        self.rows_skipped = 0
+        self.batches = 0
+        self.errors = 0
+        self.lag = Histogram(SECONDS_BUCKETS)
+        self._inode = None
+        self._stop = threading.Event()
+        self._thread = None
+
+        if offset_filepath is not None and os.path.exists(offset_filepath):
+            with open(offset_filepath, encoding='utf8') as file:
+                saved = json.load(file)
+            self.offset = saved['offset']
+            self._inode = saved['inode']
+
+    def poll(self) -> int:
+        """Apply all the complete reviews appended to the file since the last poll, in
+        batches, and returns the number of reviews applied.
+        If the file was replaced or truncated, it is followed again from its beginning.
+        """
+        try:
+            status = os.stat(self.filepath)
+        except FileNotFoundError:
+            return 0
+        if (self._inode is not None and status.st_ino != self._inode) \
+                or status.st_size < self.offset:
+            self.offset = 0
+        self._inode = status.st_ino
+        if status.st_size == self.offset:
+            return 0
+
+        applied = 0
+        with open(self.filepath, 'rb') as file:
+            while True:
+                file.seek(self.offset)
+                data = file.read(READ_SIZE)
+                rows = _complete_rows(data)
+                if len(rows) > 0:
+                    applied += self._apply_rows(rows, status.st_mtime)
+                elif len(data) < READ_SIZE or not self._skip_row(file):
+                    # The row at the offset is still being written.
+                    break
+                if len(data) < READ_SIZE:
+                    break
+        return applied
+
+    def start(self) -> None:
+        """Start polling the file in a background thread."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._follow, name='review-ingestor',
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread, after the batch it is applying."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict[str, object]:
+        """Returns a JSON-serializable description of the progress and the freshness lag of
+        this ingestor."""
+        return {'offset': self.offset, 'reviews_applied': self.reviews_applied,
+                'rows_skipped': self.rows_skipped, 'batches': self.batches,
+                'errors': self.errors, 'lag_seconds': self.lag.to_dict()}
+
+    def _follow(self) -> None:
+        """Poll the file until the ingestor is stopped. A failed poll is logged and retried
+        at the next interval, from the offset of the last batch applied."""
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception:  # Logged instead of ending the thread.
+                self.errors += 1
+                instrumentation.count('ingest_errors')
+                _LOGGER.exception('Failed to ingest the reviews of %s', self.filepath)
+            self._stop.wait(self.poll_interval)
+
+    def _apply_rows(self, rows: list[bytes], written: float) -> int:
+        """Parse the given complete rows, which start at the current offset, and apply their
+        reviews in batches. Each batch advances and saves the offset once it is visible.
+        written is the time the reviews without a review time are taken to be written at.
+        Returns the number of reviews applied.
+        """
+        applied = 0
+        for start in range(0, len(rows), self.batch_size):
+            chunk = rows[start:start + self.batch_size]
+            reviews, skipped = self._parse(chunk)
+            if len(reviews) > 0:
+                with instrumentation.span('ingest.batch'):
+                    result = self.engine.ingest_reviews(reviews)
+                    if isinstance(result, Future):
+                        result.result()
+                visible = time.time()
+                for review in reviews:
+                    lag = visible - (review[3] if review[3] is not None else written)
+                    self.lag.observe(lag)
+                    instrumentation.observe('ingest.freshness_lag_seconds', lag,
+                                            SECONDS_BUCKETS)
+                instrumentation.count('reviews_ingested', len(reviews))
+                applied += len(reviews)
+                self.reviews_applied += len(reviews)
+                self.batches += 1
+            self.rows_skipped += skipped
+            self.offset += sum(len(row) for row in chunk)
+            self._save_offset()
+        return applied
+
+    def _parse(self, rows: list[bytes]) -> tuple[list[Review], int]:
+        """Returns a tuple (a, b) of the reviews of the given rows and the number of rows
+        skipped because they could not be decoded or parsed. The header row is skipped too.
+        """
+        texts = []
+        skipped = 0
+        for row in rows:
+            try:
+                texts.append(row.decode('utf8'))
+            except UnicodeDecodeError:
+                skipped += 1
+        reviews = []
+        at_start = self.offset == 0
+        reader = csv.reader(texts)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                break
+            except csv.Error:
+                skipped += 1
+                continue
+            if at_start:
+                at_start = False
+                if len(row) > 0 and row[0] == 'uid':
+                    continue
+            try:
+                timestamp = float(row[self.timestamp_column]) \
+                    if self.timestamp_column is not None else None
+                reviews.append((row[1], int(row[2]), float(row[3]), timestamp))
+            except (IndexError, ValueError):
+                skipped += 1
+        return reviews, skipped
+
+    def _skip_row(self, file: BinaryIO) -> bool:
+        """Move the offset past the row at the offset in the given file, which is longer than
+        READ_SIZE bytes, and count it as skipped. Returns whether the row was skipped: it is
+        not if it is still being written."""
+        file.seek(self.offset)
+        position = self.offset
+        quotes = 0
+        while True:
+            data = file.read(READ_SIZE)
+            if len(data) == 0:
+                return False
+            scanned = 0
+            newline = data.find(b'\n')
+            while newline != -1:
+                quotes += data.count(b'"', scanned, newline)
+                scanned = newline + 1
+                if quotes % 2 == 0:
+                    _LOGGER.warning('Skipped a row of %s bytes at offset %s of %s',
+                                    position + scanned - self.offset, self.offset,
+                                    self.filepath)
+                    self.rows_skipped += 1
+                    self.offset = position + scanned
+                    self._save_offset()
+                    return True
+                newline = data.find(b'\n', scanned)
+            quotes += data.count(b'"', scanned)
+            position += len(data)
+
+    def _save_offset(self) -> None:
+        """Save the offset to the offset file, if there is one. The file is written to a
+        temporary file, flushed to disk and then renamed over the previous one, so it always
+        holds a complete offset."""
+        if self.offset_filepath is None:
+            return
+        temp_filepath = self.offset_filepath + '.tmp'
+        with open(temp_filepath, 'w', encoding='utf8') as file:
+            json.dump({'offset': self.offset, 'inode': self._inode}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filepath, self.offset_filepath)
+
+
+def _complete_rows(data: bytes) -> list[bytes]:
+    """Returns the complete rows at the start of the given data, each with its line break.
+    A row ends at a line break after an even number of quote characters, since a quoted field
+    may span several lines."""
+    rows = []
+    start = 0
+    scanned = 0
+    quotes = 0
+    newline = data.find(b'\n')
+    while newline != -1:
+        quotes += data.count(b'"', scanned, newline)
+        scanned = newline + 1
+        if quotes % 2 == 0:
+            rows.append(data[start:scanned])
+            start = scanned
+            quotes = 0
+        newline = data.find(b'\n', scanned)
+    return rows
+
+
+if __name__ == '__main__':
+    import random
+    import tempfile
+
+    from data_loader import create_anime_graph_from_data
+    from dataset_generator import generate_dataset
+
+    # Append reviews to a live file from another thread, and measure how soon they are seen.
+    with tempfile.TemporaryDirectory() as directory:
+        generate_dataset(directory, 10000, 2000, 100000)
+        reviews_filepath = os.path.join(directory, 'reviews.csv')
+        loaded_size = os.path.getsize(reviews_filepath)
+        concurrent_engine = ConcurrentRecommendationEngine(create_anime_graph_from_data(
+            os.path.join(directory, 'animes.csv'), os.path.join(directory, 'profiles.csv'),
+            reviews_filepath))
+        with concurrent_engine.read() as first_snapshot:
+            usernames = list(first_snapshot.graph.users)
+            anime_uids = list(first_snapshot.graph.anime)
+        ingestor = ReviewIngestor(concurrent_engine, reviews_filepath,
+                                  os.path.join(directory, 'offset.json'), loaded_size,
+                                  timestamp_column=4)
+        ingestor.start()
+        rng = random.Random(111)
+        with open(reviews_filepath, 'a', newline='') as feed:
+            writer = csv.writer(feed)
+            for i in range(5000):
+                writer.writerow([0, rng.choice(usernames), rng.choice(anime_uids),
+                                 rng.randint(1, 10), time.time()])
+                if i % 50 == 49:
+                    feed.flush()
+                    time.sleep(0.01)
+        time.sleep(2 * DEFAULT_POLL_INTERVAL)
+        ingestor.stop()
+        concurrent_engine.close()
+
+        print(json.dumps(ingestor.stats(), indent=2))
+        print(f'mean freshness lag: {ingestor.lag.total / ingestor.lag.count * 1000:.1f} ms')
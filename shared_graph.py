@@ -0,0 +1,150 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The shared_graph module.
+
+This module contains the multi-process serving mode. A loader
+process copies the arrays of an ArrayGraph into one shared memory
+block once. Worker processes attach to the block and wrap it with
+read-only NumPy views, so they start without loading the data files
+and do not keep a copy of the graph each.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+
+from array_graph import ARRAY_DTYPES, ArrayGraph
+
+# The alignment of each array in the shared block, in bytes.
+_ALIGNMENT = 64
+# The default number of worker processes.
+DEFAULT_NUM_WORKERS = 4
+
+STRATEGIES = ('users', 'genres')
+
+# The layout of the arrays in a shared block: a mapping of array names to tuples (a, b) of
+# the offset of the array in bytes and its length.
+Layout = dict[str, tuple[int, int]]
+
+# The graph attached by this worker process, and its shared block, which must stay open
+# while the graph is in use.
+_worker_graph: Optional[ArrayGraph] = None
+_worker_block: Optional[shared_memory.SharedMemory] = None
+
+
+def publish_graph(array_graph: ArrayGraph) -> tuple[shared_memory.SharedMemory, Layout]:
+    """Returns a tuple (a, b) of a new shared memory block holding the arrays of the given
+    graph and the layout of the arrays in it.
+    The caller owns the block: it must close and unlink it when no process uses it anymore.
+    """
+    layout = {}
+    size = 0
+    for name in ARRAY_DTYPES:
+        array = array_graph.arrays[name]
+        layout[name] = (size, len(array))
+        size += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for name, (offset, length) in layout.items():
+        view = np.ndarray((length,), ARRAY_DTYPES[name], buffer=block.buf, offset=offset)
+        view[:] = array_graph.arrays[name]
+    return block, layout
+
+
+def attach_graph(block_name: str, layout: Layout) \
+        -> tuple[shared_memory.SharedMemory, ArrayGraph]:
+    """Returns a tuple (a, b) of the shared memory block with the given name and the
+    ArrayGraph over read-only views of its arrays. Nothing is copied.
+    The block must stay open while the graph is in use.
+    """
+    block = shared_memory.SharedMemory(name=block_name)
+    arrays = {}
+    for name, (offset, length) in layout.items():
+        view = np.ndarray((length,), ARRAY_DTYPES[name], buffer=block.buf, offset=offset)
+        view.flags.writeable = False
+        arrays[name] = view
+    return block, ArrayGraph(arrays)
+
+
+class SharedGraphServer:
+    """A pool of worker processes serving recommendations from a graph in shared memory.
+
+    The workers are children of the process that publishes the graph, so they share its
+    resource tracker, and only this server unlinks the block, in close.
+
+    Instance Attributes:
+        - num_workers: The number of worker processes.
+    """
+    num_workers: int
+
+    # Private Instance Attributes:
+    #     - _block: The shared memory block of the graph.
+    #     - _pool: The pool of worker processes.
+    _block: shared_memory.SharedMemory
+    _pool: multiprocessing.pool.Pool
+
+    def __init__(self, array_graph: ArrayGraph, num_workers: int = DEFAULT_NUM_WORKERS,
+                 start_method: str = 'spawn') -> None:
+        """Publish the given graph to shared memory and start the worker processes.
+        With the 'spawn' start method, a worker only imports the array_graph module, and
+        never has a copy of the graph.
+        """
+        self.num_workers = num_workers
+        self._block, layout = publish_graph(array_graph)
+        context = multiprocessing.get_context(start_method)
+        self._pool = context.Pool(num_workers, initializer=_init_worker,
+                                  initargs=(self._block.name, layout))
+
+    def recommend(self, username: str, limit: int = 10, strategy: str = 'users') -> list[int]:
+        """Returns the uids of the anime recommended to the given user, up to a limit, computed
+        by a worker. Returns an empty list if the user is not in the graph.
+
+        Preconditions:
+            - strategy in STRATEGIES
+        """
+        return self._pool.apply(_recommend, (username, limit, strategy))
+
+    def recommend_many(self, usernames: list[str], limit: int = 10,
+                       strategy: str = 'users') -> list[list[int]]:
+        """Returns the recommendations of each of the given users, computed by all the workers
+        in parallel."""
+        return self._pool.starmap(_recommend, [(username, limit, strategy)
+                                               for username in usernames])
+
+    def close(self) -> None:
+        """Stop the workers, then free the shared memory block."""
+        self._pool.close()
+        self._pool.join()
+        self._block.close()
+        self._block.unlink()
+
+
+def _init_worker(block_name: str, layout: Layout) -> None:
+    """Attach the worker process to the shared graph."""
+    global _worker_graph, _worker_block
+    _worker_block, _worker_graph = attach_graph(block_name, layout)
+
+
+def _recommend(username: str, limit: int, strategy: str) -> list[int]:
+    """Returns the uids of the anime recommended by this worker to the given user."""
+    user_vid = _worker_graph.user_vid(username)
+    if user_vid is None:
+        return []
+    if strategy == 'users':
+        anime = _worker_graph.recommend_by_users(user_vid, limit)
+    else:
+        anime = _worker_graph.recommend_by_genres(user_vid, limit)
+    return _worker_graph.arrays['anime_uids'][anime].tolist()
+
+
+if __name__ == '__main__':
+    from data_loader import create_anime_graph_from_data
+
+    server = SharedGraphServer(ArrayGraph.from_graph(create_anime_graph_from_data(
+        'Data/animes.csv', 'Data/profiles.csv', 'Data/reviews.csv')))
+    print(server.recommend_many(['DesolatePsyche', 'baekbeans']))
+    server.close()
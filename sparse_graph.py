@@ -0,0 +1,99 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The sparse_graph module.
+
+This module contains the definition of the SparseAnimeGraph class,
+the representation of an AnimeGraph as SciPy CSR matrices indexed
+by the dense ids of the vertices, for use in numerical code.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+from scipy import sparse
+
+from id_interning import IdMap
+
+# A tuple of (gender, birth_year) of a user.
+UserAttributes = tuple[Optional[str], Optional[int]]
+# A tuple of (title, aired_ordinal, popularity, score) of an anime.
+AnimeAttributes = tuple[str, int, Optional[int], Optional[float]]
+
+
+class SparseAnimeGraph:
+    """An AnimeGraph stored as sparse matrices.
+    Row i of a matrix that is indexed by users corresponds to the user with id i in user_ids,
+    and similarly for anime and genres. An id that is not used by any vertex of the graph
+    has an empty row and column, and its attributes are None. The entries of each row are in
+    the order of the neighbors of its vertex, so the column indices of a row are not sorted.
+
+    Instance Attributes:
+        - ratings: The users × anime matrix of review scores.
+        - ratings_by_anime: The anime × users matrix of review scores, the transpose of
+        ratings with the entries of each row in the order of the users of the anime.
+        - membership: The anime × genres matrix, with a 1 where an anime is in a genre.
+        - affinity: The users × genres matrix of the liking scores of users toward genres.
+        - user_ids: The id map of usernames.
+        - anime_ids: The id map of anime uids.
+        - genre_ids: The id map of genre names.
+        - user_attributes: The (gender, birth_year) of each user id, or None.
+        - anime_attributes: The (title, aired_ordinal, popularity, score) of each anime id,
+        or None.
+        - genre_present: Whether the genre with each id is in the graph.
+    """
+    ratings: sparse.csr_matrix
+    ratings_by_anime: sparse.csr_matrix
+    membership: sparse.csr_matrix
+    affinity: sparse.csr_matrix
+    user_ids: IdMap
+    anime_ids: IdMap
+    genre_ids: IdMap
+    user_attributes: list[Optional[UserAttributes]]
+    anime_attributes: list[Optional[AnimeAttributes]]
+    genre_present: np.ndarray
+
+    def __init__(self, ratings: tuple[sparse.csr_matrix, sparse.csr_matrix],
+                 membership: sparse.csr_matrix, affinity: sparse.csr_matrix,
+                 id_maps: tuple[IdMap, IdMap, IdMap],
+                 user_attributes: list[Optional[UserAttributes]],
+                 anime_attributes: list[Optional[AnimeAttributes]],
+                 genre_present: np.ndarray) -> None:
+        """Initialize a sparse graph. ratings is the tuple of the users × anime and the
+        anime × users matrices of review scores, and id_maps is the tuple of the user, anime
+        and genre id maps.
+        """
+        self.ratings, self.ratings_by_anime = ratings
+        self.membership = membership
+        self.affinity = affinity
+        self.user_ids, self.anime_ids, self.genre_ids = id_maps
+        self.user_attributes = user_attributes
+        self.anime_attributes = anime_attributes
+        self.genre_present = genre_present
+
+
+def csr_from_rows(row_ids: np.ndarray, row_lengths: np.ndarray, col_ids: np.ndarray,
+                  values: np.ndarray, shape: tuple[int, int]) -> sparse.csr_matrix:
+    """Returns a CSR matrix, where the row with id row_ids[i] holds the next row_lengths[i]
+    entries of col_ids and values. The entries of each row keep their order, which is the
+    order of the neighbors of its vertex, so the column indices of a row are not sorted.
+
+    Preconditions:
+        - len(row_ids) == len(row_lengths)
+        - sum(row_lengths) == len(col_ids) == len(values)
+        - No row id appears twice in row_ids, and no column id twice in a row.
+    """
+    counts = np.zeros(shape[0], np.int64)
+    counts[row_ids] = row_lengths
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    # The position in col_ids of each entry, with the rows in order of id.
+    order = np.argsort(row_ids, kind='stable')
+    starts = (np.cumsum(row_lengths) - row_lengths)[order]
+    lengths = row_lengths[order]
+    positions = np.arange(len(col_ids)) + np.repeat(starts - (np.cumsum(lengths) - lengths),
+                                                    lengths)
+    # Explicit zeros are kept. A review or an affinity of 0 is still an edge.
+    return sparse.csr_matrix((values[positions], col_ids[positions].astype(np.int32), indptr),
+                             shape=shape)
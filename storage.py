@@ -0,0 +1,324 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The storage module.
+
+This module contains the storage backends of the user profiles and
+reviews: the Storage interface, CsvStorage, which keeps them in the
+profiles and reviews CSV files described in the report, and
+SqliteStorage, which keeps them in an embedded SQLite database.
+
+The anime are always read from their CSV file, since they never
+change while the application runs.
+================================================================
+@author: Tu Pham
+"""
+from __future__ import annotations
+
+import csv
+import sqlite3
+import threading
+from typing import TYPE_CHECKING, Iterable
+
+import instrumentation
+
+if TYPE_CHECKING:
+    from anime_graph import AnimeGraph
+
+# The score given to the favorite anime of a user.
+FAVORITE_SCORE = 9
+# The number of rows written per statement by SqliteStorage.import_csv.
+IMPORT_BATCH_SIZE = 65536
+
+# A review: a tuple of the username, the anime uid and the score.
+StoredReview = tuple[str, int, float]
+
+# The seq column of the users, favorites and reviews is the order they were first stored in,
+# which is the order they are added to the graph in, as with the CSV files.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    seq INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    gender TEXT,
+    birthday TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS favorites (
+    seq INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    anime_uid INTEGER NOT NULL,
+    UNIQUE (username, position)
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    seq INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    anime_uid INTEGER NOT NULL,
+    score REAL NOT NULL,
+    UNIQUE (username, anime_uid)
+);
+"""
+_INSERT_USER = 'INSERT OR IGNORE INTO users (username, gender, birthday) VALUES (?, ?, ?)'
+# A review that replaces an earlier one keeps its seq.
+_UPSERT_REVIEW = ('INSERT INTO reviews (username, anime_uid, score) VALUES (?, ?, ?) '
+                  'ON CONFLICT (username, anime_uid) DO UPDATE SET score = excluded.score')
+
+
+class Storage:
+    """Abstract class for the persistent store of the user profiles and reviews."""
+
+    def load_into(self, graph: AnimeGraph) -> None:
+        """Add the stored users, with their favorite anime, then the stored reviews to the
+        given graph, which already contains the anime."""
+        raise NotImplementedError
+
+    def user_exists(self, username: str) -> bool:
+        """Returns whether a user with the given username is stored."""
+        raise NotImplementedError
+
+    def add_user(self, username: str, gender: str, date_birth: str) -> None:
+        """Store a new user without favorite anime.
+
+        Preconditions:
+            - not self.user_exists(username)
+        """
+        raise NotImplementedError
+
+    def add_reviews(self, reviews: Iterable[StoredReview]) -> None:
+        """Store the given reviews, as tuples (username, anime_uid, score), together. A review
+        replaces the previous review of the same user and anime."""
+        raise NotImplementedError
+
+    def add_review(self, username: str, anime_uid: int, score: float) -> None:
+        """Store a review."""
+        self.add_reviews([(username, anime_uid, score)])
+
+    def close(self) -> None:
+        """Release the resources of this storage."""
+
+
+class CsvStorage(Storage):
+    """The profiles and reviews stored in CSV files. New users and reviews are appended, so
+    the files keep every review ever written, and the last one of a user and anime wins when
+    they are loaded.
+
+    Instance Attributes:
+        - profiles_filepath: The path to the profiles file.
+        - reviews_filepath: The path to the reviews file.
+    """
+    profiles_filepath: str
+    reviews_filepath: str
+
+    def __init__(self, profiles_filepath: str = '', reviews_filepath: str = '') -> None:
+        """Initialize a storage in the given files. A storage only used to add users or only
+        used to add reviews does not need the other file."""
+        self.profiles_filepath = profiles_filepath
+        self.reviews_filepath = reviews_filepath
+
+    def load_into(self, graph: AnimeGraph) -> None:
+        """Add the users of the profiles file, with their favorite anime, then the reviews of
+        the reviews file to the given graph.
+
+        Preconditions:
+            - The files have the format as described in the report.
+        """
+        with instrumentation.span('load.users'):
+            for row in _read_rows(self.profiles_filepath):
+                _convert_user_row_data_types(row)
+                # The types of elements in row got converted appropriately already.
+                graph.add_user(row[0], row[1], row[2])
+                for fav_uid in row[3]:  # row 3 contains a list of favorite anime uid.
+                    # giving a default score of 9 to a favorite anime
+                    graph.add_review(row[0], fav_uid, FAVORITE_SCORE)
+        with instrumentation.span('load.reviews'):
+            for row in _read_rows(self.reviews_filepath):
+                graph.add_review(row[1], int(row[2]), float(row[3]))
+
+    def user_exists(self, username: str) -> bool:
+        """Returns whether a user with the given username is in the profiles file. The whole
+        file is scanned."""
+        return any(row[0] == username for row in _read_rows(self.profiles_filepath))
+
+    def add_user(self, username: str, gender: str, date_birth: str) -> None:
+        """Append a new user without favorite anime to the profiles file."""
+        with open(self.profiles_filepath, 'a+', newline='') as fd:
+            writer = csv.writer(fd)
+            writer.writerow([username, gender, date_birth, []])
+
+    def add_reviews(self, reviews: Iterable[StoredReview]) -> None:
+        """Append the given reviews to the reviews file."""
+        with open(self.reviews_filepath, 'a+', newline='') as fd:
+            writer = csv.writer(fd)
+            for username, anime_uid, score in reviews:
+                # String form of the score
+                s = str(score)
+                # For now we don't use the details of categorized score yet
+                pseudo_details = {'Overall': s, 'Story': s, 'Animation': s, 'Sound': s,
+                                  'Character': s, 'Enjoyment': s}
+                # The '0' is a temporary review ID, we don't need it for now.
+                writer.writerow(['0', username, anime_uid, s, pseudo_details])
+
+
+class SqliteStorage(Storage):
+    """The profiles and reviews stored in an SQLite database.
+
+    The users are indexed by username, and the reviews by (username, anime uid), so a user
+    lookup or a review update touches a few pages instead of a whole file, and a user or a
+    review cannot be stored twice. The rows are kept in the order they were first stored, so
+    the graph is loaded in the same order as from the CSV files they were imported from.
+    The database is in WAL mode: readers do not block the writer, and a transaction is one
+    append to the log.
+
+    The storage can be used from several threads, one statement at a time.
+
+    Instance Attributes:
+        - filepath: The path to the database file.
+    """
+    filepath: str
+
+    # Private Instance Attributes:
+    #     - _connection: The connection to the database.
+    #     - _lock: The lock of the connection.
+    _connection: sqlite3.Connection
+    _lock: threading.Lock
+
+    def __init__(self, filepath: str) -> None:
+        """Open the database in the given file, and create its tables if they do not exist."""
+        self.filepath = filepath
+        self._connection = sqlite3.connect(filepath, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        # In WAL mode, a crash may lose the last transactions but never corrupts the database.
+        self._connection.execute('PRAGMA synchronous = NORMAL')
+        with self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def load_into(self, graph: AnimeGraph) -> None:
+        """Add the stored users, with their favorite anime, then the stored reviews to the
+        given graph, in the order they were first stored. The users and the reviews are each
+        read in a single scan of their table, so they are added in the same order as from the
+        CSV files, and the recommendations are the same.
+        """
+        with self._lock:
+            with instrumentation.span('load.users'):
+                for username, gender, birthday in self._connection.execute(
+                        'SELECT username, gender, birthday FROM users ORDER BY seq'):
+                    year = birthday[-4:]
+                    graph.add_user(username, gender, int(year) if year.isnumeric() else None)
+                for username, anime_uid in self._connection.execute(
+                        'SELECT username, anime_uid FROM favorites ORDER BY seq'):
+                    graph.add_review(username, anime_uid, FAVORITE_SCORE)
+            with instrumentation.span('load.reviews'):
+                for username, anime_uid, score in self._connection.execute(
+                        'SELECT username, anime_uid, score FROM reviews ORDER BY seq'):
+                    graph.add_review(username, anime_uid, score)
+
+    def user_exists(self, username: str) -> bool:
+        """Returns whether a user with the given username is stored."""
+        with self._lock:
+            return self._connection.execute('SELECT 1 FROM users WHERE username = ?',
+                                            (username,)).fetchone() is not None
+
+    def add_user(self, username: str, gender: str, date_birth: str) -> None:
+        """Store a new user without favorite anime. A user that is already stored is kept."""
+        with self._lock, self._connection:
+            self._connection.execute(_INSERT_USER,
+                                     (username, gender if gender != '' else None, date_birth))
+
+    def add_reviews(self, reviews: Iterable[StoredReview]) -> None:
+        """Store the given reviews in one transaction, in order."""
+        with self._lock, self._connection:
+            self._connection.executemany(_UPSERT_REVIEW, reviews)
+
+    def import_csv(self, profiles_filepath: str, reviews_filepath: str) -> None:
+        """Add the users and reviews of the given CSV files, in the format described in the
+        report, in one transaction. A repeated user keeps their first profile, with the
+        favorite anime of all their rows, and a repeated review the last score at the
+        position of the first, as when the files are loaded directly.
+
+        The rows are inserted in the order of the files, so each table is built by appending
+        to it, and only its index on the usernames is updated at random pages.
+        """
+        users = {}
+        favorite_rows = []
+        num_favorites = {}
+        for row in _read_rows(profiles_filepath):
+            if row[0] not in users:
+                users[row[0]] = (row[1] if row[1] != '' else None, row[2])
+            _convert_user_row_data_types(row)
+            # The favorites of a repeated user continue after those of their earlier rows.
+            start = num_favorites.get(row[0], 0)
+            favorite_rows.extend((row[0], start + position, anime_uid)
+                                 for position, anime_uid in enumerate(row[3]))
+            num_favorites[row[0]] = start + len(row[3])
+        reviews = {}
+        for row in _read_rows(reviews_filepath):
+            reviews[(row[1], int(row[2]))] = float(row[3])
+
+        with self._lock, self._connection:
+            self._connection.executemany(_INSERT_USER, ((username, gender, birthday)
+                                                        for username, (gender, birthday)
+                                                        in users.items()))
+            self._connection.executemany('INSERT OR IGNORE INTO favorites '
+                                         '(username, position, anime_uid) VALUES (?, ?, ?)',
+                                         favorite_rows)
+            # A dictionary keeps the position of the first insertion of a key.
+            keys = list(reviews)
+            for start in range(0, len(keys), IMPORT_BATCH_SIZE):
+                self._connection.executemany(
+                    _UPSERT_REVIEW, ((username, anime_uid, reviews[(username, anime_uid)])
+                                     for username, anime_uid in
+                                     keys[start:start + IMPORT_BATCH_SIZE]))
+
+    def close(self) -> None:
+        """Close the connection to the database."""
+        with self._lock:
+            self._connection.close()
+
+
+def _read_rows(filepath: str) -> Iterable[list[str]]:
+    """Returns an iterator over the rows of the given CSV file, without its header."""
+    with open(filepath, 'r', encoding="utf8") as file:
+        reader = csv.reader(file)
+
+        # Skip the header
+        next(reader, None)
+
+        yield from reader
+
+
+def _convert_user_row_data_types(row: list) -> None:
+    """Convert a row of user data in the csv reader to the usable format by mutating this row.
+    This means:
+        - row[0] is a str (the username)
+        - row[1] becomes a str or None (The gender of the user)
+        - row[2] becomes a int or None (The birth year of the user)
+        - row[3] is a list of str (favorite animes) or an empty List
+    """
+    if row[1] == '':
+        row[1] = None
+
+    year = row[2][-4:]
+    if year.isnumeric():
+        row[2] = int(year)
+    else:
+        row[2] = None
+    fav_list = row[3][2:-2].split('\', \'')
+    if fav_list == ['']:
+        row[3] = []
+    else:
+        row[3] = [int(uid) for uid in fav_list]
+
+
+if __name__ == '__main__':
+    import time
+    from data_loader import create_anime_graph_from_storage
+
+    # Convert the CSV files into a database, and compare the loading times.
+    start = time.perf_counter()
+    database = SqliteStorage('Data/profiles.db')
+    database.import_csv('Data/profiles.csv', 'Data/reviews.csv')
+    print(f'import: {time.perf_counter() - start:.2f} s')
+    for storage in [CsvStorage('Data/profiles.csv', 'Data/reviews.csv'), database]:
+        start = time.perf_counter()
+        create_anime_graph_from_storage('Data/animes.csv', storage)
+        print(f'{type(storage).__name__} load: {time.perf_counter() - start:.2f} s')
+    database.close()
@@ -0,0 +1,80 @@
+"""CSC111 Final Project: My Anime Recommendations
+===============================================================
+The top_k module.
+
+This module contains the top-k selection functions used instead of
+sorting a whole list and keeping its first few elements: a heap for
+items that come one at a time, and a partition for scores that are
+already in an array, or that are cheap to put in one.
+
+Ties are broken deterministically: by the order of the input, or by
+a given secondary key. So each function returns exactly what the
+corresponding stable sort followed by a slice would return.
+================================================================
+@author: Tu Pham
+"""
+import heapq
+from typing import Any, Callable, Hashable, Iterable, Optional, TypeVar
+
+import numpy as np
+
+_T = TypeVar('_T')
+
+
+def top_k(items: Iterable[_T], k: int, key: Optional[Callable[[_T], Any]] = None,
+          largest: bool = True) -> list[_T]:
+    """Returns the k items with the largest keys, or the smallest if largest is False, in
+    order, with a heap of k items. Ties keep their order in the input.
+    It returns the same list as sorted(items, key=key, reverse=largest)[:k], and only
+    iterates over the items once.
+    """
+    if k <= 0:
+        return []
+    elif largest:
+        return heapq.nlargest(k, items, key)
+    else:
+        return heapq.nsmallest(k, items, key)
+
+
+def top_k_indices(scores: np.ndarray, k: int, largest: bool = True,
+                  ties: Optional[np.ndarray] = None) -> np.ndarray:
+    """Returns the indices of the k largest scores, or the smallest if largest is False, in
+    order. Ties are broken by the smaller value of ties at the same indices, or by the
+    smaller index if ties is None. NaN scores come last.
+
+    The scores are partitioned around the k-th best score first, so only the scores at
+    least as good as it are sorted.
+    """
+    scores = np.asarray(scores)
+    if scores.dtype.kind in 'ub':
+        scores = scores.astype(np.int64)
+    k = max(0, min(k, len(scores)))
+    if k == 0:
+        return np.zeros(0, np.int64)
+    keys = -scores if largest else scores
+
+    candidates = None
+    if k < len(keys):
+        kth = np.partition(keys, k - 1)[k - 1]
+        if not (keys.dtype.kind == 'f' and np.isnan(kth)):
+            # Every score tied with the k-th best one is kept, so the ties are broken below.
+            candidates = np.flatnonzero(keys <= kth)
+    if candidates is None:
+        candidates = np.arange(len(keys))
+    secondary = candidates if ties is None else np.asarray(ties)[candidates]
+    return candidates[np.lexsort((secondary, keys[candidates]))[:k]]
+
+
+def top_k_keys(mapping: dict[Hashable, float], k: int, largest: bool = True) -> list[Hashable]:
+    """Returns the k keys of the given mapping with the largest values, or the smallest if
+    largest is False, in order. Ties keep the insertion order of the mapping.
+    It returns the same list as sorted(mapping, key=mapping.get, reverse=largest)[:k].
+
+    Preconditions:
+        - all(isinstance(value, (int, float)) for value in mapping.values())
+    """
+    if k <= 0 or len(mapping) == 0:
+        return []
+    values = np.fromiter(mapping.values(), np.float64, len(mapping))
+    keys = list(mapping)
+    return [keys[i] for i in top_k_indices(values, k, largest).tolist()]